@@ -1,18 +1,29 @@
 """
 Dashboard one-shot para visualizar ISPs (sin foco en leads).
 
+La pagina se divide en fragmentos (`st.fragment`) segun el estado de filtros
+que usa cada seccion; un widget solo re-ejecuta su fragmento:
+- Pais (sidebar): todo depende de el, re-ejecuta la pagina completa.
+- Rango de usuarios y busqueda: KPIs, graficos y tabla (`render_filtered_section`).
+- Orden y pagina de la tabla: solo la tabla (`render_table`).
+- Operadores de la serie trimestral: solo la serie (`render_series`).
+El resumen por rango depende solo del pais y no se recalcula con el resto.
+
 Ejecucion:
     streamlit run dashboard_isp.py
 """
 from __future__ import annotations
 
+from io import BytesIO
 from pathlib import Path
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import streamlit as st
 
 import config
+from scripts.size_bands import SIZE_BAND_LABELS, size_band
 
 
 st.set_page_config(page_title="ISP Dashboard", page_icon=":bar_chart:", layout="wide")
@@ -25,8 +36,9 @@ def _choose_first_existing(paths: list[Path]) -> Path | None:
     return None
 
 
-@st.cache_data(show_spinner=False)
-def load_data() -> tuple[pd.DataFrame, pd.DataFrame]:
+@st.cache_data(show_spinner=False, max_entries=2)
+def load_data(version: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Tablas de empresas y leads; `version` (mtime de los CSV) es la llave de cache."""
     empresas_candidates = [
         config.FINAL_DATA_DIR / config.OUTPUT_EMPRESAS_TABLA_FILENAME,
         config.PROCESSED_DATA_DIR / config.OUTPUT_WHOIS_FILENAME,
@@ -72,15 +84,24 @@ def normalize_empresas(df: pd.DataFrame) -> pd.DataFrame:
     return out
 
 
-def build_filters(df: pd.DataFrame) -> tuple[pd.DataFrame, list[str], tuple[int, int], str]:
-    st.sidebar.header("Filtros")
+@st.cache_data(show_spinner=False, max_entries=4)
+def normalized_empresas(_df: pd.DataFrame, version: str) -> pd.DataFrame:
+    """`normalize_empresas` una vez por version del dataset (no en cada rerun)."""
+    return normalize_empresas(_df)
+
 
+def country_filter(df: pd.DataFrame) -> list[str]:
+    st.sidebar.header("Filtros")
     countries = sorted(df["pais"].dropna().unique().tolist())
-    selected_countries = st.sidebar.multiselect("Pais", options=countries, default=countries)
+    return st.sidebar.multiselect("Pais", options=countries, default=countries)
+
 
+def detail_filters(df: pd.DataFrame) -> tuple[tuple[int, int], str]:
+    """Rango de usuarios y busqueda; viven en el fragmento que los usa (no en el sidebar)."""
+    left, right = st.columns([2, 1])
     min_users = int(df["usuarios"].min()) if len(df) else 0
     max_users = int(df["usuarios"].max()) if len(df) else 0
-    users_range = st.sidebar.slider(
+    users_range = left.slider(
         "Rango de usuarios",
         min_value=min_users,
         max_value=max_users if max_users > min_users else min_users + 1,
@@ -88,16 +109,22 @@ def build_filters(df: pd.DataFrame) -> tuple[pd.DataFrame, list[str], tuple[int,
         step=max(1, (max_users - min_users) // 100 if max_users > min_users else 1),
     )
 
-    search = st.sidebar.text_input("Buscar empresa (contiene)", value="").strip().lower()
+    search = right.text_input("Buscar empresa (contiene)", value="").strip().lower()
+    return tuple(users_range), search
 
-    filtered = df.copy()
-    if selected_countries:
-        filtered = filtered.loc[filtered["pais"].isin(selected_countries)]
-    filtered = filtered.loc[filtered["usuarios"].between(users_range[0], users_range[1])]
-    if search:
-        filtered = filtered.loc[filtered["empresa"].str.lower().str.contains(search, na=False)]
 
-    return filtered, selected_countries, users_range, search
+def apply_filters(
+    df: pd.DataFrame,
+    countries: list[str],
+    users_range: tuple[int, int],
+    search: str,
+) -> pd.DataFrame:
+    mask = df["usuarios"].between(users_range[0], users_range[1])
+    if countries:
+        mask &= df["pais"].isin(countries)
+    if search:
+        mask &= df["empresa"].str.lower().str.contains(search, na=False)
+    return df.loc[mask]
 
 
 def count_leads(leads_df: pd.DataFrame, filtered_empresas: pd.DataFrame) -> int:
@@ -125,37 +152,34 @@ def render_metrics(all_df: pd.DataFrame, filtered_df: pd.DataFrame, selected_cou
     c3.metric("Leads identificados", f"{num_leads:,}")
 
 
-def render_range_summary_table(all_df: pd.DataFrame, selected_countries: list[str]) -> None:
-    """
-    Muestra tabla de resumen por rangos de usuarios aplicando filtro de pais.
-    """
-    base = all_df.copy()
-    if selected_countries:
-        base = base.loc[base["pais"].isin(selected_countries)].copy()
+# Entradas por agregado derivado en el memo (LRU acotado por st.cache_data).
+MEMO_MAX_ENTRIES = 64
 
-    if base.empty:
-        st.info("Sin datos para tabla resumen por rango.")
-        return
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def range_binned(_all_df: pd.DataFrame, version: str) -> pd.DataFrame:
+    """Empresas unicas por pais/id con su `Rango`; una vez por carga de dataset."""
     # Unico por empresa/pais para evitar duplicados.
     base = (
-        base.sort_values("usuarios", ascending=False)
-        .drop_duplicates(subset=["pais", "id_empresa"], keep="first")
+        _all_df.sort_values("usuarios", ascending=False)
+        .drop_duplicates(subset=["pais", "id_empresa"], keep="first")[["pais", "id_empresa", "usuarios"]]
         .copy()
     )
+    base["Rango"] = size_band(base["usuarios"])
+    return base
 
-    labels = ["0 a 1000", "1001 a 5000", "5001 a 10000", "10001 a 100000", "100000+"]
-    bins = [-0.001, 1000, 5000, 10000, 100000, float("inf")]
-    base["Rango"] = pd.cut(
-        base["usuarios"],
-        bins=bins,
-        labels=labels,
-        include_lowest=True,
-        right=True,
-    )
+
+@st.cache_data(show_spinner=False, max_entries=MEMO_MAX_ENTRIES)
+def range_summary(_all_df: pd.DataFrame, version: str, countries: tuple[str, ...]) -> pd.DataFrame:
+    """Tabla resumen por rango; depende solo del set de paises (no de rango ni busqueda)."""
+    base = range_binned(_all_df, version)
+    if countries:
+        base = base.loc[base["pais"].isin(countries)]
+    if base.empty:
+        return pd.DataFrame()
 
     summary = (
-        base.groupby("Rango", as_index=False)
+        base.groupby("Rango", as_index=False, observed=False)
         .agg(
             **{
                 "Num. ISPs": ("id_empresa", "nunique"),
@@ -163,7 +187,7 @@ def render_range_summary_table(all_df: pd.DataFrame, selected_countries: list[st
             }
         )
     )
-    summary["Rango"] = pd.Categorical(summary["Rango"], categories=labels, ordered=True)
+    summary["Rango"] = pd.Categorical(summary["Rango"], categories=SIZE_BAND_LABELS, ordered=True)
     summary = summary.sort_values("Rango").fillna({"Num. ISPs": 0, "Num. usuarios": 0})
 
     total_users = float(summary["Num. usuarios"].sum()) if len(summary) else 0.0
@@ -185,23 +209,62 @@ def render_range_summary_table(all_df: pd.DataFrame, selected_countries: list[st
     table_display = table.copy()
     table_display["Num. usuarios"] = table_display["Num. usuarios"].map(lambda x: f"{int(round(x)):,}")
     table_display["Market share"] = table_display["Market share"].map(lambda x: f"{x:.1f}%")
+    return table_display
+
+
+@st.cache_data(show_spinner=False, max_entries=MEMO_MAX_ENTRIES)
+def chart_aggregates(
+    _filtered_df: pd.DataFrame,
+    version: str,
+    countries: tuple[str, ...],
+    users_range: tuple[int, int],
+    search: str,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Top 20 empresas y usuarios por pais para la seleccion (llave = estado de filtros)."""
+    top_n = min(20, len(_filtered_df))
+    top_df = (
+        _filtered_df.groupby("empresa", as_index=False)["usuarios"]
+        .sum()
+        .sort_values("usuarios", ascending=False)
+        .head(top_n)
+    )
+    by_country = (
+        _filtered_df.groupby("pais", as_index=False)["usuarios"].sum().sort_values("usuarios", ascending=False)
+    )
+    return top_df, by_country
+
+
+def render_range_summary_table(all_df: pd.DataFrame, selected_countries: list[str], version: str) -> None:
+    """
+    Muestra tabla de resumen por rangos de usuarios aplicando filtro de pais.
+    """
+    table_display = range_summary(all_df, version, tuple(sorted(selected_countries)))
+    if table_display.empty:
+        st.info("Sin datos para tabla resumen por rango.")
+        return
 
     st.subheader("Resumen por rango de usuarios")
     st.dataframe(table_display, use_container_width=True, hide_index=True)
 
 
-def render_charts(filtered_df: pd.DataFrame) -> None:
+@st.cache_data(show_spinner=False, max_entries=MEMO_MAX_ENTRIES)
+def country_pie_png(by_country: pd.DataFrame) -> bytes:
+    """Torta de usuarios por pais como PNG (una figura por distribucion distinta)."""
+    fig, ax = plt.subplots(figsize=(6, 6))
+    ax.pie(by_country["usuarios"], labels=by_country["pais"], autopct="%1.1f%%", startangle=90)
+    ax.axis("equal")
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def render_charts(filtered_df: pd.DataFrame, version: str, selection: tuple) -> None:
+    top_df, by_country = chart_aggregates(filtered_df, version, *selection)
     left, right = st.columns(2)
 
     with left:
         st.subheader("Top empresas por usuarios")
-        top_n = min(20, len(filtered_df))
-        top_df = (
-            filtered_df.groupby("empresa", as_index=False)["usuarios"]
-            .sum()
-            .sort_values("usuarios", ascending=False)
-            .head(top_n)
-        )
         if top_df.empty:
             st.info("Sin datos para graficar.")
         else:
@@ -209,53 +272,207 @@ def render_charts(filtered_df: pd.DataFrame) -> None:
 
     with right:
         st.subheader("Distribucion de usuarios por pais")
-        by_country = (
-            filtered_df.groupby("pais", as_index=False)["usuarios"].sum().sort_values("usuarios", ascending=False)
-        )
         if by_country.empty:
             st.info("Sin datos para graficar.")
         else:
-            fig, ax = plt.subplots(figsize=(6, 6))
-            ax.pie(by_country["usuarios"], labels=by_country["pais"], autopct="%1.1f%%", startangle=90)
-            ax.axis("equal")
-            st.pyplot(fig)
+            st.image(country_pie_png(by_country))
 
 
-def render_table(filtered_df: pd.DataFrame) -> None:
-    st.subheader("Tabla de ISPs")
-    cols = [
-        "pais",
-        "id_empresa",
-        "empresa",
-        "usuarios",
-        "whois_asn",
-        "whois_owner",
+CUBE_FILENAME = "cubo_accesos_trimestral.parquet"
+
+
+@st.cache_resource(show_spinner=False)
+def load_cube(version: str) -> dict | None:
+    """
+    Cubo trimestral (salida de calculate_icp) indexado para lookups.
+
+    Se carga una vez por version; cambiar de operador es un `.loc` sobre el
+    indice (pais, id_operador), sin releer ni re-agregar datos crudos.
+    """
+    path = config.PROCESSED_DATA_DIR / CUBE_FILENAME
+    if not path.exists():
+        return None
+    cube = pd.read_parquet(path)
+    cube["periodo"] = cube["periodo"].astype(str)
+    by_country = cube.pivot_table(
+        index="periodo", columns="pais", values="num_accesos", aggfunc="sum", observed=True
+    ).sort_index()
+    operators = (
+        cube[["pais", "id_operador", "operador"]]
+        .drop_duplicates(subset=["pais", "id_operador"], keep="last")
+        .astype(str)
+        .sort_values(["pais", "operador"])
+        .reset_index(drop=True)
+    )
+    indexed = cube.astype({"pais": str, "id_operador": str}).set_index(["pais", "id_operador"]).sort_index()
+    return {"by_country": by_country, "operators": operators, "indexed": indexed}
+
+
+@st.fragment
+def render_series(selected_countries: list[str], version: str) -> None:
+    st.subheader("Evolucion trimestral de accesos")
+    cube = load_cube(version)
+    if cube is None:
+        st.info(f"Sin cubo trimestral ({CUBE_FILENAME}). Ejecuta scripts/calculate_icp.py.")
+        return
+
+    by_country = cube["by_country"]
+    countries = [c for c in by_country.columns if not selected_countries or c in selected_countries]
+    left, right = st.columns(2)
+    with left:
+        st.caption("Total por pais")
+        if countries:
+            st.line_chart(by_country[countries])
+        else:
+            st.info("Sin datos para graficar.")
+
+    with right:
+        operators = cube["operators"]
+        if selected_countries:
+            operators = operators.loc[operators["pais"].isin(selected_countries)]
+        # Opciones con llave estable "pais|id_operador": una seleccion no cambia de operador al filtrar paises.
+        options = (operators["pais"] + "|" + operators["id_operador"]).tolist()
+        labels = dict(zip(options, operators["operador"] + " (" + operators["pais"] + ")"))
+        chosen = st.multiselect("Operadores", options=options, format_func=labels.get, max_selections=8)
+        if not chosen:
+            st.caption("Selecciona operadores para ver su trayectoria.")
+            return
+        series = {}
+        for key in chosen:
+            rows = cube["indexed"].loc[[tuple(key.split("|", 1))]]
+            series[labels[key]] = rows.groupby("periodo")["num_accesos"].sum()
+        st.line_chart(pd.DataFrame(series).sort_index())
+
+
+TABLE_COLUMNS = [
+    "pais",
+    "id_empresa",
+    "empresa",
+    "usuarios",
+    "whois_asn",
+    "whois_owner",
+]
+SORT_OPTIONS = {
+    "Usuarios (mayor a menor)": (["usuarios", "pais", "empresa"], [False, True, True]),
+    "Usuarios (menor a mayor)": (["usuarios", "pais", "empresa"], [True, True, True]),
+    "Empresa (A-Z)": (["empresa", "pais"], [True, True]),
+    "Pais": (["pais", "usuarios", "empresa"], [True, False, True]),
+}
+PAGE_SIZES = [25, 50, 100, 250]
+
+
+def dataset_version() -> str:
+    """Version del dataset (mtime de los archivos fuente) para invalidar caches derivados."""
+    paths = [
+        config.FINAL_DATA_DIR / config.OUTPUT_EMPRESAS_TABLA_FILENAME,
+        config.PROCESSED_DATA_DIR / config.OUTPUT_WHOIS_FILENAME,
+        config.PROCESSED_DATA_DIR / config.OUTPUT_ICP_FILENAME,
+        config.FINAL_DATA_DIR / config.OUTPUT_LEADS_FILENAME,
+        config.PROCESSED_DATA_DIR / CUBE_FILENAME,
     ]
-    cols = [c for c in cols if c in filtered_df.columns]
-    table = filtered_df[cols].copy()
-    table = table.sort_values(["usuarios", "pais", "empresa"], ascending=[False, True, True])
-    st.dataframe(table, use_container_width=True, height=500)
+    return "|".join(f"{p.name}:{p.stat().st_mtime_ns}" for p in paths if p.exists())
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def presorted_positions(_df: pd.DataFrame, version: str, sort_label: str) -> np.ndarray:
+    """
+    Posiciones de `_df` ordenadas segun `sort_label`.
+
+    Se calcula una vez por dataset y criterio (`version` es la llave; el
+    DataFrame no se hashea). Filtrar despues conserva el orden sin re-ordenar.
+    """
+    by, ascending = SORT_OPTIONS[sort_label]
+    by = [c for c in by if c in _df.columns]
+    ordered = _df.reset_index(drop=True).sort_values(by, ascending=ascending[: len(by)], kind="stable")
+    return ordered.index.to_numpy()
+
+
+def filtered_order(all_df: pd.DataFrame, filtered_df: pd.DataFrame, version: str, sort_label: str) -> np.ndarray:
+    """Posiciones (sobre `all_df`) de las filas filtradas, en el orden pre-calculado."""
+    order = presorted_positions(all_df, version, sort_label)
+    mask = all_df.index.isin(filtered_df.index)
+    return order[mask[order]]
+
+
+@st.fragment
+def render_table(all_df: pd.DataFrame, filtered_df: pd.DataFrame, version: str) -> None:
+    st.subheader("Tabla de ISPs")
+    cols = [c for c in TABLE_COLUMNS if c in all_df.columns]
+
+    c1, c2, c3 = st.columns([2, 1, 1])
+    sort_label = c1.selectbox("Ordenar por", options=list(SORT_OPTIONS), index=0)
+    page_size = c2.selectbox("Filas por pagina", options=PAGE_SIZES, index=1)
+
+    positions = filtered_order(all_df, filtered_df, version, sort_label)
+    total_rows = len(positions)
+    total_pages = max(1, -(-total_rows // page_size))
+    # La llave depende del total: al cambiar filtros se vuelve a la pagina 1.
+    page = c3.number_input("Pagina", min_value=1, max_value=total_pages, value=1, step=1, key=f"page_{total_pages}")
+
+    # Solo la pagina visible se serializa al navegador.
+    start = (int(page) - 1) * page_size
+    page_df = all_df.iloc[positions[start : start + page_size]][cols]
+    st.dataframe(page_df, use_container_width=True, hide_index=True)
+    st.caption(f"Filas {start + 1 if total_rows else 0}-{min(start + page_size, total_rows)} de {total_rows:,}")
+
+    def _csv_bytes() -> bytes:
+        # Se genera solo al hacer click (no en cada rerun de la tabla).
+        return all_df.iloc[positions][cols].to_csv(index=False).encode("utf-8")
+
+    st.download_button(
+        "Descargar CSV (resultado filtrado)",
+        data=_csv_bytes,
+        file_name="isps_filtrados.csv",
+        mime="text/csv",
+        on_click="ignore",
+    )
+
+
+@st.fragment
+def render_filtered_section(
+    all_df: pd.DataFrame,
+    leads_df: pd.DataFrame,
+    selected_countries: list[str],
+    version: str,
+) -> None:
+    """
+    KPIs, graficos y tabla: dependen de pais, rango de usuarios y busqueda.
+
+    Mover el rango o escribir en la busqueda re-ejecuta solo este fragmento;
+    los argumentos (dataset, paises) quedan fijados por la ultima corrida completa.
+    """
+    users_range, search = detail_filters(all_df)
+    filtered = apply_filters(all_df, selected_countries, users_range, search)
+    # Estado de seleccion: llave de los agregados memoizados.
+    selection = (tuple(sorted(selected_countries)), users_range, search)
+
+    render_metrics(all_df, filtered, selected_countries, leads_df)
+    st.divider()
+    render_charts(filtered, version, selection)
+    st.divider()
+    render_table(all_df, filtered, version)
 
 
 def main() -> None:
     st.title("Dashboard ISPs")
     st.caption("Visualizacion pragmatica de empresas ISP (sin foco en tabla de leads).")
 
+    version = dataset_version()
     try:
-        empresas_raw, leads_raw = load_data()
+        empresas_raw, leads_raw = load_data(version)
     except Exception as exc:
         st.error(str(exc))
         st.stop()
 
-    empresas = normalize_empresas(empresas_raw)
-    filtered, selected_countries, _, _ = build_filters(empresas)
+    empresas = normalized_empresas(empresas_raw, version)
+    selected_countries = country_filter(empresas)
 
-    render_metrics(empresas, filtered, selected_countries, leads_raw)
-    render_range_summary_table(empresas, selected_countries)
+    render_filtered_section(empresas, leads_raw, selected_countries, version)
     st.divider()
-    render_charts(filtered)
+    # Sin widgets propios: solo se recalcula (memo por paises) en corridas completas.
+    render_range_summary_table(empresas, selected_countries, version)
     st.divider()
-    render_table(filtered)
+    render_series(selected_countries, version)
 
 
 if __name__ == "__main__":
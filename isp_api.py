@@ -0,0 +1,273 @@
+"""
+API JSON de solo lectura sobre las mismas tablas del dashboard.
+
+Ejecucion:
+    python isp_api.py --port 8502
+
+Endpoints (GET):
+- /operadores?pais=COL,PER&banda=1001 a 5000&prefijo=tele&limit=100&offset=0
+- /resumen: empresas y usuarios por pais y banda.
+- /leads: leads identificados por pais.
+- /version: version del dataset.
+
+Las respuestas se precalculan por version del dataset (mtime de los CSV) y
+llevan ETag: un `If-None-Match` con el ETag vigente responde 304 sin armar
+el cuerpo.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import streamlit.logger
+
+# Fuera de `streamlit run` los caches avisan que no hay runtime; no aplica aca.
+# Debe ir antes de importar el dashboard (los avisos salen al decorar).
+streamlit.logger.set_log_level("error")
+
+from dashboard_isp import (  # noqa: E402
+    TABLE_COLUMNS,
+    count_leads,
+    dataset_version,
+    load_data,
+    normalize_empresas,
+)
+from scripts.size_bands import SIZE_BAND_LABELS, size_band  # noqa: E402
+
+API_PORT = 8502
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# Respuestas filtradas memoizadas por version (LRU).
+MAX_CACHED_RESPONSES = 256
+# Cada cuanto se revisa el mtime de los archivos.
+VERSION_CHECK_SECONDS = 2.0
+
+
+def _json_bytes(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _etag(version: str, key: str) -> str:
+    return '"' + hashlib.sha1(f"{version}|{key}".encode("utf-8")).hexdigest()[:20] + '"'
+
+
+class _Snapshot:
+    """Tablas y respuestas de una version del dataset."""
+
+    def __init__(self, version: str):
+        self.version = version
+        empresas_raw, leads = load_data(version)
+        empresas = normalize_empresas(empresas_raw)
+        self.operadores = self._operators_table(empresas)
+        self.responses: OrderedDict[str, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+        self._fixed = {
+            "/resumen": _json_bytes(self._summary(self.operadores)),
+            "/leads": _json_bytes(self._leads(empresas, leads)),
+            "/version": _json_bytes({"version": version}),
+        }
+
+    @staticmethod
+    def _operators_table(empresas: pd.DataFrame) -> pd.DataFrame:
+        columns = [c for c in TABLE_COLUMNS if c in empresas.columns]
+        table = (
+            empresas.sort_values("usuarios", ascending=False)
+            .drop_duplicates(subset=["pais", "id_empresa"], keep="first")[columns]
+            .copy()
+        )
+        table["banda"] = size_band(table["usuarios"]).astype(str)
+        table["_nombre"] = table["empresa"].str.lower()
+        return table.sort_values(["usuarios", "pais", "empresa"], ascending=[False, True, True]).reset_index(drop=True)
+
+    @staticmethod
+    def _summary(operadores: pd.DataFrame) -> dict:
+        by_country = operadores.groupby("pais").agg(num_isps=("id_empresa", "nunique"), usuarios=("usuarios", "sum"))
+        by_band = (
+            operadores.groupby(["pais", "banda"]).agg(num_isps=("id_empresa", "nunique"), usuarios=("usuarios", "sum"))
+        )
+        countries = []
+        for pais, row in by_country.iterrows():
+            bands = by_band.loc[pais] if pais in by_band.index.get_level_values(0) else pd.DataFrame()
+            countries.append(
+                {
+                    "pais": pais,
+                    "num_isps": int(row["num_isps"]),
+                    "usuarios": float(row["usuarios"]),
+                    "bandas": [
+                        {
+                            "banda": label,
+                            "num_isps": int(bands.loc[label, "num_isps"]) if label in bands.index else 0,
+                            "usuarios": float(bands.loc[label, "usuarios"]) if label in bands.index else 0.0,
+                        }
+                        for label in SIZE_BAND_LABELS
+                    ],
+                }
+            )
+        return {"paises": countries}
+
+    @staticmethod
+    def _leads(empresas: pd.DataFrame, leads: pd.DataFrame) -> dict:
+        per_country = {
+            pais: count_leads(leads, group) for pais, group in empresas.groupby("pais")
+        }
+        return {"total": int(sum(per_country.values())), "por_pais": per_country}
+
+    def fixed(self, path: str) -> bytes | None:
+        return self._fixed.get(path)
+
+    def operators(self, key: str, params: dict) -> bytes:
+        with self.lock:
+            if key in self.responses:
+                self.responses.move_to_end(key)
+                return self.responses[key]
+
+        table = self.operadores
+        if params["pais"]:
+            table = table.loc[table["pais"].isin(params["pais"])]
+        if params["banda"]:
+            table = table.loc[table["banda"].isin(params["banda"])]
+        if params["prefijo"]:
+            table = table.loc[table["_nombre"].str.startswith(params["prefijo"])]
+        page = table.iloc[params["offset"] : params["offset"] + params["limit"]].drop(columns=["_nombre"])
+        body = _json_bytes(
+            {
+                "total": int(len(table)),
+                "offset": params["offset"],
+                "limit": params["limit"],
+                "operadores": page.astype(object).where(page.notna(), None).to_dict(orient="records"),
+            }
+        )
+
+        with self.lock:
+            self.responses[key] = body
+            while len(self.responses) > MAX_CACHED_RESPONSES:
+                self.responses.popitem(last=False)
+        return body
+
+
+_snapshot: _Snapshot | None = None
+_snapshot_lock = threading.Lock()
+_version_checked = 0.0
+_version = ""
+
+
+def current_version() -> str:
+    global _version, _version_checked
+    now = time.monotonic()
+    if now - _version_checked > VERSION_CHECK_SECONDS:
+        _version = dataset_version()
+        _version_checked = now
+    return _version
+
+
+def get_snapshot(version: str) -> _Snapshot:
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = _Snapshot(version)
+        return _snapshot
+
+
+def _split(values: list[str]) -> list[str]:
+    return sorted({item.strip() for value in values for item in value.split(",") if item.strip()})
+
+
+def parse_operator_params(query: dict[str, list[str]]) -> tuple[str, dict]:
+    """Parametros normalizados y su llave canonica (misma consulta -> misma llave)."""
+    try:
+        limit = min(max(int(query.get("limit", [DEFAULT_LIMIT])[0]), 1), MAX_LIMIT)
+        offset = max(int(query.get("offset", [0])[0]), 0)
+    except ValueError as exc:
+        raise ValueError("limit/offset deben ser enteros") from exc
+    params = {
+        "pais": [value.upper() for value in _split(query.get("pais", []))],
+        "banda": _split(query.get("banda", [])),
+        "prefijo": query.get("prefijo", [""])[0].strip().lower(),
+        "limit": limit,
+        "offset": offset,
+    }
+    unknown = set(params["banda"]) - set(SIZE_BAND_LABELS)
+    if unknown:
+        raise ValueError(f"Banda desconocida: {sorted(unknown)}. Opciones: {SIZE_BAND_LABELS}")
+    return json.dumps(params, sort_keys=True, ensure_ascii=False), params
+
+
+def handle_request(path: str, query: dict[str, list[str]], if_none_match: str | None) -> tuple[int, dict, bytes]:
+    """Resuelve una peticion GET: (status, headers, cuerpo)."""
+    if path not in {"/operadores", "/resumen", "/leads", "/version"}:
+        return 404, {}, _json_bytes({"error": f"Ruta no encontrada: {path}"})
+
+    key = path
+    params = None
+    if path == "/operadores":
+        try:
+            query_key, params = parse_operator_params(query)
+        except ValueError as exc:
+            return 400, {}, _json_bytes({"error": str(exc)})
+        key = f"{path}?{query_key}"
+
+    version = current_version()
+    etag = _etag(version, key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and etag in {tag.strip() for tag in if_none_match.split(",")}:
+        return 304, headers, b""
+
+    snapshot = get_snapshot(version)
+    body = snapshot.operators(key, params) if params is not None else snapshot.fixed(path)
+    return 200, headers, body
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "ISPApi/1.0"
+
+    def do_GET(self) -> None:  # noqa: N802 (nombre exigido por BaseHTTPRequestHandler)
+        parsed = urlparse(self.path)
+        try:
+            status, headers, body = handle_request(
+                parsed.path.rstrip("/") or "/", parse_qs(parsed.query), self.headers.get("If-None-Match")
+            )
+        except Exception as exc:
+            status, headers, body = 500, {}, _json_bytes({"error": str(exc)})
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        print(f"{self.address_string()} - {format % args}")
+
+
+def serve(host: str = "0.0.0.0", port: int = API_PORT) -> None:
+    # Precalcula la version actual antes de aceptar conexiones.
+    get_snapshot(current_version())
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    print(f"API ISP escuchando en http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="API JSON de solo lectura sobre las tablas ICP.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args()
+
+    serve(host=args.host, port=args.port)
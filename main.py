@@ -1,7 +1,7 @@
 """
 Pipeline multicountry: ICP + WHOIS + tablas finales.
 """
-from scripts import calculate_icp, enrich, split_tables
+from scripts import artifacts, calculate_icp, enrich, metrics, split_tables
 
 
 def run_pipeline() -> None:
@@ -10,18 +10,37 @@ def run_pipeline() -> None:
     print(" PIPELINE MULTICOUNTRY - ICP + WHOIS")
     print("=" * 70 + "\n")
 
+    # Progreso cada 10s en consola y data_ISPs/processed/pipeline_metrics.prom.
+    metrics.start_reporter()
+
+    # Las etapas se pasan DataFrames en memoria; los CSV se escriben en segundo plano.
     print("PASO 1: Calculo ICP (COL/ECU/PER)...")
-    calculate_icp.run(include_colombia=True, include_ecuador=True, include_peru=True)
+    icp_operadores, _ = calculate_icp.run(
+        include_colombia=True,
+        include_ecuador=True,
+        include_peru=True,
+        background_writes=True,
+    )
 
     print("\n" + "-" * 70 + "\n")
 
     print("PASO 2: Enriquecimiento WHOIS (rango ICP 1.000 a 100.000)...")
-    enrich.run(only_icp=True, min_max_accesos=1000, max_max_accesos=100000)
+    enriched = enrich.run(
+        only_icp=True,
+        min_max_accesos=1000,
+        max_max_accesos=100000,
+        df_icp=icp_operadores,
+        background_writes=True,
+    )
 
     print("\n" + "-" * 70 + "\n")
 
     print("PASO 3: Separacion de tablas (empresas y leads)...")
-    split_tables.run()
+    # Sin candidatos enrich no produce salida: split_tables usa el CSV existente.
+    split_tables.run(df=enriched if not enriched.empty else None, background_writes=True)
+
+    written = artifacts.flush()
+    print(f"\nArtefactos escritos: {len(written)}")
 
     print("\n" + "=" * 70)
     print(" PIPELINE COMPLETADO")
@@ -30,4 +49,3 @@ def run_pipeline() -> None:
 
 if __name__ == "__main__":
     run_pipeline()
-
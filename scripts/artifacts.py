@@ -0,0 +1,61 @@
+"""
+Persistencia de artefactos (CSV y parquet) del pipeline.
+
+Cuando las etapas corren desde main.py los DataFrames se pasan en memoria
+entre etapas y los CSV se escriben en segundo plano (solo como artefacto,
+no como transporte). `flush()` espera las escrituras pendientes y propaga
+cualquier error.
+"""
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+from pathlib import Path
+import threading
+
+import pandas as pd
+
+
+_executor: ThreadPoolExecutor | None = None
+_pending: list[Future] = []
+_lock = threading.Lock()
+
+
+def _write_csv(df: pd.DataFrame, path: Path, kwargs: dict) -> Path:
+    # Escritura atomica: quien lea el archivo nunca ve un CSV a medias.
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    df.to_csv(tmp_path, **kwargs)
+    os.replace(tmp_path, path)
+    return path
+
+
+def persist_parquet(df: pd.DataFrame, path: Path, **to_parquet_kwargs) -> Path:
+    """Guarda `df` como parquet con escritura atomica (tmp + os.replace)."""
+    to_parquet_kwargs.setdefault("index", False)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    df.to_parquet(tmp_path, **to_parquet_kwargs)
+    os.replace(tmp_path, path)
+    return path
+
+
+def persist_csv(df: pd.DataFrame, path: Path, background: bool = False, **to_csv_kwargs) -> Future | Path:
+    """Guarda `df` en `path`; con `background=True` lo encola en un hilo escritor."""
+    to_csv_kwargs.setdefault("index", False)
+    if not background:
+        return _write_csv(df, path, to_csv_kwargs)
+
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="artifacts")
+        future = _executor.submit(_write_csv, df, path, to_csv_kwargs)
+        _pending.append(future)
+    return future
+
+
+def flush() -> list[Path]:
+    """Espera todas las escrituras en segundo plano; relanza el primer error."""
+    with _lock:
+        pending = list(_pending)
+        _pending.clear()
+    return [future.result() for future in pending]
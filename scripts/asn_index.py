@@ -0,0 +1,235 @@
+"""
+Resolucion offline de ASN a partir de dumps locales AS -> organizacion.
+
+Fuentes soportadas (descargadas a mano en data_ISPs/raw/asn/):
+- as2org de CAIDA (`*.as-org2info.txt[.gz]`): bloques `aut|...` y `org_id|...`.
+- Estadisticas extendidas de RIR (`delegated-lacnic-extended-latest`):
+  aportan pais por ASN y se cruzan con as2org por numero de ASN (`asn`);
+  el pais del RIR reemplaza al de as2org.
+- CSV simple con columnas `asn,nombre[,pais]` para listas curadas.
+
+El indice invertido va de token normalizado -> filas, y la consulta
+rankea candidatos por solapamiento ponderado (IDF) + similitud de nombre.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from difflib import SequenceMatcher
+from functools import lru_cache
+import gzip
+import math
+from pathlib import Path
+import sys
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+import config
+from scripts.entity_resolution import blocking_keys
+from scripts.extract_utils import normalize_operator_name
+
+
+ASN_DATA_DIR = config.RAW_DATA_DIR / "asn"
+MIN_SCORE = 0.75
+COUNTRY_ISO2 = {"COL": "CO", "ECU": "EC", "PER": "PE"}
+
+
+def _open_text(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def load_as2org(path: Path) -> pd.DataFrame:
+    """Lee un archivo as2org (formato CAIDA) y devuelve asn/nombre/pais/opaque_id."""
+    orgs: dict[str, tuple[str, str]] = {}
+    auts: list[tuple[str, str, str, str]] = []
+    section = None
+    with _open_text(path) as handle:
+        for line in handle:
+            line = line.rstrip("\n")
+            if line.startswith("# format:"):
+                section = "aut" if line.startswith("# format:aut") else "org"
+                continue
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split("|")
+            if section == "org" and len(parts) >= 4:
+                # org_id|changed|org_name|country|source
+                orgs[parts[0]] = (parts[2], parts[3])
+            elif section == "aut" and len(parts) >= 4:
+                # aut|changed|aut_name|org_id|opaque_id|source
+                opaque_id = parts[4] if len(parts) >= 5 else ""
+                auts.append((parts[0], parts[2], parts[3], opaque_id))
+
+    rows = []
+    for asn, aut_name, org_id, opaque_id in auts:
+        org_name, country = orgs.get(org_id, ("", ""))
+        rows.append(
+            {
+                "asn": f"AS{asn}",
+                "nombre": org_name or aut_name,
+                "pais": country,
+                "opaque_id": opaque_id,
+            }
+        )
+    return pd.DataFrame(rows, columns=["asn", "nombre", "pais", "opaque_id"])
+
+
+def load_rir_delegation(path: Path) -> pd.DataFrame:
+    """Lee estadisticas extendidas de RIR (solo filas asn) y expande rangos."""
+    rows = []
+    with _open_text(path) as handle:
+        for line in handle:
+            if line.startswith("#"):
+                continue
+            parts = line.strip().split("|")
+            # registry|cc|type|start|value|date|status[|opaque_id]
+            if len(parts) < 7 or parts[2] != "asn" or parts[1] in {"", "*"}:
+                continue
+            if parts[6] not in {"allocated", "assigned"}:
+                continue
+            start, count = int(parts[3]), int(parts[4])
+            opaque_id = parts[7] if len(parts) >= 8 else ""
+            for asn in range(start, start + count):
+                rows.append({"asn": f"AS{asn}", "pais": parts[1], "opaque_id": opaque_id})
+    return pd.DataFrame(rows, columns=["asn", "pais", "opaque_id"])
+
+
+def load_dumps(data_dir: Path = ASN_DATA_DIR) -> pd.DataFrame:
+    """Consolida todos los dumps del directorio en asn/nombre/pais."""
+    if not data_dir.exists():
+        return pd.DataFrame(columns=["asn", "nombre", "pais"])
+
+    named_parts = []
+    delegations = []
+    for path in sorted(p for p in data_dir.iterdir() if p.is_file()):
+        name = path.name.lower()
+        if "as-org2info" in name or "as2org" in name:
+            named_parts.append(load_as2org(path))
+        elif name.startswith("delegated-"):
+            delegations.append(load_rir_delegation(path))
+        elif path.suffix.lower() == ".csv":
+            df = pd.read_csv(path, dtype=str)
+            df["asn"] = "AS" + df["asn"].str.upper().str.replace("AS", "", regex=False).str.strip()
+            if "pais" not in df.columns:
+                df["pais"] = ""
+            named_parts.append(df[["asn", "nombre", "pais"]].assign(opaque_id=""))
+
+    if not named_parts:
+        return pd.DataFrame(columns=["asn", "nombre", "pais"])
+
+    named = pd.concat(named_parts, ignore_index=True).fillna("")
+    if delegations:
+        # El RIR es la fuente autoritativa de pais por ASN.
+        delegated = pd.concat(delegations, ignore_index=True).drop_duplicates("asn")
+        named = named.merge(delegated[["asn", "pais"]], on="asn", how="left", suffixes=("", "_rir"))
+        named["pais"] = named["pais_rir"].fillna(named["pais"])
+        named = named.drop(columns=["pais_rir"])
+    named = named.loc[named["nombre"].astype(str).str.strip().ne("")]
+    return named.drop_duplicates(subset=["asn", "nombre"])[["asn", "nombre", "pais"]].reset_index(drop=True)
+
+
+def build_index(records: pd.DataFrame) -> dict:
+    """Construye el indice invertido token -> filas."""
+    names = records["nombre"].astype(str).tolist()
+    normalized = [normalize_operator_name(name) for name in names]
+    postings: dict[str, list[int]] = defaultdict(list)
+    for row_id, norm in enumerate(normalized):
+        for token in blocking_keys(norm):
+            postings[token].append(row_id)
+
+    total = max(len(normalized), 1)
+    idf = {token: math.log(1 + total / len(rows)) for token, rows in postings.items()}
+    weights = [sum(idf[token] for token in blocking_keys(norm)) for norm in normalized]
+    return {
+        "asn": records["asn"].astype(str).tolist(),
+        "nombre": names,
+        "pais": records["pais"].astype(str).str.upper().tolist(),
+        "normalizado": normalized,
+        "postings": dict(postings),
+        "idf": idf,
+        "peso": weights,
+    }
+
+
+def query_index(index: dict, operator_name: str, pais: str | None = None, top_n: int = 5) -> list[dict]:
+    """
+    Devuelve candidatos ASN rankeados para un nombre de operador.
+
+    Score = 0.6 * Jaccard ponderado por IDF + 0.4 * similitud de nombre,
+    con bonus si el pais del ASN coincide con el del operador.
+    """
+    query_norm = normalize_operator_name(operator_name)
+    tokens = blocking_keys(query_norm)
+    if not tokens:
+        return []
+
+    query_weight = sum(index["idf"].get(token, 0.0) for token in tokens)
+    if query_weight <= 0:
+        return []
+
+    overlap: dict[int, float] = defaultdict(float)
+    for token in tokens:
+        weight = index["idf"].get(token, 0.0)
+        for row_id in index["postings"].get(token, []):
+            overlap[row_id] += weight
+
+    country = COUNTRY_ISO2.get(str(pais or "").upper(), str(pais or "").upper())
+    candidates = []
+    for row_id, matched in overlap.items():
+        similarity = SequenceMatcher(None, query_norm, index["normalizado"][row_id]).ratio()
+        union_weight = query_weight + index["peso"][row_id] - matched
+        score = 0.6 * (matched / union_weight) + 0.4 * similarity
+        if country and index["pais"][row_id] == country:
+            score += 0.1
+        elif country and index["pais"][row_id]:
+            score -= 0.2
+        candidates.append(
+            {
+                "asn": index["asn"][row_id],
+                "nombre": index["nombre"][row_id],
+                "pais": index["pais"][row_id],
+                "score": round(min(score, 1.0), 4),
+            }
+        )
+
+    candidates.sort(key=lambda item: (-item["score"], item["asn"]))
+    return candidates[:top_n]
+
+
+@lru_cache(maxsize=1)
+def load_default_index() -> dict | None:
+    """Indice de los dumps en ASN_DATA_DIR (una sola carga por proceso)."""
+    records = load_dumps(ASN_DATA_DIR)
+    if records.empty:
+        return None
+    print(f"Indice ASN offline: {len(records)} registros desde {ASN_DATA_DIR}")
+    return build_index(records)
+
+
+def resolve_asn(operator_name: str, pais: str | None = None, min_score: float = MIN_SCORE) -> str | None:
+    """Mejor ASN offline si supera `min_score`; None si no hay dump o no hay match."""
+    index = load_default_index()
+    if index is None:
+        return None
+    candidates = query_index(index, operator_name, pais=pais, top_n=1)
+    if candidates and candidates[0]["score"] >= min_score:
+        return candidates[0]["asn"]
+    return None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Consulta el indice ASN offline.")
+    parser.add_argument("operador", help="Nombre del operador a resolver.")
+    parser.add_argument("--pais", default=None, help="COL/ECU/PER para priorizar ASN del pais.")
+    args = parser.parse_args()
+
+    idx = load_default_index()
+    if idx is None:
+        print(f"No hay dumps ASN en {ASN_DATA_DIR}")
+    else:
+        for candidate in query_index(idx, args.operador, pais=args.pais):
+            print(f"{candidate['asn']:>10}  {candidate['score']:.3f}  {candidate['pais']:2}  {candidate['nombre']}")
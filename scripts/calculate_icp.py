@@ -6,11 +6,28 @@ from __future__ import annotations
 from pathlib import Path
 import sys
 
+import numpy as np
 import pandas as pd
 
 sys.path.append(str(Path(__file__).parent.parent))
 import config
-from scripts import extract_colombia, extract_ecuador, extract_peru
+from scripts import (
+    artifacts,
+    extract_colombia,
+    extract_ecuador,
+    extract_peru,
+    source_plan,
+    sync_colombia,
+    validation,
+)
+from scripts.entity_resolution import apply_entity_resolution
+from scripts.size_bands import size_band
+
+
+CUBE_FILENAME = "cubo_accesos_trimestral.parquet"
+GROWTH_FILENAME = "icp_operadores_crecimiento_2024_2025.csv"
+# Caida interanual a partir de la cual se marca churn por caida.
+CHURN_YOY_DROP = 0.3
 
 
 def _list_files(folder: Path, suffixes: tuple[str, ...]) -> list[Path]:
@@ -23,6 +40,16 @@ def _list_files(folder: Path, suffixes: tuple[str, ...]) -> list[Path]:
 
 def _load_colombia_canonical() -> pd.DataFrame:
     folder = config.RAW_DATA_DIR / "colombia"
+    sync_state = sync_colombia.load_state()
+    if sync_state["periods"]:
+        print(f"Colombia desde store incremental: {len(sync_state['periods'])} periodos")
+        return sync_colombia.to_canonical_from_store()
+
+    checkpoint = extract_colombia.load_checkpoint()
+    if checkpoint and checkpoint.get("completed"):
+        print(f"Colombia desde chunks: {extract_colombia.CHUNKS_DIR} ({checkpoint['rows']} filas)")
+        return extract_colombia.to_canonical_from_chunks()
+
     candidates = _list_files(folder, (".csv",))
     if not candidates:
         raise ValueError(f"No se encontraron CSV en {folder}")
@@ -30,8 +57,7 @@ def _load_colombia_canonical() -> pd.DataFrame:
     # Priorizar archivo mas grande para evitar tomar muestras pequenas.
     selected = max(candidates, key=lambda p: p.stat().st_size)
     print(f"Colombia raw seleccionado: {selected.name}")
-    df_raw = pd.read_csv(selected, sep=";", na_values=["", "NA", "null"], keep_default_na=True)
-    return extract_colombia.to_canonical(df_raw)
+    return extract_colombia.to_canonical_from_csv(selected)
 
 
 def _load_ecuador_canonical() -> pd.DataFrame:
@@ -40,7 +66,8 @@ def _load_ecuador_canonical() -> pd.DataFrame:
     if not files:
         raise ValueError(f"No se encontraron archivos ECU en {folder}")
     print(f"Ecuador archivos: {len(files)}")
-    return extract_ecuador.run(source_files=[str(p) for p in files], save=False)
+    # Duplicados y periodos solapados se resuelven antes de parsear (evita doble conteo).
+    return source_plan.load_planned("ECU", files, extract_ecuador.run)
 
 
 def _load_peru_canonical() -> pd.DataFrame:
@@ -49,10 +76,15 @@ def _load_peru_canonical() -> pd.DataFrame:
     if not files:
         raise ValueError(f"No se encontraron archivos PER en {folder}")
     print(f"Peru archivos: {len(files)}")
-    return extract_peru.run(source_files=[str(p) for p in files], save=False)
+    return source_plan.load_planned("PER", files, extract_peru.run)
 
 
-def build_canonical(include_colombia: bool = True, include_ecuador: bool = True, include_peru: bool = True) -> pd.DataFrame:
+def build_canonical(
+    include_colombia: bool = True,
+    include_ecuador: bool = True,
+    include_peru: bool = True,
+    validate: bool = True,
+) -> pd.DataFrame:
     parts = []
     if include_colombia:
         parts.append(_load_colombia_canonical())
@@ -64,18 +96,27 @@ def build_canonical(include_colombia: bool = True, include_ecuador: bool = True,
     if not parts:
         raise ValueError("Debes incluir al menos un pais.")
 
-    canonical = pd.concat(parts, ignore_index=True)
-    canonical = canonical.dropna(subset=["pais", "id_operador", "operador", "anno", "trimestre"])
+    raw_concat = pd.concat(parts, ignore_index=True)
+    canonical = raw_concat.dropna(subset=["pais", "id_operador", "operador", "anno", "trimestre"])
     canonical["anno"] = pd.to_numeric(canonical["anno"], errors="coerce")
     canonical["trimestre"] = pd.to_numeric(canonical["trimestre"], errors="coerce")
     canonical["num_accesos"] = pd.to_numeric(canonical["num_accesos"], errors="coerce").fillna(0)
     canonical = canonical.dropna(subset=["anno", "trimestre"])
+    # Variantes de nombre del mismo operador -> una sola llave antes de agregar.
+    canonical = apply_entity_resolution(canonical)
     canonical = canonical.groupby(
         ["pais", "id_operador", "operador", "anno", "trimestre", "fuente"],
         as_index=False,
     )["num_accesos"].sum()
     canonical = canonical[config.CANONICAL_COLUMNS].copy()
     canonical = canonical.sort_values(["pais", "id_operador", "anno", "trimestre"])
+
+    if validate:
+        # Falla rapido: un parseo roto no debe llegar a la etapa WHOIS.
+        report = validation.validate_canonical(raw_concat, canonical)
+        report_path = validation.write_report(report)
+        print(f"Validacion canonico: {report['fallas_hard']} fallas, {report['avisos']} avisos ({report_path})")
+        validation.enforce(report)
     return canonical
 
 
@@ -158,26 +199,160 @@ def calculate_icp_tables(canonical: pd.DataFrame) -> tuple[pd.DataFrame, pd.Data
     return by_operator, resumen
 
 
-def run(include_colombia: bool = True, include_ecuador: bool = True, include_peru: bool = True) -> tuple[pd.DataFrame, pd.DataFrame]:
+def build_quarterly_cube(canonical: pd.DataFrame, by_operator: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cubo compacto pais x anno/trimestre x banda x operador con accesos.
+
+    La banda sale de `max_accesos_2024_2025` (fija por operador), asi el
+    dashboard puede filtrar trayectorias por tamano sin recalcular nada.
+    """
+    bands = by_operator[["pais", "id_operador", "max_accesos_2024_2025"]].copy()
+    bands["banda"] = size_band(bands["max_accesos_2024_2025"])
+    cube = canonical.merge(bands[["pais", "id_operador", "banda"]], on=["pais", "id_operador"], how="left")
+    cube = cube.groupby(
+        ["pais", "anno", "trimestre", "banda", "id_operador", "operador"],
+        as_index=False,
+        observed=True,
+        dropna=False,
+    )["num_accesos"].sum()
+    cube["anno"] = cube["anno"].astype("int16")
+    cube["trimestre"] = cube["trimestre"].astype("int8")
+    cube["periodo"] = cube["anno"].astype(str) + "Q" + cube["trimestre"].astype(str)
+    for column in ["pais", "periodo", "id_operador", "operador"]:
+        cube[column] = cube[column].astype("category")
+    return cube.sort_values(["pais", "id_operador", "anno", "trimestre"]).reset_index(drop=True)
+
+
+def build_growth_features(canonical: pd.DataFrame) -> pd.DataFrame:
+    """
+    Metricas de crecimiento por operador con operaciones agrupadas (sin loops por operador).
+
+    - crecimiento_qoq / crecimiento_yoy: ultimo trimestre reportado contra el
+      trimestre anterior y el mismo trimestre del anno previo (NaN si falta).
+    - cagr_ventana: crecimiento anual compuesto entre el primer y ultimo
+      trimestre reportado en la ventana.
+    - volatilidad_qoq: desviacion estandar de las tasas QoQ en la ventana.
+    - trimestres_desde_primer_reporte: hasta el ultimo trimestre del pais.
+    - churn_salida: no reporta en el ultimo trimestre del pais.
+    - churn_caida: caida interanual mayor a CHURN_YOY_DROP.
+    """
+    keys = ["pais", "id_operador"]
+    panel = canonical.groupby(keys + ["anno", "trimestre"], as_index=False)["num_accesos"].sum()
+    panel["q"] = panel["anno"].astype(int) * 4 + panel["trimestre"].astype(int) - 1
+    panel = panel.sort_values(keys + ["q"]).reset_index(drop=True)
+
+    grouped = panel.groupby(keys, sort=False)
+    prev_q = grouped["q"].shift(1)
+    prev_accesos = grouped["num_accesos"].shift(1)
+    accesos = panel["num_accesos"].astype(float)
+    # QoQ solo entre trimestres consecutivos y con base positiva.
+    panel["qoq"] = np.where(
+        (panel["q"] - prev_q == 1) & (prev_accesos > 0), accesos / prev_accesos - 1, np.nan
+    )
+    year_ago = panel[keys + ["q", "num_accesos"]].assign(q=panel["q"] + 4)
+    panel = panel.merge(year_ago, on=keys + ["q"], how="left", suffixes=("", "_anno_previo"))
+    base = panel["num_accesos_anno_previo"].astype(float)
+    panel["yoy"] = np.where(base > 0, panel["num_accesos"] / base - 1, np.nan)
+
+    start_year, end_year = config.WINDOW_YEARS
+    in_window = panel["anno"].between(start_year, end_year, inclusive="both")
+    window = panel.loc[in_window]
+    window_stats = window.groupby(keys).agg(
+        q_inicio=("q", "first"),
+        q_fin=("q", "last"),
+        accesos_inicio=("num_accesos", "first"),
+        accesos_fin=("num_accesos", "last"),
+        volatilidad_qoq=("qoq", "std"),
+    )
+    years = (window_stats["q_fin"] - window_stats["q_inicio"]) / 4
+    ratio = window_stats["accesos_fin"] / window_stats["accesos_inicio"].where(window_stats["accesos_inicio"] > 0)
+    window_stats["cagr_ventana"] = np.where(years > 0, ratio ** (1 / years.where(years > 0)) - 1, np.nan)
+
+    last = panel.groupby(keys, sort=False).tail(1)
+    features = last.set_index(keys)[["q", "num_accesos", "qoq", "yoy"]].rename(
+        columns={
+            "q": "q_ultimo",
+            "num_accesos": "accesos_ultimo_trimestre",
+            "qoq": "crecimiento_qoq",
+            "yoy": "crecimiento_yoy",
+        }
+    )
+    features["q_primero"] = panel.groupby(keys)["q"].min()
+    features = features.join(window_stats[["cagr_ventana", "volatilidad_qoq"]], how="left").reset_index()
+
+    latest_country = panel.groupby("pais")["q"].max().rename("q_pais")
+    features = features.merge(latest_country, on="pais", how="left")
+    features["trimestres_desde_primer_reporte"] = (features["q_pais"] - features["q_primero"]).astype(int)
+    features["churn_salida"] = features["q_ultimo"] < features["q_pais"]
+    features["churn_caida"] = features["crecimiento_yoy"] <= -CHURN_YOY_DROP
+
+    def _label(q: pd.Series) -> pd.Series:
+        return (q // 4).astype(int).astype(str) + "Q" + (q % 4 + 1).astype(int).astype(str)
+
+    features["primer_periodo"] = _label(features["q_primero"])
+    features["ultimo_periodo"] = _label(features["q_ultimo"])
+    return features[
+        [
+            "pais",
+            "id_operador",
+            "primer_periodo",
+            "ultimo_periodo",
+            "accesos_ultimo_trimestre",
+            "crecimiento_qoq",
+            "crecimiento_yoy",
+            "cagr_ventana",
+            "volatilidad_qoq",
+            "trimestres_desde_primer_reporte",
+            "churn_salida",
+            "churn_caida",
+        ]
+    ]
+
+
+def run(
+    include_colombia: bool = True,
+    include_ecuador: bool = True,
+    include_peru: bool = True,
+    validate: bool = True,
+    background_writes: bool = False,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Calcula ICP y devuelve (operadores, resumen).
+
+    Con `background_writes=True` (desde main.py) los CSV se escriben en un
+    hilo aparte y la siguiente etapa recibe los DataFrames en memoria.
+    """
     canonical = build_canonical(
         include_colombia=include_colombia,
         include_ecuador=include_ecuador,
         include_peru=include_peru,
+        validate=validate,
     )
 
     raw_canonical_path = config.RAW_DATA_DIR / config.RAW_CANONICAL_FILENAME
-    canonical.to_csv(raw_canonical_path, index=False)
+    artifacts.persist_csv(canonical, raw_canonical_path, background=background_writes)
     print(f"Canonico multi-pais guardado: {raw_canonical_path}")
 
     by_operator, resumen = calculate_icp_tables(canonical)
 
     operators_path = config.PROCESSED_DATA_DIR / config.OUTPUT_ICP_FILENAME
     resumen_path = config.PROCESSED_DATA_DIR / config.OUTPUT_ICP_RESUMEN_FILENAME
-    by_operator.to_csv(operators_path, index=False)
-    resumen.to_csv(resumen_path, index=False)
+    artifacts.persist_csv(by_operator, operators_path, background=background_writes)
+    artifacts.persist_csv(resumen, resumen_path, background=background_writes)
     print(f"ICP operadores guardado: {operators_path}")
     print(f"ICP resumen guardado: {resumen_path}")
 
+    growth = build_growth_features(canonical)
+    growth_path = config.PROCESSED_DATA_DIR / GROWTH_FILENAME
+    artifacts.persist_csv(growth, growth_path, background=background_writes)
+    print(f"Crecimiento por operador guardado: {growth_path}")
+
+    cube = build_quarterly_cube(canonical, by_operator)
+    cube_path = config.PROCESSED_DATA_DIR / CUBE_FILENAME
+    # Atomico: el dashboard puede estar leyendo el cubo mientras se regenera.
+    artifacts.persist_parquet(cube, cube_path)
+    print(f"Cubo trimestral guardado: {cube_path} ({len(cube)} filas)")
+
     return by_operator, resumen
 
 
@@ -6,80 +6,80 @@ Entrada:
 
 Salida:
 - data_ISPs/processed/icp_operadores_whois_2024_2025.csv
+
+Cada operador terminado se agrega a data_ISPs/processed/whois_checkpoint.jsonl
+(una linea JSON, con fsync); si la corrida se corta, la siguiente retoma desde
+ahi. Con `--deadline` se enriquecen primero los operadores de mayor
+`max_accesos_2024_2025` y se corta limpio al agotar el presupuesto.
 """
 from __future__ import annotations
 
+from collections import deque
 from html import unescape
+import json
+import os
 from pathlib import Path
-import re
 import sys
 import time
 from urllib.parse import quote
 
 import pandas as pd
-import requests
 
 sys.path.append(str(Path(__file__).parent.parent))
 import config
+from scripts import artifacts, asn_index, metrics, rate_control, whois_stream
+from scripts.extract_utils import clean_operator_name, normalize_operator_name
 
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
 }
-
-
-def clean_operator_name(name: str) -> str:
-    """
-    Limpia sufijos corporativos para mejorar la busqueda ASN.
-    """
-    cleaned = str(name).strip().upper()
-    patterns = [
-        r"\s+EN\s+LIQUIDACION\s*$",
-        r"\s+BIC\s*$",
-        r"\s+ZOMAC\s*$",
-        r"\s*E\.?\s*S\.?\s*P\.?\s*$",
-        r"\s*S\.?\s*A\.?\s*S\.?\s*$",
-        r"\s*S\.?\s*A\.?\s*$",
-        r"\s*L\.?\s*T\.?\s*D\.?\s*A\.?\s*$",
-        r"\s*S\.?\s*R\.?\s*L\.?\s*$",
-        r"\s*S\.?\s*A\.?\s*C\.?\s*$",
-        r"\s*C\.?\s*L\.?\s*T\.?\s*D\.?\s*A\.?\s*$",
-        r"\s*&\s*CIA\.?\s*$",
-        r"\s+Y\s+CIA\.?\s*$",
-    ]
-    changed = True
-    while changed:
-        changed = False
-        for pattern in patterns:
-            new_value = re.sub(pattern, "", cleaned, flags=re.IGNORECASE)
-            if new_value != cleaned:
-                cleaned = new_value.strip()
-                changed = True
-                break
-    cleaned = re.sub(r"[\s,.\-]+$", "", cleaned).strip()
-    return cleaned
-
-
-def search_asn(operator_name: str) -> tuple[str | None, str]:
+CHECKPOINT_FILENAME = "whois_checkpoint.jsonl"
+WHOIS_FIELDS = [
+    "whois_asn",
+    "whois_owner",
+    "whois_responsible",
+    "whois_address",
+    "whois_phone",
+    "whois_contact_person",
+    "whois_contact_email",
+    "whois_contact_phone",
+]
+# Marca de corrida terminada: el siguiente run empieza de cero.
+_COMPLETE_MARKER = {"_completo": True}
+# Veces que un operador se re-encola por throttling antes de dejarlo para la proxima corrida.
+MAX_REQUEUES = 3
+# Ritmo adaptativo por host (reemplaza el sleep fijo de 0.4s entre requests).
+RATE_CONTROLLER = rate_control.AdaptiveRateController(initial_interval=0.4)
+
+
+def search_asn(operator_name: str, pais: str | None = None, offline: bool = True) -> tuple[str | None, str]:
     """
     Busca el primer ASN asociado a un nombre de operador.
+
+    Primero consulta el indice offline (dumps en data_ISPs/raw/asn); solo
+    si no hay match suficiente cae a la busqueda HTTP.
     """
     query_name = clean_operator_name(operator_name)
+    if offline:
+        asn = asn_index.resolve_asn(query_name, pais=pais)
+        metrics.cache_lookup("asn_offline", bool(asn))
+        if asn:
+            return asn, query_name
+
     url = f"{config.WHOIS_SEARCH_BASE_URL}/{quote(query_name)}"
 
     try:
-        response = requests.get(url, headers=HEADERS, timeout=30)
-        response.raise_for_status()
-        html = response.text
+        # Coincide enlaces tipo /AS273166; corta la descarga en el primero.
+        asn, _ = RATE_CONTROLLER.call(
+            url, lambda: whois_stream.fetch_streamed(url, whois_stream.scan_as_link, headers=HEADERS)
+        )
+    except rate_control.Throttled:
+        raise
     except Exception as exc:
         print(f"   Error search ASN para '{query_name}': {exc}")
         return None, query_name
-
-    # Coincide enlaces tipo /AS273166
-    match = re.search(r'href="/(AS\d+)"', html)
-    if not match:
-        return None, query_name
-    return match.group(1), query_name
+    return asn, query_name
 
 
 def parse_whois_fields(whois_text: str, asn: str) -> dict:
@@ -137,17 +137,18 @@ def get_whois_data(asn: str) -> dict:
     """
     url = f"{config.WHOIS_ASN_BASE_URL}/{asn}"
     try:
-        response = requests.get(url, headers=HEADERS, timeout=30)
-        response.raise_for_status()
-        html = response.text
+        pre_block, _ = RATE_CONTROLLER.call(
+            url, lambda: whois_stream.fetch_streamed(url, whois_stream.scan_whois_pre, headers=HEADERS)
+        )
+    except rate_control.Throttled:
+        raise
     except Exception as exc:
         print(f"   Error WHOIS para {asn}: {exc}")
         return {}
 
-    pre_match = re.search(r'<div[^>]*id="whois"[^>]*>.*?<pre[^>]*>(.*?)</pre>', html, flags=re.DOTALL | re.IGNORECASE)
-    if not pre_match:
+    if pre_block is None:
         return {}
-    whois_text = re.sub(r"<[^>]+>", "", pre_match.group(1))
+    whois_text = whois_stream.strip_tags(pre_block)
     return parse_whois_fields(whois_text, asn=asn)
 
 
@@ -155,17 +156,22 @@ def load_icp_candidates(
     only_icp: bool = True,
     min_max_accesos: int = 1000,
     max_max_accesos: int = 100000,
+    df_icp: pd.DataFrame | None = None,
 ) -> pd.DataFrame:
     """
     Carga operadores desde ICP y filtra candidatos a enriquecer.
-    """
-    input_path = config.PROCESSED_DATA_DIR / config.OUTPUT_ICP_FILENAME
-    if not input_path.exists():
-        raise FileNotFoundError(
-            f"No existe {input_path}. Ejecuta primero scripts/calculate_icp.py"
-        )
 
-    df = pd.read_csv(input_path)
+    Si se pasa `df_icp` (salida en memoria de calculate_icp) no se lee el CSV.
+    """
+    if df_icp is None:
+        input_path = config.PROCESSED_DATA_DIR / config.OUTPUT_ICP_FILENAME
+        if not input_path.exists():
+            raise FileNotFoundError(
+                f"No existe {input_path}. Ejecuta primero scripts/calculate_icp.py"
+            )
+        df = pd.read_csv(input_path)
+    else:
+        df = df_icp
     if only_icp and "cumple_icp" in df.columns:
         df = df.loc[df["cumple_icp"] == True].copy()
     if "max_accesos_2024_2025" in df.columns:
@@ -178,47 +184,173 @@ def load_icp_candidates(
     return df
 
 
-def enrich_whois(df_ops: pd.DataFrame, sleep_seconds: float = 0.4) -> pd.DataFrame:
+def lookup_operator(operator_name: str, pais: str | None = None) -> tuple[str, dict]:
     """
-    Enriquece DataFrame de operadores con WHOIS.
+    ASN + WHOIS de un operador: (nombre consultado, campos whois).
+
+    El ritmo lo pone RATE_CONTROLLER; con throttling se propaga
+    `rate_control.Throttled` para re-encolar al operador.
     """
-    records = []
-    total = len(df_ops)
-    print(f"Enriqueciendo WHOIS para {total} operadores...")
+    asn, query_name = search_asn(operator_name, pais=pais)
+    whois = {"whois_asn": ""}
+    if asn:
+        whois = get_whois_data(asn) or {"whois_asn": asn}
+    return query_name, whois
 
-    for idx, row in df_ops.iterrows():
-        operator_name = str(row["operador"])
-        print(f"[{idx + 1}/{total}] {row['pais']} - {operator_name}")
 
-        base = row.to_dict()
-        asn, query_name = search_asn(operator_name)
-        base["whois_query_name"] = query_name
+def whois_entity_key(pais, operator_name: str) -> str:
+    """Llave de reutilizacion WHOIS: nombre normalizado dentro del pais (la busqueda ASN filtra por pais)."""
+    return f"{pais}|{normalize_operator_name(str(operator_name))}"
 
-        if asn:
-            time.sleep(sleep_seconds)
-            whois = get_whois_data(asn)
-            if whois:
-                base.update(whois)
-            else:
-                base["whois_asn"] = asn
-        else:
-            base["whois_asn"] = ""
-
-        # Completa campos faltantes estandar
-        for field in [
-            "whois_owner",
-            "whois_responsible",
-            "whois_address",
-            "whois_phone",
-            "whois_contact_person",
-            "whois_contact_email",
-            "whois_contact_phone",
-        ]:
-            base.setdefault(field, "")
 
-        records.append(base)
-        time.sleep(sleep_seconds)
+def _checkpoint_path() -> Path:
+    return config.PROCESSED_DATA_DIR / CHECKPOINT_FILENAME
+
 
+def _operator_key(pais, id_operador) -> tuple[str, str]:
+    return str(pais), str(id_operador)
+
+
+def load_checkpoint(path: Path | None = None) -> dict[tuple[str, str], dict]:
+    """
+    Resultados ya guardados por (pais, id_operador).
+
+    Un checkpoint de una corrida terminada se ignora; una linea final
+    truncada (corte a mitad de escritura) se descarta.
+    """
+    path = path or _checkpoint_path()
+    if not path.exists():
+        return {}
+    done: dict[tuple[str, str], dict] = {}
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record == _COMPLETE_MARKER:
+                return {}
+            done[_operator_key(record["pais"], record["id_operador"])] = record
+    return done
+
+
+def _append_checkpoint(handle, record: dict) -> None:
+    handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+    handle.flush()
+    os.fsync(handle.fileno())
+
+
+def enrich_whois(
+    df_ops: pd.DataFrame,
+    resume: bool = True,
+    deadline_seconds: float | None = None,
+    checkpoint_path: Path | None = None,
+) -> pd.DataFrame:
+    """
+    Enriquece DataFrame de operadores con WHOIS.
+
+    Procesa por `max_accesos_2024_2025` descendente y devuelve solo los
+    operadores terminados (todos, salvo deadline, Ctrl-C o throttling
+    persistente), en el orden de `df_ops`.
+    """
+    checkpoint_path = checkpoint_path or _checkpoint_path()
+    if not resume and checkpoint_path.exists():
+        checkpoint_path.unlink()
+    saved = load_checkpoint(checkpoint_path)
+    if not saved and checkpoint_path.exists():
+        checkpoint_path.unlink()
+
+    total = len(df_ops)
+    # Una consulta por entidad resuelta y pais: variantes del mismo nombre reutilizan el resultado.
+    resolved: dict[str, tuple[str, dict]] = {
+        record["entity_key"]: (record["whois_query_name"], {f: record.get(f, "") for f in WHOIS_FIELDS})
+        for record in saved.values()
+    }
+    keys = [_operator_key(pais, id_op) for pais, id_op in zip(df_ops["pais"], df_ops["id_operador"])]
+    # Solo cuentan los operadores de esta corrida (el checkpoint puede venir de otro df_ops).
+    key_set = set(keys)
+    done = {key: record for key, record in saved.items() if key in key_set}
+    pending = [pos for pos, key in enumerate(keys) if key not in done]
+    if "max_accesos_2024_2025" in df_ops.columns:
+        priority = df_ops["max_accesos_2024_2025"].to_numpy()
+        pending.sort(key=lambda pos: -priority[pos])
+    queue = deque(pending)
+    requeues: dict[int, int] = {}
+    if done:
+        print(f"Retomando checkpoint: {total - len(pending)}/{total} operadores ya enriquecidos")
+    print(f"Enriqueciendo WHOIS para {len(pending)} operadores...")
+
+    started = time.monotonic()
+    processed = 0
+    whois_stage = metrics.stage("whois", total=len(pending), unit="operadores")
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, whois_stage as progress:
+        try:
+            while queue:
+                pos = queue.popleft()
+                elapsed = time.monotonic() - started
+                # Corta antes de empezar un operador que no alcanzaria a terminar.
+                if deadline_seconds is not None and processed and elapsed + elapsed / processed > deadline_seconds:
+                    print(f"Deadline de {deadline_seconds:g}s alcanzado; quedan {len(queue) + 1} operadores.")
+                    break
+
+                row = df_ops.iloc[pos]
+                operator_name = str(row["operador"])
+                print(f"[{processed + 1}/{len(pending)}] {row['pais']} - {operator_name}")
+
+                entity_key = whois_entity_key(row["pais"], operator_name)
+                metrics.cache_lookup("whois_entidad", entity_key in resolved)
+                if entity_key in resolved:
+                    query_name, whois = resolved[entity_key]
+                    print("   Reutilizado de entidad ya consultada")
+                else:
+                    try:
+                        query_name, whois = lookup_operator(operator_name, pais=row.get("pais"))
+                    except rate_control.Throttled as exc:
+                        # No se registra como vacio: vuelve al final de la cola.
+                        metrics.error("whois", exc)
+                        requeues[pos] = requeues.get(pos, 0) + 1
+                        if requeues[pos] <= MAX_REQUEUES:
+                            queue.append(pos)
+                            print(f"   Throttling ({exc}); re-encolado")
+                        else:
+                            print("   Throttling persistente; queda pendiente para la proxima corrida")
+                        if isinstance(exc, rate_control.CircuitOpen):
+                            time.sleep(exc.retry_after)
+                        continue
+                    resolved[entity_key] = (query_name, whois)
+
+                record = {
+                    "pais": keys[pos][0],
+                    "id_operador": keys[pos][1],
+                    "entity_key": entity_key,
+                    "whois_query_name": query_name,
+                    # Completa campos faltantes estandar
+                    **{field: whois.get(field, "") for field in WHOIS_FIELDS},
+                }
+                _append_checkpoint(checkpoint, record)
+                done[keys[pos]] = record
+                processed += 1
+                progress.advance()
+        except KeyboardInterrupt:
+            print(f"\nInterrumpido; {len(done)}/{total} operadores quedan en el checkpoint.")
+
+        if all(key in done for key in keys):
+            _append_checkpoint(checkpoint, _COMPLETE_MARKER)
+
+    return merge_whois_results(df_ops, done)
+
+
+def merge_whois_results(df_ops: pd.DataFrame, results: dict[tuple[str, str], dict]) -> pd.DataFrame:
+    """Une resultados por (pais, id_operador) a los operadores, en el orden de `df_ops`."""
+    records = []
+    for pos, (pais, id_operador) in enumerate(zip(df_ops["pais"], df_ops["id_operador"])):
+        result = results.get(_operator_key(pais, id_operador))
+        if result is None:
+            continue
+        base = df_ops.iloc[pos].to_dict()
+        base["whois_query_name"] = result["whois_query_name"]
+        base.update({field: result.get(field, "") for field in WHOIS_FIELDS})
+        records.append(base)
     return pd.DataFrame(records)
 
 
@@ -226,22 +358,46 @@ def run(
     only_icp: bool = True,
     min_max_accesos: int = 1000,
     max_max_accesos: int = 100000,
+    df_icp: pd.DataFrame | None = None,
+    background_writes: bool = False,
+    resume: bool = True,
+    deadline_seconds: float | None = None,
+    workers: int = 1,
 ) -> pd.DataFrame:
     """
     Ejecuta enriquecimiento WHOIS y guarda resultado.
+
+    Con deadline o interrupcion la salida contiene solo los operadores
+    terminados; relanzar completa el resto desde el checkpoint. Con
+    `workers > 1` se usa la cola SQLite de scripts/whois_queue.py.
     """
+    if workers > 1:
+        from scripts import whois_queue
+
+        return whois_queue.run(
+            num_workers=workers,
+            only_icp=only_icp,
+            min_max_accesos=min_max_accesos,
+            max_max_accesos=max_max_accesos,
+            df_icp=df_icp,
+            background_writes=background_writes,
+        )
+
     candidates = load_icp_candidates(
         only_icp=only_icp,
         min_max_accesos=min_max_accesos,
         max_max_accesos=max_max_accesos,
+        df_icp=df_icp,
     )
     if candidates.empty:
         print("No hay operadores para enriquecer con los filtros actuales.")
         return pd.DataFrame()
 
-    enriched = enrich_whois(candidates)
+    enriched = enrich_whois(candidates, resume=resume, deadline_seconds=deadline_seconds)
+    if len(enriched) < len(candidates):
+        print(f"Salida parcial: {len(enriched)}/{len(candidates)} operadores enriquecidos.")
     output_path = config.PROCESSED_DATA_DIR / config.OUTPUT_WHOIS_FILENAME
-    enriched.to_csv(output_path, index=False)
+    artifacts.persist_csv(enriched, output_path, background=background_writes)
     print(f"WHOIS enriquecido guardado: {output_path}")
     return enriched
 
@@ -253,14 +409,30 @@ if __name__ == "__main__":
     parser.add_argument("--all-icp", action="store_true", help="Forzar filtro ICP completo (1000 a 100000).")
     parser.add_argument("--min-max-accesos", type=int, default=1000, help="Minimo de max_accesos_2024_2025.")
     parser.add_argument("--max-max-accesos", type=int, default=100000, help="Maximo de max_accesos_2024_2025.")
+    parser.add_argument(
+        "--deadline", type=float, default=None, help="Presupuesto en segundos; prioriza mayor max_accesos."
+    )
+    parser.add_argument("--no-resume", action="store_true", help="Ignora el checkpoint y empieza de cero.")
+    parser.add_argument("--workers", type=int, default=1, help="Workers en paralelo via cola SQLite (>1).")
     args = parser.parse_args()
 
+    metrics.start_reporter()
     if args.all_icp:
-        run(only_icp=True, min_max_accesos=1000, max_max_accesos=100000)
+        run(
+            only_icp=True,
+            min_max_accesos=1000,
+            max_max_accesos=100000,
+            resume=not args.no_resume,
+            deadline_seconds=args.deadline,
+            workers=args.workers,
+        )
     else:
         run(
             only_icp=True,
             min_max_accesos=args.min_max_accesos,
             max_max_accesos=args.max_max_accesos,
+            resume=not args.no_resume,
+            deadline_seconds=args.deadline,
+            workers=args.workers,
         )
 
@@ -0,0 +1,218 @@
+"""
+Resolucion de entidades de operador (variantes de nombre -> una llave canonica).
+
+Flujo:
+- normaliza cada nombre una sola vez (memoizado en extract_utils),
+- agrupa en bloques por q-gramas del nombre compacto (sin espacios) dentro
+  de cada pais, asi "TELE CABLE"/"TELECABLE" o "MEGADATO"/"MEGADATOS" caen
+  en el mismo bloque aunque no compartan un token completo,
+- compara con fuzzy matching solo dentro de cada bloque (nunca une nombres
+  con numeros distintos: "FIBRANET 1" != "FIBRANET 2"),
+- une coincidencias (union-find) y asigna llave/nombre canonico por entidad.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from difflib import SequenceMatcher
+from pathlib import Path
+import re
+import sys
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.extract_utils import normalize_operator_name, operator_key
+
+
+# Tokens demasiado frecuentes para servir como bloque.
+GENERIC_TOKENS = {
+    "DE", "DEL", "LA", "LAS", "EL", "LOS", "Y", "E", "EN",
+    "INTERNET", "TELECOMUNICACIONES", "COMUNICACIONES", "TELECOM", "TELECOMUNICACION",
+    "SERVICIOS", "SERVICIO", "SOLUCIONES", "REDES", "RED", "NET", "TV", "CABLE",
+    "GRUPO", "EMPRESA", "CORPORACION", "COMPANIA", "CIA", "SOCIEDAD", "COOPERATIVA",
+    "SAS", "SA", "SAC", "SRL", "EIRL", "LTDA", "ESP",
+}
+MIN_TOKEN_LEN = 3
+MAX_BLOCK_SIZE = 200
+SIMILARITY_THRESHOLD = 0.9
+QGRAM_SIZE = 3
+# Fraccion minima de q-gramas compartidos (sobre el nombre mas corto) para comparar.
+MIN_QGRAM_OVERLAP = 0.5
+_NUMBER_RE = re.compile(r"\d+")
+
+
+def blocking_keys(normalized: str) -> set[str]:
+    """Tokens informativos usados como llaves de bloque."""
+    tokens = {t for t in normalized.split() if len(t) >= MIN_TOKEN_LEN and t not in GENERIC_TOKENS}
+    if not tokens and normalized:
+        # Nombres compuestos solo por tokens genericos: bloque por nombre completo.
+        tokens = {normalized}
+    return tokens
+
+
+def qgrams(normalized: str, size: int = QGRAM_SIZE) -> set[str]:
+    """q-gramas del nombre compacto (sin espacios) con bordes marcados."""
+    compact = f"#{normalized.replace(' ', '')}#"
+    if len(compact) <= size:
+        return {compact}
+    return {compact[pos : pos + size] for pos in range(len(compact) - size + 1)}
+
+
+def _similar(left: str, right: str) -> bool:
+    if left == right:
+        return True
+    # Numeros distintos suelen ser operadores distintos ("FIBRANET 1" vs "FIBRANET 2").
+    if _NUMBER_RE.findall(left) != _NUMBER_RE.findall(right):
+        return False
+    # Compacto sin espacios: "TELE CABLE" == "TELECABLE".
+    if left.replace(" ", "") == right.replace(" ", ""):
+        return True
+    matcher = SequenceMatcher(None, left, right, autojunk=False)
+    if matcher.real_quick_ratio() < SIMILARITY_THRESHOLD or matcher.quick_ratio() < SIMILARITY_THRESHOLD:
+        return False
+    return matcher.ratio() >= SIMILARITY_THRESHOLD
+
+
+class _UnionFind:
+    """Union-find que no une componentes con ids reales de fuente distintos."""
+
+    def __init__(self, real_ids: list[str | None]):
+        self.parent = list(range(len(real_ids)))
+        self.real_id = list(real_ids)
+
+    def find(self, node: int) -> int:
+        while self.parent[node] != node:
+            self.parent[node] = self.parent[self.parent[node]]
+            node = self.parent[node]
+        return node
+
+    def union(self, left: int, right: int) -> None:
+        root_l, root_r = self.find(left), self.find(right)
+        if root_l == root_r:
+            return
+        id_l, id_r = self.real_id[root_l], self.real_id[root_r]
+        if id_l and id_r and id_l != id_r:
+            return
+        self.parent[root_r] = root_l
+        self.real_id[root_l] = id_l or id_r
+
+
+def resolve_operators(nodes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Resuelve entidades sobre operadores unicos.
+
+    Espera columnas `pais`, `id_operador`, `operador` y opcionalmente
+    `ultimo_periodo` (para elegir el nombre canonico mas reciente).
+    Devuelve las mismas filas con `id_entidad` y `operador_entidad`.
+    """
+    nodes = nodes.reset_index(drop=True).copy()
+    if nodes.empty:
+        nodes["id_entidad"] = pd.Series(dtype=str)
+        nodes["operador_entidad"] = pd.Series(dtype=str)
+        return nodes
+
+    nodes["__norm"] = nodes["operador"].astype(str).map(normalize_operator_name)
+    # Un id que coincide con la llave derivada del nombre no es un id real de la fuente.
+    name_keys = nodes["operador"].astype(str).map(operator_key)
+    ids = nodes["id_operador"].astype(str)
+    real_ids = [
+        f"{pais}|{id_value}" if id_value != name_key else None
+        for pais, id_value, name_key in zip(nodes["pais"], ids, name_keys)
+    ]
+    uf = _UnionFind(real_ids)
+
+    # Mismo id en el mismo pais => misma entidad (aunque cambie el nombre).
+    for _, idx in nodes.groupby(["pais", "id_operador"]).indices.items():
+        for other in idx[1:]:
+            uf.union(idx[0], other)
+
+    # Bloques por (pais, q-grama); comparacion solo dentro del bloque y entre nombres distintos.
+    blocks: dict[tuple[str, str], list[int]] = defaultdict(list)
+    first_by_norm: dict[tuple[str, str], int] = {}
+    grams: dict[int, set[str]] = {}
+    for idx, (pais, norm) in enumerate(zip(nodes["pais"], nodes["__norm"])):
+        key = (pais, norm)
+        if key in first_by_norm:
+            uf.union(first_by_norm[key], idx)
+            continue
+        first_by_norm[key] = idx
+        grams[idx] = qgrams(norm)
+        for gram in grams[idx]:
+            blocks[(pais, gram)].append(idx)
+
+    # Bloques enormes (q-gramas comunes como "TEL") se omiten: los pares
+    # similares comparten ademas q-gramas raros.
+    norms = nodes["__norm"].tolist()
+    compared: set[tuple[int, int]] = set()
+    for members in blocks.values():
+        if len(members) < 2 or len(members) > MAX_BLOCK_SIZE:
+            continue
+        for pos, left in enumerate(members):
+            for right in members[pos + 1 :]:
+                if (left, right) in compared:
+                    continue
+                compared.add((left, right))
+                shared = len(grams[left] & grams[right])
+                if shared < MIN_QGRAM_OVERLAP * min(len(grams[left]), len(grams[right])):
+                    continue
+                if _similar(norms[left], norms[right]):
+                    uf.union(left, right)
+
+    nodes["__root"] = [uf.find(idx) for idx in range(len(nodes))]
+    if "ultimo_periodo" not in nodes.columns:
+        nodes["ultimo_periodo"] = 0
+
+    # Nombre canonico: el mas reciente; empate -> el normalizado mas corto/alfabetico.
+    ordered = nodes.assign(__len=nodes["__norm"].str.len()).sort_values(
+        ["__root", "ultimo_periodo", "__len", "__norm"],
+        ascending=[True, False, True, True],
+    )
+    representative = ordered.drop_duplicates("__root", keep="first").set_index("__root")
+
+    # Llave estable: id real de la fuente o, si no hay, la menor llave de nombre
+    # del grupo (independiente del orden de llegada de fuentes/trimestres).
+    min_norm = nodes.groupby("__root")["__norm"].min()
+    entity_ids = {
+        root: (uf.real_id[root].split("|", 1)[1] if uf.real_id[root] else norm.replace(" ", "_"))
+        for root, norm in min_norm.items()
+    }
+    nodes["id_entidad"] = nodes["__root"].map(entity_ids)
+    nodes["operador_entidad"] = nodes["__root"].map(representative["operador"])
+    return nodes.drop(columns=["__norm", "__root"])
+
+
+def apply_entity_resolution(canonical: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reemplaza `id_operador`/`operador` del canonico por la entidad resuelta.
+
+    Las variantes de nombre de un mismo operador quedan con una sola llave en
+    todas las fuentes y trimestres; el groupby posterior las consolida.
+    """
+    if canonical.empty:
+        return canonical
+
+    df = canonical.copy()
+    df["id_operador"] = df["id_operador"].astype(str).str.strip()
+    df["operador"] = df["operador"].astype(str).str.strip()
+    periodo = pd.to_numeric(df["anno"], errors="coerce").fillna(0) * 10 + pd.to_numeric(
+        df["trimestre"], errors="coerce"
+    ).fillna(0)
+    nodes = (
+        df.assign(ultimo_periodo=periodo)
+        .groupby(["pais", "id_operador", "operador"], as_index=False)["ultimo_periodo"]
+        .max()
+    )
+    resolved = resolve_operators(nodes)
+
+    merged = df.merge(
+        resolved[["pais", "id_operador", "operador", "id_entidad", "operador_entidad"]],
+        on=["pais", "id_operador", "operador"],
+        how="left",
+    )
+    merged["id_operador"] = merged["id_entidad"].fillna(merged["id_operador"])
+    merged["operador"] = merged["operador_entidad"].fillna(merged["operador"])
+
+    n_before = len(nodes)
+    n_after = len(resolved[["pais", "id_entidad"]].drop_duplicates())
+    print(f"Resolucion de entidades: {n_before} operadores -> {n_after} entidades")
+    return merged.drop(columns=["id_entidad", "operador_entidad"])
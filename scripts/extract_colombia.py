@@ -4,6 +4,7 @@ Extractor Colombia: API DKAN postdata.gov.co.
 from __future__ import annotations
 
 import json
+import os
 from pathlib import Path
 import sys
 
@@ -12,67 +13,282 @@ import requests
 
 sys.path.append(str(Path(__file__).parent.parent))
 import config
+from scripts import metrics, rate_control
+from scripts.extract_utils import combine_partials
 
 
 SOURCE_TAG = "postdata_dkan"
+REQUIRED_COLUMNS = {"id_empresa", "empresa", "anno", "trimestre", "accesos"}
+# Fuera de _list_files (subcarpeta), para no competir con los CSV de raw/colombia.
+CHUNKS_DIR = config.RAW_DATA_DIR / "colombia" / "chunks"
+CHECKPOINT_FILENAME = "checkpoint.json"
 
 
-def build_params(limit: int = 100, offset: int = 0) -> dict:
-    return {
+PUSHDOWN_MODES = ("filters", "none")
+# Sin pausa mientras el datastore responde bien; backoff ante 429/5xx.
+RATE_CONTROLLER = rate_control.AdaptiveRateController(initial_interval=0.0, min_interval=0.0)
+
+
+def build_params(
+    limit: int = 100,
+    offset: int = 0,
+    fields: list[str] | None = None,
+    years: tuple[int, int] | None = None,
+    period: tuple[int, int] | None = None,
+) -> dict:
+    params = {
         "resource_id": config.RESOURCE_ID,
         "limit": limit,
         "offset": offset,
     }
+    if fields:
+        params["fields"] = ",".join(fields)
+    filters = {}
+    if years:
+        start_year, end_year = years
+        filters["anno"] = [str(y) for y in range(start_year, end_year + 1)]
+    if period:
+        # Un solo (anno, trimestre), usado por la sincronizacion incremental.
+        filters["anno"] = [str(period[0])]
+        filters["trimestre"] = [str(period[1])]
+    if filters:
+        params["filters"] = json.dumps(filters)
+    return params
+
+
+def _params_for_mode(mode: str, limit: int, offset: int, years: tuple[int, int] | None) -> dict:
+    if mode == "filters":
+        return build_params(limit=limit, offset=offset, fields=sorted(REQUIRED_COLUMNS), years=years)
+    return build_params(limit=limit, offset=offset)
+
+
+def write_atomic_json(path: Path, payload: dict) -> None:
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(chunks_dir: Path = CHUNKS_DIR) -> dict | None:
+    path = chunks_dir / CHECKPOINT_FILENAME
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def fetch_page(url: str, params: dict, max_retries: int = 5) -> dict:
+    def _get():
+        response = requests.get(url, params=params, timeout=60)
+        response.raise_for_status()
+        return response
+
+    # 429/5xx/timeouts: backoff del controlador y reintento de la misma pagina.
+    response = RATE_CONTROLLER.call_with_retry(url, _get, max_retries=max_retries)
+
+    try:
+        payload = response.json()
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"Respuesta JSON invalida en Colombia: {exc}") from exc
+
+    if not payload.get("success", False):
+        raise RuntimeError(f"Error de API Colombia: {payload.get('error', 'Unknown error')}")
+    return payload
+
+
+def _probe_pushdown(url: str, mode: str, years: tuple[int, int] | None) -> bool:
+    """
+    Verifica con una pagina chica que el servidor respeta proyeccion y filtro.
+
+    Un datastore que ignora `fields`/`filters` responde success=True con
+    todas las columnas o anos; eso cuenta como no soportado.
+    """
+    try:
+        payload = fetch_page(url, _params_for_mode(mode, limit=5, offset=0, years=years), max_retries=0)
+    except Exception as exc:
+        print(f"  Pushdown '{mode}' no soportado: {exc}")
+        return False
+
+    records = payload.get("result", {}).get("records", [])
+    if not records:
+        return False
+    extra = set(records[0]) - REQUIRED_COLUMNS - {"_id"}
+    if extra or not REQUIRED_COLUMNS.issubset(records[0]):
+        print(f"  Pushdown '{mode}' ignorado por el servidor (columnas: {sorted(records[0])})")
+        return False
+    if years:
+        annos = pd.to_numeric(pd.Series([r.get("anno") for r in records]), errors="coerce")
+        if not annos.between(years[0], years[1]).all():
+            print(f"  Pushdown '{mode}' no filtro anos {years}")
+            return False
+    return True
+
+
+def select_pushdown(url: str, pushdown: str = "auto", years: tuple[int, int] | None = None) -> str:
+    """Elige el modo de extraccion: filters > none (descarga completa)."""
+    if pushdown != "auto":
+        if pushdown not in PUSHDOWN_MODES:
+            raise ValueError(f"Modo pushdown invalido: {pushdown}. Usa auto/{'/'.join(PUSHDOWN_MODES)}")
+        return pushdown
+    if _probe_pushdown(url, "filters", years):
+        return "filters"
+    print("  Sin pushdown disponible; descarga completa.")
+    return "none"
+
+
+def _checkpoint_is_current(url: str, checkpoint: dict, years: tuple[int, int] | None) -> bool:
+    """
+    Un checkpoint completo sigue vigente si el servidor reporta el mismo total.
 
+    Un total distinto (p.ej. el trimestre nuevo) o desconocido obliga a
+    extraer de nuevo; si el servidor no responde se reutilizan los chunks.
+    """
+    params = _params_for_mode(checkpoint["pushdown"], limit=1, offset=0, years=years)
+    try:
+        server_total = fetch_page(url, params, max_retries=0).get("result", {}).get("total")
+    except Exception as exc:
+        print(f"  No se pudo verificar el total en el servidor ({exc}); se reutiliza el checkpoint.")
+        return True
+    if server_total is None or checkpoint.get("total") is None:
+        return False
+    return int(server_total) == checkpoint["total"]
 
-def extract_data_from_api(limit: int = 100, max_pages: int | None = None) -> pd.DataFrame:
-    """Extrae datos crudos de Colombia con paginacion."""
+
+def _write_chunk(records: list[dict], chunks_dir: Path, start_offset: int) -> str:
+    # Nombre determinista por offset: si se cae entre chunk y checkpoint, el reintento lo sobrescribe.
+    name = f"part_{start_offset:012d}.parquet"
+    tmp_path = chunks_dir / f"{name}.tmp"
+    pd.DataFrame(records).astype("string").to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, chunks_dir / name)
+    return name
+
+
+def extract_to_chunks(
+    limit: int = 100,
+    max_pages: int | None = None,
+    pages_per_chunk: int = 50,
+    chunks_dir: Path = CHUNKS_DIR,
+    resume: bool = True,
+    pushdown: str = "auto",
+    years: tuple[int, int] | None = config.WINDOW_YEARS,
+    api_url: str | None = None,
+) -> dict:
+    """
+    Extrae Colombia paginando y escribe chunks parquet a disco a medida que llegan.
+
+    Tras cada chunk se guarda un checkpoint con el ultimo offset confirmado;
+    una ejecucion reiniciada continua desde ahi. Un checkpoint completo solo
+    se reutiliza si el servidor reporta el mismo total de filas. Devuelve el
+    checkpoint final.
+
+    `pushdown` empuja al datastore la proyeccion de columnas y el filtro de
+    anos (`years`); con "auto" se prueba con una pagina chica y se cae a
+    descarga completa si el servidor no lo soporta.
+    `api_url` permite apuntar a un DKAN local de pruebas.
+    """
     if not config.RESOURCE_ID:
         raise ValueError("RESOURCE_ID no esta configurado en config.py")
 
-    url = f"{config.API_BASE_URL}/search.json"
-    all_data = []
-    offset = 0
+    url = f"{api_url or config.API_BASE_URL}/search.json"
+    window = list(years) if years else None
+    chunks_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint = load_checkpoint(chunks_dir) if resume else None
+    if checkpoint and (
+        checkpoint.get("resource_id") != config.RESOURCE_ID
+        or checkpoint.get("limit") != limit
+        or checkpoint.get("years") != window
+        or checkpoint.get("pushdown") not in PUSHDOWN_MODES
+        or (pushdown != "auto" and checkpoint.get("pushdown") != pushdown)
+    ):
+        print("Checkpoint Colombia de otro recurso/limit/consulta; se reinicia la extraccion.")
+        checkpoint = None
+    if checkpoint and checkpoint.get("completed") and not _checkpoint_is_current(url, checkpoint, years):
+        print("Checkpoint Colombia completo pero el servidor cambio de total; se reinicia la extraccion.")
+        checkpoint = None
+    if checkpoint is None:
+        for old_chunk in chunks_dir.glob("part_*.parquet"):
+            old_chunk.unlink()
+        checkpoint = {
+            "resource_id": config.RESOURCE_ID,
+            "limit": limit,
+            "years": window,
+            "pushdown": select_pushdown(url, pushdown=pushdown, years=years),
+            "next_offset": 0,
+            "rows": 0,
+            "total": None,
+            "chunks": [],
+            "completed": False,
+        }
+    elif checkpoint.get("completed"):
+        print(f"Extraccion Colombia ya completa y vigente en {chunks_dir} ({checkpoint['rows']} filas).")
+        return checkpoint
+    else:
+        print(f"Reanudando Colombia desde offset {checkpoint['next_offset']} ({checkpoint['rows']} filas).")
+
+    mode = checkpoint["pushdown"]
+    offset = checkpoint["next_offset"]
+    chunk_start = offset
+    buffer: list[dict] = []
     pages = 0
+    done = False
 
-    print("Extrayendo Colombia desde API...")
-    while True:
-        params = build_params(limit=limit, offset=offset)
-        response = requests.get(url, params=params, timeout=60)
-        response.raise_for_status()
+    print(f"Extrayendo Colombia desde API (pushdown={mode})...")
+    with metrics.stage("colombia_api", total=checkpoint["total"], initial=checkpoint["rows"]) as progress:
+        while not done:
+            payload = fetch_page(url, _params_for_mode(mode, limit=limit, offset=offset, years=years))
+            records = payload.get("result", {}).get("records", [])
+            if records:
+                buffer.extend(records)
+                pages += 1
+                offset += len(records)
+                progress.advance(len(records))
+                total_records = payload.get("result", {}).get("total")
+                if total_records is not None:
+                    checkpoint["total"] = int(total_records)
+                    progress.total = checkpoint["total"]
+                print(f"  - pagina {pages}: +{len(records)} (total={checkpoint['rows'] + len(buffer)})")
+
+            done = (
+                not records
+                or len(records) < limit
+                or (checkpoint["total"] is not None and offset >= checkpoint["total"])
+            )
+            stop_by_pages = max_pages is not None and pages >= max_pages
 
-        try:
-            payload = response.json()
-        except json.JSONDecodeError as exc:
-            raise ValueError(f"Respuesta JSON invalida en Colombia: {exc}") from exc
+            if buffer and (done or stop_by_pages or pages % pages_per_chunk == 0):
+                checkpoint["chunks"].append(_write_chunk(buffer, chunks_dir, chunk_start))
+                checkpoint["rows"] += len(buffer)
+                buffer = []
+                chunk_start = offset
+            checkpoint["next_offset"] = offset
+            checkpoint["completed"] = done
+            if not buffer:
+                write_atomic_json(chunks_dir / CHECKPOINT_FILENAME, checkpoint)
+            if stop_by_pages:
+                break
 
-        if not payload.get("success", False):
-            raise RuntimeError(f"Error de API Colombia: {payload.get('error', 'Unknown error')}")
+    return checkpoint
 
-        records = payload.get("result", {}).get("records", [])
-        if not records:
-            break
 
-        all_data.extend(records)
-        pages += 1
-        print(f"  - pagina {pages}: +{len(records)} (total={len(all_data)})")
+def iter_chunks(chunks_dir: Path = CHUNKS_DIR, columns: list[str] | None = None):
+    """Itera los chunks confirmados en el checkpoint (uno a la vez en memoria)."""
+    checkpoint = load_checkpoint(chunks_dir)
+    if checkpoint is None:
+        return
+    for name in checkpoint["chunks"]:
+        yield pd.read_parquet(chunks_dir / name, columns=columns)
 
-        total_records = payload.get("result", {}).get("total", len(all_data))
-        if len(all_data) >= total_records:
-            break
-        if len(records) < limit:
-            break
-        if max_pages is not None and pages >= max_pages:
-            break
-        offset += limit
 
-    return pd.DataFrame(all_data)
+def extract_data_from_api(limit: int = 100, max_pages: int | None = None, pushdown: str = "none") -> pd.DataFrame:
+    """Extrae datos crudos de Colombia con paginacion (via chunks en disco)."""
+    extract_to_chunks(limit=limit, max_pages=max_pages, pushdown=pushdown, years=None)
+    parts = list(iter_chunks())
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts, ignore_index=True)
 
 
 def to_canonical(df_raw: pd.DataFrame) -> pd.DataFrame:
     """Convierte raw Colombia a esquema canonico trimestral por operador."""
-    required = {"id_empresa", "empresa", "anno", "trimestre", "accesos"}
-    missing = required - set(df_raw.columns)
+    missing = REQUIRED_COLUMNS - set(df_raw.columns)
     if missing:
         raise ValueError(f"Faltan columnas requeridas Colombia: {sorted(missing)}")
 
@@ -104,26 +320,108 @@ def to_canonical(df_raw: pd.DataFrame) -> pd.DataFrame:
     return canonical
 
 
-def save_outputs(df_raw: pd.DataFrame, df_canonical: pd.DataFrame) -> None:
+def to_canonical_from_chunks(chunks_dir: Path = CHUNKS_DIR) -> pd.DataFrame:
+    """Canonico desde los chunks parquet: cada chunk se agrega y se descarta."""
+    partials = []
+    with metrics.stage("colombia_parse") as progress:
+        for chunk in iter_chunks(chunks_dir, columns=sorted(REQUIRED_COLUMNS)):
+            partials.append(to_canonical(chunk))
+            progress.advance(len(chunk))
+    return combine_partials(partials)
+
+
+def to_canonical_from_csv(path: Path, chunksize: int = 500_000) -> pd.DataFrame:
+    """Canonico desde un CSV raw (sep=';') leyendo por bloques solo las columnas requeridas."""
+    reader = pd.read_csv(
+        path,
+        sep=";",
+        usecols=lambda col: col in REQUIRED_COLUMNS,
+        na_values=["", "NA", "null"],
+        keep_default_na=True,
+        chunksize=chunksize,
+    )
+    partials = []
+    with metrics.stage("colombia_parse") as progress:
+        for chunk in reader:
+            partials.append(to_canonical(chunk))
+            progress.advance(len(chunk))
+    return combine_partials(partials)
+
+
+def save_outputs(df_canonical: pd.DataFrame, chunks_dir: Path = CHUNKS_DIR) -> None:
+    """
+    Guarda el canonico y vuelca los chunks al CSV raw (sep=';') chunk a chunk.
+
+    El CSV raw es el volcado nacional completo: una extraccion con pushdown
+    (columnas requeridas y anos de la ventana) no lo reescribe; esa
+    extraccion queda en los chunks y en el canonico.
+    """
     raw_path = config.RAW_DATA_DIR / config.RAW_COL_FILENAME
     canonical_path = config.RAW_DATA_DIR / f"canonical_colombia_{config.RAW_COL_FILENAME}"
-    df_raw.to_csv(raw_path, index=False, sep=";")
     df_canonical.to_csv(canonical_path, index=False)
-    print(f"Raw Colombia guardado: {raw_path}")
     print(f"Canonico Colombia guardado: {canonical_path}")
 
+    checkpoint = load_checkpoint(chunks_dir)
+    if checkpoint and checkpoint.get("pushdown") != "none":
+        print(f"Raw Colombia sin cambios: extraccion proyectada (pushdown={checkpoint['pushdown']}) en {chunks_dir}")
+        return
+    tmp_path = raw_path.with_suffix(raw_path.suffix + ".tmp")
+    columns = None
+    with open(tmp_path, "w", encoding="utf-8", newline="") as handle:
+        for chunk in iter_chunks(chunks_dir):
+            # Columnas fijadas por el primer chunk; faltantes se escriben vacias.
+            columns = columns or list(chunk.columns)
+            chunk.reindex(columns=columns).to_csv(handle, index=False, sep=";", header=handle.tell() == 0)
+    os.replace(tmp_path, raw_path)
+    print(f"Raw Colombia guardado: {raw_path}")
+
 
-def run(limit: int = 100, max_pages: int | None = None, save: bool = True) -> pd.DataFrame:
-    df_raw = extract_data_from_api(limit=limit, max_pages=max_pages)
-    if df_raw.empty:
+def run(
+    limit: int = 100,
+    max_pages: int | None = None,
+    save: bool = True,
+    resume: bool = True,
+    pushdown: str = "auto",
+    api_url: str | None = None,
+) -> pd.DataFrame:
+    checkpoint = extract_to_chunks(
+        limit=limit,
+        max_pages=max_pages,
+        resume=resume,
+        pushdown=pushdown,
+        api_url=api_url,
+    )
+    if not checkpoint["rows"]:
         print("No se obtuvieron datos Colombia")
         return pd.DataFrame(columns=config.CANONICAL_COLUMNS)
-    df_canonical = to_canonical(df_raw)
+    df_canonical = to_canonical_from_chunks()
     if save:
-        save_outputs(df_raw, df_canonical)
+        save_outputs(df_canonical)
     return df_canonical
 
 
 if __name__ == "__main__":
-    run()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extractor Colombia (DKAN postdata).")
+    parser.add_argument("--limit", type=int, default=100, help="Registros por pagina.")
+    parser.add_argument("--max-pages", type=int, default=None, help="Maximo de paginas en esta ejecucion.")
+    parser.add_argument("--no-resume", action="store_true", help="Ignorar checkpoint y extraer desde cero.")
+    parser.add_argument(
+        "--pushdown",
+        choices=["auto", *PUSHDOWN_MODES],
+        default="auto",
+        help="Filtro/proyeccion en el servidor (none = descarga completa).",
+    )
+    parser.add_argument("--api-url", default=None, help="Base URL del datastore (p.ej. un DKAN local de pruebas).")
+    args = parser.parse_args()
+
+    metrics.start_reporter()
+    run(
+        limit=args.limit,
+        max_pages=args.max_pages,
+        resume=not args.no_resume,
+        pushdown=args.pushdown,
+        api_url=args.api_url,
+    )
 
@@ -11,7 +11,8 @@ import pandas as pd
 
 sys.path.append(str(Path(__file__).parent.parent))
 import config
-from scripts.extract_utils import normalize_colname, month_to_quarter
+from scripts import metrics, schema_registry
+from scripts.extract_utils import normalize_colname, month_to_quarter, operator_key
 
 
 SOURCE_TAG = "arcotel_xlsx"
@@ -25,65 +26,127 @@ def _find_column(columns_norm: dict[str, str], candidates: list[str]) -> str | N
     return None
 
 
-def _read_file(path: Path) -> pd.DataFrame:
+SHEET_NAME = "D Prestador"
+MONTH_DATE_RE = re.compile(r"20\d{2}-\d{2}-\d{2}")
+MONTH_SHORT_RE = re.compile(r"\b(ene|feb|mar|abr|may|jun|jul|ago|sep|oct|nov|dic)[-_ ]?\d{2,4}\b")
+YEAR_RE = re.compile(r"20\d{2}")
+
+
+def resolve_columns(columns) -> dict[str, str | None]:
+    """Mapea las columnas que usa el canonico a partir del encabezado."""
+    cols_norm = {normalize_colname(c): c for c in columns}
+    mapping = {
+        "no": _find_column(cols_norm, ["no"]),
+        "operador": _find_column(cols_norm, ["empresa", "operador", "prestador", "proveedor"]),
+        "accesos": _find_column(cols_norm, ["acceso", "abonado", "conexion", "cuenta", "suscriptor"]),
+        "id": _find_column(cols_norm, ["id", "ruc", "identificacion"]),
+        "year": _find_column(cols_norm, ["ano", "anio", "year"]),
+        "quarter": _find_column(cols_norm, ["trimestre", "quarter"]),
+        "month": _find_column(cols_norm, ["mes", "month"]),
+    }
+    return {key: str(value) if value is not None else None for key, value in mapping.items()}
+
+
+def monthly_columns(columns) -> list:
+    """Columnas mensuales del trimestre (suelen venir como fechas en el header)."""
+    monthly_cols = []
+    for column in columns:
+        is_timestamp = isinstance(column, pd.Timestamp)
+        looks_date = bool(MONTH_DATE_RE.search(str(column)))
+        looks_month_short = bool(MONTH_SHORT_RE.search(str(column).lower()))
+        if is_timestamp or looks_date or looks_month_short:
+            monthly_cols.append(column)
+    return monthly_cols
+
+
+def _find_header_row(raw: pd.DataFrame, path: Path) -> int:
+    for idx in raw.index[:60]:
+        values = [normalize_colname(v) for v in raw.loc[idx].tolist() if pd.notna(v)]
+        has_prestadores = any(value == "prestadores" or "prestadores" in value for value in values)
+        has_no = any(value == "no" for value in values)
+        has_month_or_total = any(
+            bool(YEAR_RE.search(value)) or "cuentas_de_internet" in value for value in values
+        )
+        if has_prestadores and has_no and has_month_or_total:
+            return int(idx)
+    raise ValueError(f"No se encontro encabezado de tabla en hoja '{SHEET_NAME}' para {path.name}.")
+
+
+def _build_headers(row: list) -> list:
+    headers = []
+    seen = {}
+    for col_idx, value in enumerate(row):
+        if pd.isna(value):
+            header = f"col_{col_idx}"
+        else:
+            header = str(value).strip()
+        count = seen.get(header, 0)
+        if count:
+            header = f"{header}_{count}"
+        seen[str(value).strip() if pd.notna(value) else f'col_{col_idx}'] = count + 1
+        headers.append(header)
+    return headers
+
+
+def _layout_from_headers(reader: dict, headers: list) -> dict:
+    return {
+        "lector": reader,
+        "encabezado": headers,
+        "columnas": resolve_columns(headers),
+        "mensuales": [str(column) for column in monthly_columns(headers)],
+    }
+
+
+def _read_file(path: Path) -> tuple[pd.DataFrame, dict]:
+    """Lee el archivo y devuelve (DataFrame, layout del registro de esquemas)."""
     if path.suffix.lower() in {".xlsx", ".xls"}:
         # Los reportes ARCOTEL traen encabezado visual y la tabla real
         # suele iniciar varias filas mas abajo en la hoja "D Prestador".
-        raw = pd.read_excel(path, sheet_name="D Prestador", header=None)
+        raw = pd.read_excel(path, sheet_name=SHEET_NAME, header=None)
         raw = raw.dropna(axis=1, how="all")
 
-        header_idx = None
-        for idx in raw.index[:60]:
-            values = [normalize_colname(v) for v in raw.loc[idx].tolist() if pd.notna(v)]
-            has_prestadores = any(value == "prestadores" or "prestadores" in value for value in values)
-            has_no = any(value == "no" for value in values)
-            has_month_or_total = any(
-                bool(re.search(r"20\d{2}", value)) or "cuentas_de_internet" in value for value in values
-            )
-            if has_prestadores and has_no and has_month_or_total:
-                header_idx = idx
-                break
-
-        if header_idx is None:
-            raise ValueError(
-                f"No se encontro encabezado de tabla en hoja 'D Prestador' para {path.name}."
-            )
-
-        headers = []
-        seen = {}
-        for col_idx, value in enumerate(raw.loc[header_idx].tolist()):
-            if pd.isna(value):
-                header = f"col_{col_idx}"
-            else:
-                header = str(value).strip()
-            count = seen.get(header, 0)
-            if count:
-                header = f"{header}_{count}"
-            seen[str(value).strip() if pd.notna(value) else f'col_{col_idx}'] = count + 1
-            headers.append(header)
+        def read_header(reader: dict) -> list:
+            return _build_headers(raw.loc[reader["header_row"]].tolist())
+
+        def detect() -> dict:
+            reader = {"sheet": SHEET_NAME, "header_row": _find_header_row(raw, path)}
+            return _layout_from_headers(reader, read_header(reader))
+
+        layout = schema_registry.resolve_layout("ECU", path, read_header=read_header, detect=detect)
+        header_idx = layout["lector"]["header_row"]
 
         df = raw.loc[header_idx + 1 :].copy()
-        df.columns = headers
+        df.columns = _build_headers(raw.loc[header_idx].tolist())
         df = df.dropna(how="all").reset_index(drop=True)
 
         # Limpiar fila de total si viene al final.
-        cols_norm = {normalize_colname(c): c for c in df.columns}
-        operador_col = _find_column(cols_norm, ["prestador", "empresa", "operador", "proveedor"])
+        operador_col = layout["columnas"]["operador"]
         if operador_col:
             mask_total = df[operador_col].astype(str).str.contains("total", case=False, na=False)
             df = df.loc[~mask_total].copy()
 
-        return df
+        return df, layout
     if path.suffix.lower() == ".csv":
-        return pd.read_csv(path, sep=";", encoding="latin1")
+        reader = {"sep": ";", "encoding": "latin1"}
+        df = pd.read_csv(path, **reader)
+
+        layout = schema_registry.resolve_layout(
+            "ECU",
+            path,
+            read_header=lambda _reader: list(df.columns),
+            detect=lambda: _layout_from_headers(reader, list(df.columns)),
+        )
+        return df, layout
     raise ValueError(f"Formato no soportado para Ecuador: {path}")
 
 
-def _infer_year_quarter(df: pd.DataFrame, source_name: str) -> tuple[pd.Series, pd.Series]:
-    cols_norm = {normalize_colname(c): c for c in df.columns}
-    year_col = _find_column(cols_norm, ["ano", "anio", "year"])
-    quarter_col = _find_column(cols_norm, ["trimestre", "quarter"])
-    month_col = _find_column(cols_norm, ["mes", "month"])
+def _infer_year_quarter(
+    df: pd.DataFrame, source_name: str, mapping: dict[str, str | None] | None = None
+) -> tuple[pd.Series, pd.Series]:
+    mapping = mapping or resolve_columns(df.columns)
+    year_col = mapping["year"]
+    quarter_col = mapping["quarter"]
+    month_col = mapping["month"]
 
     if year_col and quarter_col:
         anno = pd.to_numeric(df[year_col], errors="coerce")
@@ -97,7 +160,7 @@ def _infer_year_quarter(df: pd.DataFrame, source_name: str) -> tuple[pd.Series,
         return anno, trimestre
 
     # Fallback por nombre de archivo: ..._sep_2025.xlsx
-    year_match = re.search(r"(20\d{2})", source_name)
+    year_match = YEAR_RE.search(source_name)
     month_map = {
         "ene": 1,
         "feb": 2,
@@ -120,7 +183,7 @@ def _infer_year_quarter(df: pd.DataFrame, source_name: str) -> tuple[pd.Series,
             break
 
     if year_match and month_value:
-        anno = pd.Series([int(year_match.group(1))] * len(df))
+        anno = pd.Series([int(year_match.group(0))] * len(df))
         trimestre = pd.Series([month_to_quarter(month_value)] * len(df))
         return anno, trimestre
 
@@ -129,20 +192,21 @@ def _infer_year_quarter(df: pd.DataFrame, source_name: str) -> tuple[pd.Series,
     )
 
 
-def normalize_to_canonical(df_raw: pd.DataFrame, source_name: str) -> pd.DataFrame:
-    cols_norm = {normalize_colname(c): c for c in df_raw.columns}
-
-    no_col = _find_column(cols_norm, ["no"])
-    operador_col = _find_column(cols_norm, ["empresa", "operador", "prestador", "proveedor"])
-    accesos_col = _find_column(cols_norm, ["acceso", "abonado", "conexion", "cuenta", "suscriptor"])
-    id_col = _find_column(cols_norm, ["id", "ruc", "identificacion"])
+def normalize_to_canonical(df_raw: pd.DataFrame, source_name: str, layout: dict | None = None) -> pd.DataFrame:
+    if layout is None:
+        layout = _layout_from_headers({}, list(df_raw.columns))
+    mapping = layout["columnas"]
+    no_col = mapping["no"]
+    operador_col = mapping["operador"]
+    accesos_col = mapping["accesos"]
+    id_col = mapping["id"]
 
     if not operador_col or not accesos_col:
         raise ValueError(
             f"No fue posible mapear columnas minimas en Ecuador (operador/accesos). Columnas: {list(df_raw.columns)}"
         )
 
-    anno, trimestre = _infer_year_quarter(df_raw, source_name=source_name)
+    anno, trimestre = _infer_year_quarter(df_raw, source_name=source_name, mapping=mapping)
 
     df = df_raw.copy()
     # Regla de negocio validada: en ARCOTEL D Prestador solo filas con "No." numerico.
@@ -151,19 +215,13 @@ def normalize_to_canonical(df_raw: pd.DataFrame, source_name: str) -> pd.DataFra
 
     df["__operador"] = df[operador_col].astype(str).str.strip()
     df["__id_operador"] = (
-        df[id_col].astype(str).str.strip() if id_col else df["__operador"].str.upper().str.replace(r"\s+", "_", regex=True)
+        df[id_col].astype(str).str.strip() if id_col else df["__operador"].map(operator_key)
     )
     df["__anno"] = anno
     df["__trimestre"] = trimestre
 
     # Priorizar columnas mensuales del trimestre (suelen venir como fechas en el header).
-    monthly_cols = []
-    for column in df.columns:
-        is_timestamp = isinstance(column, pd.Timestamp)
-        looks_date = bool(re.search(r"20\d{2}-\d{2}-\d{2}", str(column)))
-        looks_month_short = bool(re.search(r"\b(ene|feb|mar|abr|may|jun|jul|ago|sep|oct|nov|dic)[-_ ]?\d{2,4}\b", str(column).lower()))
-        if is_timestamp or looks_date or looks_month_short:
-            monthly_cols.append(column)
+    monthly_cols = schema_registry.columns_by_name(df.columns, layout["mensuales"])
 
     if monthly_cols:
         month_values = df[monthly_cols].apply(pd.to_numeric, errors="coerce")
@@ -200,13 +258,15 @@ def run(source_files: list[str] | None = None, save: bool = True) -> pd.DataFram
 
     canonical_parts = []
     raw_parts = []
-    for file_path in source_files:
-        path = Path(file_path).expanduser()
-        print(f"Leyendo Ecuador: {path}")
-        raw_df = _read_file(path)
-        canonical_df = normalize_to_canonical(raw_df, source_name=path.name)
-        canonical_parts.append(canonical_df)
-        raw_parts.append(raw_df)
+    with metrics.stage("ecuador_parse") as progress:
+        for file_path in source_files:
+            path = Path(file_path).expanduser()
+            print(f"Leyendo Ecuador: {path}")
+            raw_df, layout = _read_file(path)
+            canonical_df = normalize_to_canonical(raw_df, source_name=path.name, layout=layout)
+            canonical_parts.append(canonical_df)
+            raw_parts.append(raw_df)
+            progress.advance(len(raw_df))
 
     canonical = pd.concat(canonical_parts, ignore_index=True)
     raw_joined = pd.concat(raw_parts, ignore_index=True)
@@ -3,6 +3,9 @@ Extractor Peru: datasets OSIPTEL desde archivos CSV/XLSX.
 """
 from __future__ import annotations
 
+import codecs
+import csv
+import os
 from pathlib import Path
 import sys
 
@@ -10,10 +13,13 @@ import pandas as pd
 
 sys.path.append(str(Path(__file__).parent.parent))
 import config
-from scripts.extract_utils import normalize_colname, month_to_quarter
+from scripts import metrics, schema_registry
+from scripts.extract_utils import combine_partials, normalize_colname, month_to_quarter, operator_key
 
 
 SOURCE_TAG = "osiptel_open_data"
+SNIFF_BYTES = 64 * 1024
+CHUNK_ROWS = 200_000
 
 
 def _find_column(columns_norm: dict[str, str], candidates: list[str]) -> str | None:
@@ -24,36 +30,67 @@ def _find_column(columns_norm: dict[str, str], candidates: list[str]) -> str | N
     return None
 
 
-def _read_file(path: Path) -> pd.DataFrame:
-    if path.suffix.lower() in {".xlsx", ".xls"}:
-        return pd.read_excel(path, header=3)
-    if path.suffix.lower() == ".csv":
-        attempts = [
-            {"sep": ";", "encoding": "latin1"},
-            {"sep": ";", "encoding": "utf-8"},
-            {"encoding": "latin1"},
-            {},
-        ]
-        for kwargs in attempts:
-            try:
-                df = pd.read_csv(path, **kwargs)
-                # Si queda una sola columna con ';', se parseo mal.
-                if len(df.columns) == 1 and ";" in str(df.columns[0]):
-                    continue
-                return df
-            except Exception:
-                continue
-        raise ValueError(f"No se pudo leer CSV de Peru con separadores/encodings comunes: {path}")
-    raise ValueError(f"Formato no soportado para Peru: {path}")
-
-
-def _parse_period(df: pd.DataFrame) -> tuple[pd.Series, pd.Series]:
-    cols_norm = {normalize_colname(c): c for c in df.columns}
-    year_col = _find_column(cols_norm, ["ano", "anio", "year"])
-    quarter_col = _find_column(cols_norm, ["trimestre", "quarter"])
-    month_col = _find_column(cols_norm, ["mes", "month"])
-    period_col = _find_column(cols_norm, ["periodo"])
-    date_col = _find_column(cols_norm, ["fecha", "date"])
+def _sniff_encoding(sample: bytes) -> str:
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # final=False: un caracter multibyte cortado al final de la muestra no es error.
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin1"
+
+
+def sniff_csv(path: Path, sample_bytes: int = SNIFF_BYTES) -> dict:
+    """
+    Detecta encoding, separador y fila de encabezado leyendo solo el inicio del archivo.
+    """
+    with open(path, "rb") as handle:
+        sample = handle.read(sample_bytes)
+
+    encoding = _sniff_encoding(sample)
+    text = sample.decode(encoding, errors="replace")
+    lines = text.splitlines()
+    if len(sample) == sample_bytes and len(lines) > 1:
+        lines = lines[:-1]  # ultima linea posiblemente incompleta
+
+    try:
+        sep = csv.Sniffer().sniff("\n".join(lines[:50]), delimiters=";,\t|").delimiter
+    except csv.Error:
+        counts = {candidate: sum(line.count(candidate) for line in lines[:50]) for candidate in ";,\t|"}
+        sep = max(counts, key=counts.get)
+
+    # Encabezado: primera linea con el numero de campos modal (saltando preambulos).
+    widths = [len(next(csv.reader([line], delimiter=sep))) if line.strip() else 0 for line in lines[:50]]
+    modal = max(set(w for w in widths if w > 1), key=widths.count, default=1)
+    header_row = next((idx for idx, width in enumerate(widths) if width == modal), 0)
+    return {"encoding": encoding, "sep": sep, "header_row": header_row}
+
+
+def resolve_columns(columns) -> dict[str, str | None]:
+    """
+    Mapea columnas de operador, accesos, id y periodo usando solo el encabezado.
+    """
+    cols_norm = {normalize_colname(c): c for c in columns}
+    return {
+        "operador": _find_column(cols_norm, ["empresa", "operador", "prestadora", "proveedor"]),
+        "accesos": _find_column(cols_norm, ["conexion", "acceso", "abonado", "linea", "cuenta"]),
+        "id": _find_column(cols_norm, ["id", "ruc", "identificacion"]),
+        "year": _find_column(cols_norm, ["ano", "anio", "year"]),
+        "quarter": _find_column(cols_norm, ["trimestre", "quarter"]),
+        "month": _find_column(cols_norm, ["mes", "month"]),
+        "period": _find_column(cols_norm, ["periodo"]),
+        "date": _find_column(cols_norm, ["fecha", "date"]),
+    }
+
+
+def _parse_period(df: pd.DataFrame, mapping: dict[str, str | None] | None = None) -> tuple[pd.Series, pd.Series]:
+    mapping = mapping or resolve_columns(df.columns)
+    year_col = mapping["year"]
+    quarter_col = mapping["quarter"]
+    month_col = mapping["month"]
+    period_col = mapping["period"]
+    date_col = mapping["date"]
 
     if year_col and quarter_col:
         return pd.to_numeric(df[year_col], errors="coerce"), pd.to_numeric(df[quarter_col], errors="coerce")
@@ -102,42 +139,32 @@ def _parse_period(df: pd.DataFrame) -> tuple[pd.Series, pd.Series]:
     )
 
 
-def normalize_to_canonical(df_raw: pd.DataFrame) -> pd.DataFrame:
-    cols_norm = {normalize_colname(c): c for c in df_raw.columns}
-
-    operador_col = _find_column(cols_norm, ["empresa", "operador", "prestadora", "proveedor"])
-    accesos_col = _find_column(cols_norm, ["conexion", "acceso", "abonado", "linea", "cuenta"])
-    id_col = _find_column(cols_norm, ["id", "ruc", "identificacion"])
+def normalize_to_canonical(df_raw: pd.DataFrame, mapping: dict[str, str | None] | None = None) -> pd.DataFrame:
+    mapping = mapping or resolve_columns(df_raw.columns)
+    operador_col = mapping["operador"]
+    accesos_col = mapping["accesos"]
+    id_col = mapping["id"]
 
     if not operador_col or not accesos_col:
         raise ValueError(
             f"No fue posible mapear columnas minimas en Peru (operador/accesos). Columnas: {list(df_raw.columns)}"
         )
 
-    anno, trimestre = _parse_period(df_raw)
-
-    df = df_raw.copy()
-    df["__operador"] = df[operador_col].astype(str).str.strip()
-    df["__id_operador"] = (
-        df[id_col].astype(str).str.strip() if id_col else df["__operador"].str.upper().str.replace(r"\s+", "_", regex=True)
-    )
-    df["__anno"] = anno
-    df["__trimestre"] = trimestre
-    df["__num_accesos"] = pd.to_numeric(df[accesos_col], errors="coerce").fillna(0)
-
-    grouped = (
-        df.groupby(["__id_operador", "__operador", "__anno", "__trimestre"], as_index=False)["__num_accesos"]
-        .sum()
-        .rename(
-            columns={
-                "__id_operador": "id_operador",
-                "__operador": "operador",
-                "__anno": "anno",
-                "__trimestre": "trimestre",
-                "__num_accesos": "num_accesos",
-            }
-        )
+    anno, trimestre = _parse_period(df_raw, mapping)
+
+    # Solo las columnas que se agregan; no se copia el frame crudo.
+    operador = df_raw[operador_col].astype(str).str.strip()
+    df = pd.DataFrame(
+        {
+            "id_operador": df_raw[id_col].astype(str).str.strip() if id_col else operador.map(operator_key),
+            "operador": operador,
+            "anno": anno,
+            "trimestre": trimestre,
+            "num_accesos": pd.to_numeric(df_raw[accesos_col], errors="coerce").fillna(0),
+        },
+        index=df_raw.index,
     )
+    grouped = df.groupby(["id_operador", "operador", "anno", "trimestre"], as_index=False)["num_accesos"].sum()
 
     grouped["pais"] = "PER"
     grouped["fuente"] = SOURCE_TAG
@@ -148,35 +175,188 @@ def normalize_to_canonical(df_raw: pd.DataFrame) -> pd.DataFrame:
     return canonical
 
 
-def run(source_files: list[str] | None = None, save: bool = True) -> pd.DataFrame:
+def _usecols(mapping: dict[str, str | None]) -> list[str]:
+    return list(dict.fromkeys(col for col in mapping.values() if col))
+
+
+def _read_header(path: Path, reader: dict) -> list:
+    if path.suffix.lower() in {".xlsx", ".xls"}:
+        return list(pd.read_excel(path, header=reader["header_row"], nrows=0).columns)
+    return list(
+        pd.read_csv(
+            path, sep=reader["sep"], encoding=reader["encoding"], skiprows=reader["header_row"], nrows=0
+        ).columns
+    )
+
+
+def _probe_header(path: Path, reader: dict) -> list:
+    """Encabezado con parametros de un layout conocido; descarta encodings que no aplican."""
+    if path.suffix.lower() == ".csv" and "encoding" in reader:
+        with open(path, "rb") as handle:
+            # Un encabezado ASCII se lee igual en cualquier encoding: se valida con la muestra.
+            if _sniff_encoding(handle.read(SNIFF_BYTES)) != reader["encoding"]:
+                raise ValueError("encoding distinto al del layout")
+    return _read_header(path, reader)
+
+
+def _detect_layout(path: Path) -> dict:
+    if path.suffix.lower() in {".xlsx", ".xls"}:
+        reader = {"header_row": 3}
+    else:
+        reader = sniff_csv(path)
+        print(f"  Dialecto CSV: encoding={reader['encoding']} sep={reader['sep']!r} header={reader['header_row']}")
+    header = _read_header(path, reader)
+    return {"lector": reader, "encabezado": header, "columnas": resolve_columns(header)}
+
+
+def resolve_layout(path: Path) -> dict:
+    """Layout del archivo desde el registro de esquemas (deteccion solo si es nuevo)."""
+    if path.suffix.lower() not in {".csv", ".xlsx", ".xls"}:
+        raise ValueError(f"Formato no soportado para Peru: {path}")
+    return schema_registry.resolve_layout(
+        "PER", path, read_header=lambda reader: _probe_header(path, reader), detect=lambda: _detect_layout(path)
+    )
+
+
+def iter_file_chunks(
+    path: Path, chunksize: int = CHUNK_ROWS, all_columns: bool = False, encoding: str | None = None
+):
+    """
+    Itera un archivo Peru en bloques con el mapeo de columnas del registro de esquemas.
+
+    Devuelve (mapping, iterador de DataFrames). Con `all_columns=False` solo se
+    leen las columnas que usa el canonico.
+    """
+    layout = resolve_layout(path)
+    reader, mapping = dict(layout["lector"]), layout["columnas"]
+    usecols = None if all_columns else _usecols(mapping)
+    if path.suffix.lower() in {".xlsx", ".xls"}:
+        # Excel no se puede leer por bloques: se proyecta y se entrega en un solo bloque.
+        return mapping, iter([pd.read_excel(path, header=reader["header_row"], usecols=usecols)])
+
+    if encoding and encoding != reader["encoding"]:
+        reader["encoding"] = encoding
+        schema_registry.register({**layout, "lector": reader}, path)
+
+    # Tipos desde el encabezado: ids y nombres como texto (RUC con ceros a la izquierda).
+    text_cols = [col for col in (mapping["operador"], mapping["id"]) if col]
+    chunks = pd.read_csv(
+        path,
+        sep=reader["sep"],
+        encoding=reader["encoding"],
+        skiprows=reader["header_row"],
+        usecols=usecols,
+        dtype={col: str for col in text_cols},
+        chunksize=chunksize,
+    )
+    return mapping, chunks
+
+
+def to_canonical_streaming(path: Path, chunksize: int = CHUNK_ROWS, raw_writer=None) -> pd.DataFrame:
+    """
+    Canonico de un archivo leyendo por bloques y agregando cada bloque.
+
+    `raw_writer` (opcional) recibe los bloques crudos completos para guardar el
+    raw en streaming; sin writer solo se leen las columnas necesarias.
+    """
+    encoding = None
+    while True:
+        if raw_writer is not None:
+            raw_writer.begin_file()
+        mapping, chunks = iter_file_chunks(
+            path, chunksize=chunksize, all_columns=raw_writer is not None, encoding=encoding
+        )
+        partials = []
+        try:
+            with metrics.stage("peru_parse") as progress:
+                for chunk in chunks:
+                    if raw_writer is not None:
+                        raw_writer.write(chunk)
+                    partials.append(normalize_to_canonical(chunk, mapping))
+                    progress.advance(len(chunk))
+        except UnicodeDecodeError:
+            if encoding == "latin1":
+                raise
+            # La muestra era UTF-8 valido pero el resto del archivo no: se relee en latin1.
+            if raw_writer is not None:
+                raw_writer.rollback()
+            encoding = "latin1"
+            continue
+        return combine_partials(partials)
+
+
+class RawCsvWriter:
+    """
+    Escribe el raw unido de varios archivos por bloques en un solo CSV.
+
+    Las columnas son la union de los encabezados en orden de aparicion (como
+    `pd.concat`), calculada de antemano para no reescribir el archivo.
+    """
+
+    def __init__(self, path: Path, columns: list[str]):
+        self.path = path
+        self.columns = columns
+        self._tmp_path = path.with_name(f".{path.name}.tmp")
+        self._handle = open(self._tmp_path, "w", encoding="utf-8", newline="")
+        pd.DataFrame(columns=columns).to_csv(self._handle, index=False)
+        self._file_start = self._handle.tell()
+
+    def begin_file(self) -> None:
+        self._file_start = self._handle.tell()
+
+    def rollback(self) -> None:
+        self._handle.seek(self._file_start)
+        self._handle.truncate()
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        chunk.reindex(columns=self.columns).to_csv(self._handle, index=False, header=False)
+
+    def close(self) -> Path:
+        self._handle.close()
+        os.replace(self._tmp_path, self.path)
+        return self.path
+
+
+def run(
+    source_files: list[str] | None = None,
+    save: bool = True,
+    save_raw: bool = False,
+    chunksize: int = CHUNK_ROWS,
+) -> pd.DataFrame:
     source_files = source_files or config.PERU_SOURCE_FILES
     if not source_files:
         raise ValueError("No hay archivos fuente para Peru. Pasa source_files o configura PERU_SOURCE_FILES.")
 
+    paths = [Path(file_path).expanduser() for file_path in source_files]
+    raw_writer = None
+    if save and save_raw:
+        columns = list(dict.fromkeys(col for path in paths for col in resolve_layout(path)["encabezado"]))
+        raw_writer = RawCsvWriter(config.RAW_DATA_DIR / config.RAW_PER_FILENAME, columns)
+
     canonical_parts = []
-    raw_parts = []
-    for file_path in source_files:
-        path = Path(file_path).expanduser()
+    for path in paths:
         print(f"Leyendo Peru: {path}")
-        raw_df = _read_file(path)
-        canonical_df = normalize_to_canonical(raw_df)
-        canonical_parts.append(canonical_df)
-        raw_parts.append(raw_df)
+        canonical_parts.append(to_canonical_streaming(path, chunksize=chunksize, raw_writer=raw_writer))
 
     canonical = pd.concat(canonical_parts, ignore_index=True)
-    raw_joined = pd.concat(raw_parts, ignore_index=True)
 
     if save:
-        raw_path = config.RAW_DATA_DIR / config.RAW_PER_FILENAME
+        if raw_writer is not None:
+            print(f"Raw Peru guardado: {raw_writer.close()}")
         canonical_path = config.RAW_DATA_DIR / "canonical_peru.csv"
-        raw_joined.to_csv(raw_path, index=False)
         canonical.to_csv(canonical_path, index=False)
-        print(f"Raw Peru guardado: {raw_path}")
         print(f"Canonico Peru guardado: {canonical_path}")
 
     return canonical
 
 
 if __name__ == "__main__":
-    run()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extractor Peru (OSIPTEL) por bloques.")
+    parser.add_argument("files", nargs="*", help="Archivos CSV/XLSX (default: PERU_SOURCE_FILES).")
+    parser.add_argument("--save-raw", action="store_true", help="Guarda tambien el raw unido (en streaming).")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_ROWS, help="Filas por bloque al leer CSV.")
+    args = parser.parse_args()
 
+    run(source_files=args.files or None, save_raw=args.save_raw, chunksize=args.chunksize)
@@ -3,9 +3,17 @@ Utilidades compartidas para extractores multi-pais.
 """
 from __future__ import annotations
 
+from functools import lru_cache
+from pathlib import Path
 import re
+import sys
 import unicodedata
 
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+import config
+
 
 def normalize_colname(value: str) -> str:
     """Normaliza nombres de columnas para matching flexible."""
@@ -23,3 +31,67 @@ def month_to_quarter(month: int) -> int:
         raise ValueError(f"Mes invalido: {month}")
     return ((month - 1) // 3) + 1
 
+
+
+# Sufijos societarios que no distinguen operadores. El orden importa:
+# se remueve el primer patron que coincida y se vuelve a empezar.
+_OPERATOR_SUFFIX_PATTERNS = [
+    re.compile(pattern, flags=re.IGNORECASE)
+    for pattern in [
+        r"\s+EN\s+LIQUIDACION\s*$",
+        r"\s+BIC\s*$",
+        r"\s+ZOMAC\s*$",
+        r"\s*E\.?\s*S\.?\s*P\.?\s*$",
+        r"\s*S\.?\s*A\.?\s*S\.?\s*$",
+        r"\s*S\.?\s*A\.?\s*$",
+        r"\s*L\.?\s*T\.?\s*D\.?\s*A\.?\s*$",
+        r"\s*S\.?\s*R\.?\s*L\.?\s*$",
+        r"\s*S\.?\s*A\.?\s*C\.?\s*$",
+        r"\s*C\.?\s*L\.?\s*T\.?\s*D\.?\s*A\.?\s*$",
+        r"\s*&\s*CIA\.?\s*$",
+        r"\s+Y\s+CIA\.?\s*$",
+        r"\s+C\.?\s*I\.?\s*A\.?\s*$",
+    ]
+]
+_TRAILING_PUNCT_RE = re.compile(r"[\s,.\-]+$")
+_NON_ALNUM_RE = re.compile(r"[^A-Z0-9]+")
+
+
+@lru_cache(maxsize=None)
+def clean_operator_name(name: str) -> str:
+    """Limpia sufijos corporativos del nombre de operador (memoizado)."""
+    cleaned = str(name).strip().upper()
+    changed = True
+    while changed:
+        changed = False
+        for pattern in _OPERATOR_SUFFIX_PATTERNS:
+            new_value = pattern.sub("", cleaned)
+            if new_value != cleaned:
+                cleaned = new_value.strip()
+                changed = True
+                break
+    return _TRAILING_PUNCT_RE.sub("", cleaned).strip()
+
+
+@lru_cache(maxsize=None)
+def normalize_operator_name(name: str) -> str:
+    """Nombre de operador sin sufijos, tildes ni puntuacion (tokens separados por espacio)."""
+    value = unicodedata.normalize("NFKD", clean_operator_name(name))
+    value = "".join(ch for ch in value if not unicodedata.combining(ch))
+    return _NON_ALNUM_RE.sub(" ", value.upper()).strip()
+
+
+def combine_partials(partials: list[pd.DataFrame]) -> pd.DataFrame:
+    """Une canonicos parciales (por bloque/chunk) y re-agrega por llave canonica."""
+    if not partials:
+        return pd.DataFrame(columns=config.CANONICAL_COLUMNS)
+    combined = pd.concat(partials, ignore_index=True)
+    combined = combined.groupby(
+        ["pais", "id_operador", "operador", "anno", "trimestre", "fuente"], as_index=False
+    )["num_accesos"].sum()
+    return combined[config.CANONICAL_COLUMNS].copy()
+
+
+def operator_key(name: str) -> str:
+    """Llave estable derivada del nombre, para fuentes sin id de operador."""
+    return normalize_operator_name(name).replace(" ", "_")
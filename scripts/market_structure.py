@@ -0,0 +1,244 @@
+"""
+Estructura de mercado local (Colombia) a partir del resumen empresa/municipio/trimestre.
+
+Por trimestre se arma una matriz dispersa municipio x operador con
+`num_accesos` y todas las metricas salen de algebra dispersa (sin groupbys
+anidados):
+- HHI (0-10000), participacion del operador lider y numero de operadores
+  por municipio y por departamento (matriz indicadora depto x municipio @ M).
+- Dominancia local por operador: cuota ponderada por accesos en los
+  municipios donde opera, municipios donde lidera y cuota maxima.
+
+Los operadores ICP (`cumple_icp` en la tabla ICP) se rankean por dominancia
+local dentro de cada trimestre.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+sys.path.append(str(Path(__file__).parent.parent))
+import config
+from scripts import artifacts
+
+
+MUNICIPIOS_FILENAME = "concentracion_municipio_trimestre.csv"
+DEPARTAMENTOS_FILENAME = "concentracion_departamento_trimestre.csv"
+DOMINANCIA_FILENAME = "dominancia_local_operadores.csv"
+
+
+def build_quarter_matrices(df_resumen: pd.DataFrame) -> dict:
+    """
+    Matrices CSR municipio x operador por trimestre.
+
+    Los indices de municipio/operador se factorizan una sola vez para todo el
+    resumen, asi las matrices de distintos trimestres son comparables.
+    """
+    data = df_resumen.loc[df_resumen["num_accesos"] > 0]
+    muni_codes, municipios = pd.factorize(data["id_municipio"].astype(str), sort=True)
+    op_codes, operadores = pd.factorize(data["id_empresa"].astype(str), sort=True)
+    shape = (len(municipios), len(operadores))
+
+    matrices = {}
+    quarter_keys = data["anno"].astype(int) * 10 + data["trimestre"].astype(int)
+    for key, positions in quarter_keys.groupby(quarter_keys).indices.items():
+        # coo -> csr suma duplicados (mismo operador/municipio en varias filas).
+        matrices[(key // 10, key % 10)] = sparse.coo_matrix(
+            (
+                data["num_accesos"].to_numpy(dtype=float)[positions],
+                (muni_codes[positions], op_codes[positions]),
+            ),
+            shape=shape,
+        ).tocsr()
+
+    # Departamento de cada municipio (el ultimo reportado si cambia).
+    muni_dept = (
+        data.assign(id_municipio=data["id_municipio"].astype(str), id_departamento=data["id_departamento"].astype(str))
+        .drop_duplicates(subset=["id_municipio"], keep="last")
+        .set_index("id_municipio")
+        .reindex(municipios)
+    )
+    return {
+        "matrices": matrices,
+        "municipios": municipios,
+        "operadores": operadores,
+        "municipio_nombre": muni_dept["municipio"].to_numpy(),
+        "municipio_departamento": muni_dept["id_departamento"].to_numpy(),
+        "departamento_nombre": muni_dept.drop_duplicates(subset=["id_departamento"], keep="last")
+        .set_index("id_departamento")["departamento"],
+    }
+
+
+def _row_shares(matrix: sparse.csr_matrix) -> tuple[np.ndarray, sparse.csr_matrix]:
+    """Totales por fila y matriz de participaciones (filas vacias quedan en 0)."""
+    totals = np.asarray(matrix.sum(axis=1)).ravel()
+    inverse = np.divide(1.0, totals, out=np.zeros_like(totals), where=totals > 0)
+    return totals, sparse.diags(inverse) @ matrix
+
+
+def concentration_metrics(matrix: sparse.csr_matrix) -> pd.DataFrame:
+    """HHI, cuota del lider, numero de operadores y lider por fila de `matrix`."""
+    totals, shares = _row_shares(matrix)
+    hhi = np.asarray(shares.multiply(shares).sum(axis=1)).ravel() * 10000
+    top_share = shares.max(axis=1).toarray().ravel()
+    leader = np.asarray(shares.argmax(axis=1)).ravel()
+    return pd.DataFrame(
+        {
+            "accesos_totales": totals,
+            "num_operadores": matrix.getnnz(axis=1),
+            "hhi": hhi,
+            "cuota_lider": top_share * 100,
+            "lider_idx": leader,
+        }
+    )
+
+
+def operator_dominance(matrix: sparse.csr_matrix) -> pd.DataFrame:
+    """
+    Dominancia local por operador (columna).
+
+    `cuota_local_ponderada` = sum_m accesos_om * cuota_om / sum_m accesos_om:
+    la cuota promedio que enfrenta un usuario del operador en su municipio.
+    """
+    _, shares = _row_shares(matrix)
+    accesos = np.asarray(matrix.sum(axis=0)).ravel()
+    weighted = np.asarray(matrix.multiply(shares).sum(axis=0)).ravel()
+
+    # Lider de cada municipio con accesos; bincount cuenta liderazgos por operador.
+    active_rows = np.flatnonzero(matrix.getnnz(axis=1))
+    leaders = np.asarray(shares.argmax(axis=1)).ravel()[active_rows]
+    lead_counts = np.bincount(leaders, minlength=matrix.shape[1])
+
+    return pd.DataFrame(
+        {
+            "accesos": accesos,
+            "municipios_presencia": matrix.getnnz(axis=0),
+            "municipios_lider": lead_counts,
+            "cuota_local_ponderada": np.divide(
+                weighted, accesos, out=np.zeros_like(weighted), where=accesos > 0
+            ) * 100,
+            "cuota_local_maxima": shares.max(axis=0).toarray().ravel() * 100,
+        }
+    )
+
+
+def _period_first(df: pd.DataFrame) -> pd.DataFrame:
+    return df[["anno", "trimestre", *[c for c in df.columns if c not in {"anno", "trimestre"}]]]
+
+
+def build_market_structure(
+    df_resumen: pd.DataFrame,
+    df_icp: pd.DataFrame | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Devuelve (municipios, departamentos, dominancia) para todos los trimestres.
+
+    Con `df_icp` (tabla ICP de calculate_icp) la dominancia marca `cumple_icp`
+    y agrega `ranking_icp` por trimestre (1 = mas dominante localmente).
+    """
+    structure = build_quarter_matrices(df_resumen)
+    operadores = structure["operadores"]
+    municipios = structure["municipios"]
+    dept_codes, departamentos = pd.factorize(pd.Series(structure["municipio_departamento"]), sort=True)
+    # Indicadora depto x municipio: agrega la matriz por departamento con un producto.
+    dept_indicator = sparse.csr_matrix(
+        (np.ones(len(municipios)), (dept_codes, np.arange(len(municipios)))),
+        shape=(len(departamentos), len(municipios)),
+    )
+    nombres_operador = (
+        df_resumen.assign(id_empresa=df_resumen["id_empresa"].astype(str))
+        .drop_duplicates(subset=["id_empresa"], keep="last")
+        .set_index("id_empresa")["empresa"]
+        .reindex(operadores)
+        .to_numpy()
+    )
+
+    muni_frames, dept_frames, dom_frames = [], [], []
+    for (anno, trimestre), matrix in sorted(structure["matrices"].items()):
+        active = matrix.getnnz(axis=1) > 0
+
+        muni = concentration_metrics(matrix)
+        muni.insert(0, "id_municipio", municipios)
+        muni.insert(1, "municipio", structure["municipio_nombre"])
+        muni.insert(2, "id_departamento", structure["municipio_departamento"])
+        muni_frames.append(muni.loc[active].assign(anno=anno, trimestre=trimestre))
+
+        dept_matrix = dept_indicator @ matrix
+        dept = concentration_metrics(dept_matrix)
+        dept.insert(0, "id_departamento", departamentos)
+        dept_frames.append(dept.loc[dept_matrix.getnnz(axis=1) > 0].assign(anno=anno, trimestre=trimestre))
+
+        dom = operator_dominance(matrix)
+        dom.insert(0, "id_empresa", operadores)
+        dom.insert(1, "empresa", nombres_operador)
+        dom_frames.append(dom.loc[dom["accesos"] > 0].assign(anno=anno, trimestre=trimestre))
+
+    def _finish(frames: list[pd.DataFrame], key: str) -> pd.DataFrame:
+        df = pd.concat(frames, ignore_index=True)
+        df["operador_lider"] = operadores[df.pop("lider_idx").to_numpy()]
+        return _period_first(df).sort_values(["anno", "trimestre", key]).reset_index(drop=True)
+
+    df_muni = _finish(muni_frames, "id_municipio")
+    df_dept = _finish(dept_frames, "id_departamento")
+    df_dept.insert(3, "departamento", df_dept["id_departamento"].map(structure["departamento_nombre"]))
+
+    df_dom = _period_first(pd.concat(dom_frames, ignore_index=True))
+    if df_icp is not None and not df_icp.empty:
+        icp_ids = set(
+            df_icp.loc[(df_icp["pais"] == "COL") & df_icp["cumple_icp"].astype(bool), "id_operador"].astype(str)
+        )
+        df_dom["cumple_icp"] = df_dom["id_empresa"].isin(icp_ids)
+        ranked = df_dom.loc[df_dom["cumple_icp"]].sort_values(
+            ["anno", "trimestre", "cuota_local_ponderada", "municipios_lider", "accesos"],
+            ascending=[True, True, False, False, False],
+        )
+        df_dom["ranking_icp"] = ranked.groupby(["anno", "trimestre"]).cumcount().add(1).reindex(df_dom.index)
+        df_dom["ranking_icp"] = df_dom["ranking_icp"].astype("Int64")
+    df_dom = df_dom.sort_values(
+        ["anno", "trimestre", "cuota_local_ponderada", "accesos"], ascending=[True, True, False, False]
+    ).reset_index(drop=True)
+
+    return df_muni, df_dept, df_dom
+
+
+def _load_icp() -> pd.DataFrame | None:
+    path = config.PROCESSED_DATA_DIR / config.OUTPUT_ICP_FILENAME
+    if not path.exists():
+        return None
+    return pd.read_csv(path, dtype={"id_operador": str})
+
+
+def run(df_resumen: pd.DataFrame | None = None, df_icp: pd.DataFrame | None = None) -> tuple[pd.DataFrame, ...]:
+    """Calcula y guarda concentracion por municipio/departamento y dominancia por operador."""
+    if df_resumen is None:
+        df_resumen = pd.read_csv(
+            config.PROCESSED_DATA_DIR / config.OUTPUT_RESUMEN_FILENAME,
+            dtype={"id_empresa": str, "id_municipio": str, "id_departamento": str},
+        )
+    if df_icp is None:
+        df_icp = _load_icp()
+
+    print("\nCalculando estructura de mercado local...")
+    df_muni, df_dept, df_dom = build_market_structure(df_resumen, df_icp)
+
+    outputs = [
+        (df_muni, MUNICIPIOS_FILENAME),
+        (df_dept, DEPARTAMENTOS_FILENAME),
+        (df_dom, DOMINANCIA_FILENAME),
+    ]
+    for df, filename in outputs:
+        filepath = config.PROCESSED_DATA_DIR / filename
+        artifacts.persist_csv(df, filepath)
+        print(f"Guardado: {filepath} ({len(df)} registros)")
+    if df_icp is None:
+        print("  Sin tabla ICP: la dominancia se guarda sin ranking ICP.")
+
+    return df_muni, df_dept, df_dom
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,356 @@
+"""
+Metricas en vivo de las etapas largas (extraccion, parseo, WHOIS, descargas).
+
+- `stage(nombre, total, unidad)`: progreso de una etapa (tasa y ETA).
+- Contadores e histogramas con etiquetas, en formato de texto Prometheus.
+- `start_reporter()`: hilo que cada `REPORT_SECONDS` imprime una linea por
+  etapa activa (tasa, ETA, req/s, latencia media, errores) y reescribe
+  data_ISPs/processed/pipeline_metrics.prom (textfile collector de
+  node_exporter, o `cat` para mirarlo a mano).
+- `start_worker_reporter(worker_id)`: en un proceso worker (cola WHOIS) las
+  metricas propias van a pipeline_metrics.<worker_id>.prom con la etiqueta
+  `worker`, para que los archivos de varios procesos no repitan series.
+
+Metricas expuestas:
+- isp_stage_items_total{stage}: filas/operadores procesados (rate() = filas/s).
+- isp_stage_items_expected{stage}: total esperado si se conoce.
+- isp_http_requests_total{host,outcome}: ok / throttled / error.
+- isp_http_request_seconds{host}: histograma de latencia.
+- isp_errors_total{stage,type}: errores por tipo (http_429, Timeout, ...).
+- isp_cache_lookups_total{cache,result}: hit / miss por cache.
+"""
+from __future__ import annotations
+
+import atexit
+from contextlib import contextmanager
+import math
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+
+sys.path.append(str(Path(__file__).parent.parent))
+import config
+
+
+METRICS_FILENAME = "pipeline_metrics.prom"
+REPORT_SECONDS = 10.0
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+# Etiquetas fijas del proceso (p. ej. worker="host-w0"), antepuestas a cada serie.
+_instance_labels: tuple[tuple[str, str], ...] = ()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    """Valor exacto: enteros sin decimales y floats con repr (no `:g`, que redondea a 6 digitos)."""
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer() and abs(value) < 2**53:
+        return str(int(value))
+    return repr(value)
+
+
+def _label_text(labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*_instance_labels, *zip(labelnames, values))]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        _METRICS.append(self)
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def value(self, **labels) -> float:
+        with _lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def total(self, **labels) -> float:
+        """Suma sobre las series que coinciden con las etiquetas dadas."""
+        with _lock:
+            return sum(
+                value
+                for key, value in self._values.items()
+                if all(key[self.labelnames.index(name)] == str(wanted) for name, wanted in labels.items())
+            )
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with _lock:
+            self._values[self._key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0])
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][idx] += 1
+            series[1] += value
+            self._values[key] = self._values.get(key, 0.0) + 1
+
+    def sum(self, **labels) -> float:
+        with _lock:
+            return sum(
+                series[1]
+                for key, series in self._series.items()
+                if all(key[self.labelnames.index(name)] == str(wanted) for name, wanted in labels.items())
+            )
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total) in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = _label_text(self.labelnames, key, 'le="%s"' % _format_value(bound))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            count = self._values[key]
+            labels = _label_text(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {_format_value(count)}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {_format_value(count)}")
+        return lines
+
+
+_METRICS: list[_Metric] = []
+
+STAGE_ITEMS = Counter("isp_stage_items_total", "Filas u operadores procesados por etapa.", ("stage",))
+STAGE_EXPECTED = Gauge("isp_stage_items_expected", "Total esperado de la etapa (0 si no se conoce).", ("stage",))
+HTTP_REQUESTS = Counter("isp_http_requests_total", "Requests HTTP por host y resultado.", ("host", "outcome"))
+HTTP_LATENCY = Histogram("isp_http_request_seconds", "Latencia de requests HTTP.", ("host",))
+ERRORS = Counter("isp_errors_total", "Errores por etapa y tipo.", ("stage", "type"))
+CACHE_LOOKUPS = Counter("isp_cache_lookups_total", "Consultas a caches por resultado (hit/miss).", ("cache", "result"))
+
+
+def cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def error(stage_name: str, exc_or_type) -> None:
+    kind = exc_or_type if isinstance(exc_or_type, str) else type(exc_or_type).__name__
+    ERRORS.inc(stage=stage_name, type=kind)
+
+
+class Stage:
+    """Progreso de una etapa: `advance(n)` por cada bloque procesado."""
+
+    def __init__(self, name: str, total: float | None = None, unit: str = "filas", initial: float = 0.0):
+        self.name = name
+        self.unit = unit
+        self.started = time.monotonic()
+        # `initial`: avance previo (p. ej. checkpoint); cuenta para el ETA, no para la tasa.
+        self.initial = initial
+        self.done = initial
+        self.total = total
+
+    @property
+    def total(self) -> float | None:
+        return self._total
+
+    @total.setter
+    def total(self, value: float | None) -> None:
+        self._total = value
+        STAGE_EXPECTED.set(value or 0, stage=self.name)
+
+    def advance(self, amount: float = 1) -> None:
+        self.done += amount
+        STAGE_ITEMS.inc(amount, stage=self.name)
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return (self.done - self.initial) / elapsed if elapsed > 0 else 0.0
+
+    def describe(self) -> str:
+        rate = self.rate()
+        text = f"{self.name}: {self.done:,.0f}"
+        if self.total:
+            text += f"/{self.total:,.0f}"
+        text += f" {self.unit} ({rate:,.1f}/s"
+        if self.total and rate > 0:
+            remaining = max(self.total - self.done, 0) / rate
+            text += f", ETA {_format_seconds(remaining)}"
+        return text + ")"
+
+
+_active: dict[int, Stage] = {}
+
+
+@contextmanager
+def stage(name: str, total: float | None = None, unit: str = "filas", initial: float = 0.0):
+    """Registra una etapa activa mientras dura el bloque `with`."""
+    current = Stage(name, total=total, unit=unit, initial=initial)
+    with _lock:
+        _active[id(current)] = current
+    try:
+        yield current
+    finally:
+        with _lock:
+            _active.pop(id(current), None)
+        elapsed = time.monotonic() - current.started
+        if elapsed >= REPORT_SECONDS:
+            processed = current.done - current.initial
+            print(f"[metricas] {current.name}: {processed:,.0f} {current.unit} en {_format_seconds(elapsed)}")
+
+
+def _format_seconds(seconds: float) -> str:
+    if not math.isfinite(seconds):
+        return "?"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{secs:02d}s"
+
+
+def render() -> str:
+    with _lock:
+        lines = [line for metric in _METRICS for line in metric.render()]
+    return "\n".join(lines) + "\n"
+
+
+def _metrics_path() -> Path:
+    return config.PROCESSED_DATA_DIR / METRICS_FILENAME
+
+
+def write_textfile(path: Path | None = None) -> Path:
+    """Reescribe el archivo Prometheus de forma atomica."""
+    path = path or _metrics_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(render(), encoding="utf-8")
+    os.replace(tmp_path, path)
+    return path
+
+
+class _Reporter(threading.Thread):
+    def __init__(self, interval: float, path: Path | None, live: bool):
+        super().__init__(name="metrics-reporter", daemon=True)
+        self.interval = interval
+        self.path = path
+        self.live = live
+        self.stopped = threading.Event()
+        self._last = (time.monotonic(), 0.0, 0.0, 0.0)
+
+    def _http_line(self) -> str:
+        now = time.monotonic()
+        requests_total = HTTP_REQUESTS.total()
+        latency_sum = HTTP_LATENCY.sum()
+        errors_total = ERRORS.total()
+        then, prev_requests, prev_latency, prev_errors = self._last
+        self._last = (now, requests_total, latency_sum, errors_total)
+        delta = requests_total - prev_requests
+        if not delta and errors_total == prev_errors:
+            return ""
+        latency = (latency_sum - prev_latency) / delta if delta else 0.0
+        return (
+            f"http {delta / max(now - then, 1e-9):.1f} req/s, latencia media {latency:.2f}s, "
+            f"errores +{errors_total - prev_errors:g}"
+        )
+
+    def report(self) -> None:
+        if self.live:
+            with _lock:
+                stages = list(_active.values())
+            parts = [current.describe() for current in stages]
+            http = self._http_line()
+            if http:
+                parts.append(http)
+            if parts:
+                print("[metricas] " + " | ".join(parts), flush=True)
+        try:
+            write_textfile(self.path)
+        except OSError as exc:
+            print(f"[metricas] No se pudo escribir {self.path or _metrics_path()}: {exc}")
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+
+_reporter: _Reporter | None = None
+
+
+def start_reporter(interval: float = REPORT_SECONDS, path: Path | None = None, live: bool = True) -> None:
+    """Arranca (una sola vez) el hilo de progreso + textfile; escribe al salir."""
+    global _reporter
+    if _reporter is not None:
+        return
+    _reporter = _Reporter(interval, path, live)
+    _reporter.start()
+    atexit.register(stop_reporter)
+
+
+def start_worker_reporter(worker_id: str, interval: float = REPORT_SECONDS) -> Path:
+    """
+    Reporter de un proceso worker: sin lineas de progreso, textfile propio.
+
+    Descarta lo heredado del padre (con fork llegan sus valores y un reporter
+    cuyo hilo no corre en el hijo) y etiqueta cada serie con `worker`.
+    """
+    global _reporter, _instance_labels
+    _reporter = None
+    with _lock:
+        for metric in _METRICS:
+            metric._values.clear()
+            if isinstance(metric, Histogram):
+                metric._series.clear()
+        _active.clear()
+    _instance_labels = (("worker", worker_id),)
+    path = _metrics_path().with_name(f"{Path(METRICS_FILENAME).stem}.{worker_id}.prom")
+    start_reporter(interval, path=path, live=False)
+    return path
+
+
+def stop_reporter() -> None:
+    global _reporter
+    if _reporter is None:
+        return
+    _reporter.stopped.set()
+    _reporter.join(timeout=5)
+    try:
+        write_textfile(_reporter.path)
+    except OSError:
+        pass
+    _reporter = None
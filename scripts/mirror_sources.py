@@ -0,0 +1,291 @@
+"""
+Espejo local de archivos fuente de Ecuador (ARCOTEL) y Peru (OSIPTEL).
+
+Lista de fuentes: data_ISPs/raw/fuentes_descarga.json
+    [{"pais": "ecuador", "url": "https://.../abonados_2025_T1.xlsx"},
+     {"pais": "peru", "url": "https://.../conexiones.csv", "archivo": "osiptel_conexiones.csv"}]
+
+Cada archivo se guarda en data_ISPs/raw/<pais>/ con escritura atomica y
+queda registrado en data_ISPs/raw/mirror_manifest.json (ETag, Last-Modified,
+tamano, sha256). En la siguiente corrida se pide con `If-None-Match` /
+`If-Modified-Since`: un archivo sin cambios cuesta un 304. Los caches
+posteriores pueden usar el sha256 del manifiesto (`known_hash`) en lugar de
+releer el archivo.
+
+Uso:
+    python scripts/mirror_sources.py
+    python scripts/mirror_sources.py --url ecuador=https://... --workers 4
+"""
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+import sys
+import threading
+from urllib.parse import unquote, urlparse
+
+import requests
+
+sys.path.append(str(Path(__file__).parent.parent))
+import config
+from scripts import metrics
+from scripts.rate_control import AdaptiveRateController
+
+
+SOURCES_FILENAME = "fuentes_descarga.json"
+MANIFEST_FILENAME = "mirror_manifest.json"
+COUNTRIES = {"ecuador", "peru"}
+DOWNLOAD_WORKERS = 4
+CHUNK_BYTES = 1024 * 1024
+# Los portales no publican limites; sin espera inicial, backoff ante 429/5xx.
+RATE_CONTROLLER = AdaptiveRateController(initial_interval=0.0, min_interval=0.0)
+
+
+def _manifest_path() -> Path:
+    return config.RAW_DATA_DIR / MANIFEST_FILENAME
+
+
+def load_manifest(path: Path | None = None) -> dict:
+    path = path or _manifest_path()
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_manifest(manifest: dict, path: Path | None = None) -> Path:
+    path = path or _manifest_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_sources(path: Path | None = None) -> list[dict]:
+    path = path or config.RAW_DATA_DIR / SOURCES_FILENAME
+    if not path.exists():
+        return []
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def known_hash(path: Path, manifest: dict | None = None) -> str | None:
+    """sha256 del manifiesto si el archivo local sigue igual (tamano/mtime)."""
+    manifest = load_manifest() if manifest is None else manifest
+    resolved = str(Path(path).resolve())
+    for entry in manifest.values():
+        if entry.get("ruta") != resolved or not Path(resolved).exists():
+            continue
+        stat = Path(resolved).stat()
+        if stat.st_size == entry.get("size") and int(stat.st_mtime) == entry.get("mtime"):
+            return entry.get("sha256")
+    return None
+
+
+class TargetNames:
+    """
+    Nombres de destino reservados por pais en una corrida.
+
+    Rechaza nombres invalidos (vacios, `.`/`..`, rutas, ocultos) y nombres
+    ya reservados por otra URL: dos fuentes no pueden escribir el mismo archivo.
+    """
+
+    def __init__(self):
+        self._owners: dict[tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, pais: str, name: str, url: str) -> str:
+        if name in {"", ".", ".."} or name.startswith(".") or "/" in name or "\\" in name:
+            raise ValueError(f"Nombre de archivo invalido para {url}: {name!r}")
+        with self._lock:
+            owner = self._owners.setdefault((pais, name), url)
+        if owner != url:
+            raise ValueError(f"Nombre de archivo {pais}/{name} repetido (ya lo usa {owner})")
+        return name
+
+
+def _filename_for(source: dict, response: requests.Response | None = None) -> str:
+    if source.get("archivo"):
+        return source["archivo"]
+    if response is not None:
+        match = re.search(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', response.headers.get("Content-Disposition", ""))
+        if match:
+            return Path(unquote(match.group(1))).name
+    return Path(unquote(urlparse(source["url"]).path)).name or "descarga"
+
+
+def _conditional_headers(previous: dict | None) -> dict:
+    # Solo condicional si el archivo local sigue ahi; si no, descarga completa.
+    if not previous or not Path(previous.get("ruta", "")).exists():
+        return {}
+    headers = {}
+    if previous.get("etag"):
+        headers["If-None-Match"] = previous["etag"]
+    if previous.get("last_modified"):
+        headers["If-Modified-Since"] = previous["last_modified"]
+    return headers
+
+
+def mirror_one(
+    source: dict,
+    previous: dict | None,
+    timeout: int = 120,
+    names: TargetNames | None = None,
+) -> tuple[str, dict]:
+    """
+    Descarga (condicional) una fuente y devuelve (estado, entrada de manifiesto).
+
+    Estados: `sin_cambios` (304 o mismo sha256), `nuevo`, `actualizado`.
+    El nombre de destino (incluido el de Content-Disposition) se reserva en
+    `names`; uno invalido o ya usado por otra URL es un error.
+    """
+    url = source["url"]
+    pais = source["pais"].lower()
+    if pais not in COUNTRIES:
+        raise ValueError(f"Pais no soportado para espejo: {pais}")
+    names = names or TargetNames()
+    folder = config.RAW_DATA_DIR / pais
+    folder.mkdir(parents=True, exist_ok=True)
+
+    def _download():
+        response = requests.get(url, headers=_conditional_headers(previous), timeout=timeout, stream=True)
+        if response.status_code == 304:
+            response.close()
+            return response, None, None, 0, None
+        response.raise_for_status()
+
+        try:
+            target = folder / names.claim(pais, _filename_for(source, response), url)
+        except ValueError:
+            response.close()
+            raise
+        tmp_path = target.with_name(f".{target.name}.part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with response, open(tmp_path, "wb") as handle:
+                for chunk in response.iter_content(chunk_size=CHUNK_BYTES):
+                    handle.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return response, target, tmp_path, size, digest.hexdigest()
+
+    result = RATE_CONTROLLER.call_with_retry(url, _download, max_retries=3)
+    response = result[0]
+    checked_at = datetime.now().isoformat(timespec="seconds")
+
+    if response.status_code == 304:
+        return "sin_cambios", {**previous, "verificado": checked_at}
+
+    _, target, tmp_path, size, sha256 = result
+    same_file = previous and Path(previous["ruta"]) == target.resolve() and target.exists()
+    if same_file and previous.get("sha256") == sha256:
+        # Mismo contenido con otros validadores: no se toca el archivo (ni su mtime).
+        tmp_path.unlink(missing_ok=True)
+        state = "sin_cambios"
+    else:
+        os.replace(tmp_path, target)
+        state = "actualizado" if previous else "nuevo"
+
+    stat = target.stat()
+    entry = {
+        "pais": pais,
+        "ruta": str(target.resolve()),
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "size": size,
+        "mtime": int(stat.st_mtime),
+        "sha256": sha256,
+        "descargado": checked_at if state != "sin_cambios" else previous.get("descargado", checked_at),
+        "verificado": checked_at,
+    }
+    return state, entry
+
+
+def run(
+    sources: list[dict] | None = None,
+    workers: int = DOWNLOAD_WORKERS,
+    manifest_path: Path | None = None,
+) -> dict[str, str]:
+    """Actualiza el espejo local; devuelve url -> estado (`error: ...` si fallo)."""
+    sources = load_sources() if sources is None else sources
+    if not sources:
+        print(f"Sin fuentes: definir {config.RAW_DATA_DIR / SOURCES_FILENAME} o usar --url pais=URL")
+        return {}
+
+    manifest = load_manifest(manifest_path)
+    print(f"Espejo de fuentes: {len(sources)} URLs ({workers} descargas en paralelo)")
+
+    # Nombres de destino validados antes de descargar: repetidos o invalidos no se envian.
+    states: dict[str, str] = {}
+    names = TargetNames()
+    valid = []
+    seen_urls: set[str] = set()
+    for source in sources:
+        url = source["url"]
+        try:
+            if url in seen_urls:
+                raise ValueError("URL repetida en la lista de fuentes")
+            seen_urls.add(url)
+            names.claim(source["pais"].lower(), _filename_for(source), url)
+        except ValueError as exc:
+            states.setdefault(url, f"error: {exc}")
+            metrics.error("mirror", exc)
+            print(f"  ERROR {url}: {exc}")
+            continue
+        valid.append(source)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool, metrics.stage(
+        "mirror", total=len(valid), unit="archivos"
+    ) as progress:
+        futures = {
+            source["url"]: pool.submit(mirror_one, source, manifest.get(source["url"]), names=names)
+            for source in valid
+        }
+        for url, future in futures.items():
+            try:
+                state, entry = future.result()
+            except Exception as exc:
+                states[url] = f"error: {exc}"
+                metrics.error("mirror", exc)
+                print(f"  ERROR {url}: {exc}")
+                continue
+            finally:
+                progress.advance()
+            metrics.cache_lookup("mirror", state == "sin_cambios")
+            manifest[url] = entry
+            states[url] = state
+            print(f"  {state:<12} {Path(entry['ruta']).name} ({entry['size']:,} bytes)")
+
+    save_manifest(manifest, manifest_path)
+    kinds = [state.split(":")[0] for state in states.values()]
+    summary = {kind: kinds.count(kind) for kind in dict.fromkeys(kinds)}
+    print(f"Resumen: {summary}")
+    return states
+
+
+def _parse_url_arg(value: str) -> dict:
+    pais, sep, url = value.partition("=")
+    if not sep or not url:
+        raise ValueError(f"Formato esperado pais=URL: {value}")
+    return {"pais": pais.strip().lower(), "url": url.strip()}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Espejo local de archivos fuente ARCOTEL/OSIPTEL.")
+    parser.add_argument("--url", action="append", default=[], help="Fuente adicional pais=URL (repetible).")
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS)
+    args = parser.parse_args()
+
+    extra = [_parse_url_arg(value) for value in args.url]
+    metrics.start_reporter()
+    run(sources=load_sources() + extra, workers=args.workers)
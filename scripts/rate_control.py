@@ -0,0 +1,224 @@
+"""
+Control adaptativo de tasa (AIMD) y circuit breaker por host.
+
+- Mientras la latencia y la tasa de error se mantienen bajas, el intervalo
+  entre requests baja (la tasa sube de a `increase_step` req/s).
+- Ante 429/5xx, timeouts o errores de conexion el intervalo se multiplica
+  por `backoff_factor` (respetando `Retry-After` si viene).
+- Tras `failure_threshold` fallas seguidas el circuito del host se abre por
+  `cooldown_seconds`: las llamadas fallan rapido con `CircuitOpen` y el
+  llamador re-encola el trabajo en lugar de registrarlo como vacio.
+
+Lo usan enrich (WHOIS) y extract_colombia (API DKAN).
+"""
+from __future__ import annotations
+
+from collections import deque
+import threading
+import time
+from typing import Callable, TypeVar
+from urllib.parse import urlparse
+
+import requests
+
+from scripts import metrics
+
+
+T = TypeVar("T")
+THROTTLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class Throttled(Exception):
+    """El host respondio con throttling/error transitorio; reintentar mas tarde."""
+
+    def __init__(self, host: str, retry_after: float = 0.0, reason: str = ""):
+        super().__init__(f"{host}: {reason or 'throttled'}")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class CircuitOpen(Throttled):
+    """Circuito abierto: no se envian requests al host hasta `retry_after`."""
+
+
+def _retry_after_seconds(exc: Exception) -> float:
+    response = getattr(exc, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    try:
+        return max(float(value), 0.0) if value is not None else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _error_type(exc: Exception) -> str:
+    response = getattr(exc, "response", None)
+    if response is not None:
+        return f"http_{response.status_code}"
+    return type(exc).__name__
+
+
+def is_throttle_error(exc: Exception) -> bool:
+    if isinstance(exc, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code in THROTTLE_STATUS
+    return False
+
+
+class _HostState:
+    def __init__(self, interval: float, window: int):
+        self.interval = interval
+        self.next_allowed = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.outcomes: deque[bool] = deque(maxlen=window)
+
+    def error_rate(self) -> float:
+        return (len(self.outcomes) - sum(self.outcomes)) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class AdaptiveRateController:
+    def __init__(
+        self,
+        initial_interval: float = 0.4,
+        min_interval: float = 0.05,
+        max_interval: float = 30.0,
+        increase_step: float = 0.1,
+        backoff_factor: float = 2.0,
+        backoff_floor: float = 0.5,
+        target_latency: float = 2.0,
+        max_error_rate: float = 0.1,
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 60.0,
+        window: int = 20,
+    ):
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.increase_step = increase_step
+        self.backoff_factor = backoff_factor
+        self.backoff_floor = backoff_floor
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.window = window
+        self._hosts: dict[str, _HostState] = {}
+        self._lock = threading.Lock()
+
+    def share(self, workers: int) -> "AdaptiveRateController":
+        """
+        Controlador nuevo con la tasa por host dividida entre `workers`.
+
+        Cada proceso tiene su propio controlador: con N procesos contra el
+        mismo host, cada uno debe usar 1/N de la tasa para no multiplicarla.
+        """
+        workers = max(1, int(workers))
+        return AdaptiveRateController(
+            initial_interval=self.initial_interval * workers,
+            min_interval=self.min_interval * workers,
+            max_interval=max(self.max_interval, self.min_interval * workers),
+            increase_step=self.increase_step / workers,
+            backoff_factor=self.backoff_factor,
+            backoff_floor=self.backoff_floor * workers,
+            target_latency=self.target_latency,
+            max_error_rate=self.max_error_rate,
+            failure_threshold=self.failure_threshold,
+            cooldown_seconds=self.cooldown_seconds,
+            window=self.window,
+        )
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlparse(url).netloc or url
+
+    def _state(self, host: str) -> _HostState:
+        if host not in self._hosts:
+            self._hosts[host] = _HostState(self.initial_interval, self.window)
+        return self._hosts[host]
+
+    def interval(self, host: str) -> float:
+        with self._lock:
+            return self._state(host).interval
+
+    def acquire(self, host: str) -> None:
+        """Espera el turno del host; `CircuitOpen` si el circuito esta abierto."""
+        with self._lock:
+            state = self._state(host)
+            now = time.monotonic()
+            if state.open_until > now:
+                raise CircuitOpen(host, retry_after=state.open_until - now, reason="circuito abierto")
+            start = max(now, state.next_allowed)
+            state.next_allowed = start + state.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def on_success(self, host: str, latency: float) -> None:
+        with self._lock:
+            state = self._state(host)
+            state.outcomes.append(True)
+            state.consecutive_failures = 0
+            healthy = latency <= self.target_latency and state.error_rate() <= self.max_error_rate
+            if healthy and state.interval > self.min_interval:
+                # Aumento aditivo de la tasa (req/s), no del intervalo.
+                rate = 1.0 / state.interval + self.increase_step
+                state.interval = max(self.min_interval, 1.0 / rate)
+
+    def on_throttle(self, host: str, retry_after: float = 0.0) -> None:
+        with self._lock:
+            state = self._state(host)
+            now = time.monotonic()
+            state.outcomes.append(False)
+            state.consecutive_failures += 1
+            state.interval = min(self.max_interval, max(state.interval * self.backoff_factor, self.backoff_floor))
+            state.next_allowed = max(state.next_allowed, now + max(retry_after, state.interval))
+            if state.consecutive_failures >= self.failure_threshold:
+                state.open_until = now + max(self.cooldown_seconds, retry_after)
+                state.consecutive_failures = 0
+                print(f"   Circuito abierto para {host} por {state.open_until - now:.0f}s")
+
+    def call(self, url: str, fn: Callable[[], T]) -> T:
+        """
+        Ejecuta `fn` (el request a `url`) respetando la tasa del host.
+
+        Throttling, timeouts y errores de conexion se registran y se relanzan
+        como `Throttled`; otros errores se relanzan tal cual.
+        """
+        host = self.host_of(url)
+        try:
+            self.acquire(host)
+        except CircuitOpen:
+            metrics.error("http", "CircuitOpen")
+            raise
+        started = time.monotonic()
+        try:
+            result = fn()
+        except Exception as exc:
+            metrics.HTTP_LATENCY.observe(time.monotonic() - started, host=host)
+            metrics.error("http", _error_type(exc))
+            if is_throttle_error(exc):
+                metrics.HTTP_REQUESTS.inc(host=host, outcome="throttled")
+                retry_after = _retry_after_seconds(exc)
+                self.on_throttle(host, retry_after=retry_after)
+                raise Throttled(host, retry_after=retry_after, reason=str(exc)) from exc
+            metrics.HTTP_REQUESTS.inc(host=host, outcome="error")
+            with self._lock:
+                self._state(host).outcomes.append(False)
+            raise
+        latency = time.monotonic() - started
+        metrics.HTTP_LATENCY.observe(latency, host=host)
+        metrics.HTTP_REQUESTS.inc(host=host, outcome="ok")
+        self.on_success(host, latency)
+        return result
+
+    def call_with_retry(self, url: str, fn: Callable[[], T], max_retries: int = 5) -> T:
+        """`call` con reintentos; espera a que cierre el circuito si se abre."""
+        for attempt in range(max_retries):
+            try:
+                return self.call(url, fn)
+            except CircuitOpen as exc:
+                print(f"   {exc}; esperando {exc.retry_after:.0f}s")
+                time.sleep(exc.retry_after)
+            except Throttled as exc:
+                print(f"   Reintento {attempt + 1}/{max_retries} ({exc})")
+        return self.call(url, fn)
@@ -0,0 +1,177 @@
+"""
+Registro de esquemas por layout de archivo fuente (Ecuador/Peru).
+
+Cada layout se identifica por una huella del encabezado (fuente + parametros
+de lectura + nombres de columna estructurales) y guarda el mapeo ya resuelto:
+- `lector`: parametros de lectura (hoja, fila de encabezado, encoding, separador),
+- `columnas`: operador/accesos/id/periodo (y las que use cada extractor),
+- `mensuales`: columnas mensuales (Ecuador) y `mensuales_pos`, su posicion en
+  el encabezado. Los nombres mensuales son fechas que cambian cada trimestre:
+  la huella los reemplaza por su posicion, asi el archivo del trimestre
+  siguiente reutiliza el layout y solo toma los nombres nuevos.
+
+Archivo: data_ISPs/raw/esquemas_fuentes.json
+- `layouts`: huella -> layout.
+- `archivos`: ruta -> tamano, mtime, huella y columnas mensuales del archivo
+  (atajo sin leer encabezado).
+
+Un archivo ya visto (mismo tamano/mtime) o con un encabezado de layout
+conocido usa el mapeo guardado sin deteccion; un layout nuevo se detecta
+una vez y queda registrado.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import sys
+from typing import Callable
+
+sys.path.append(str(Path(__file__).parent.parent))
+import config
+
+
+REGISTRY_FILENAME = "esquemas_fuentes.json"
+MONTHLY_PLACEHOLDER = "<mensual>"
+
+
+def _registry_path() -> Path:
+    return config.RAW_DATA_DIR / REGISTRY_FILENAME
+
+
+def load_registry(path: Path | None = None) -> dict:
+    path = path or _registry_path()
+    if not path.exists():
+        return {"layouts": {}, "archivos": {}}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_registry(registry: dict, path: Path | None = None) -> Path:
+    path = path or _registry_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(registry, indent=2, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_path, path)
+    return path
+
+
+def fingerprint(source: str, reader: dict, header: list, monthly_positions: list[int] | None = None) -> str:
+    """
+    Huella de un layout: fuente, parametros de lectura y columnas no vacias.
+
+    Las columnas en `monthly_positions` cuentan solo por su posicion.
+    """
+    masked = set(monthly_positions or [])
+    header = [MONTHLY_PLACEHOLDER if pos in masked else value for pos, value in enumerate(header)]
+    names = [str(value).strip() for value in header if str(value).strip() not in {"", "nan", "None"}]
+    payload = json.dumps([source, reader, names], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _file_key(path: Path) -> tuple[str, dict]:
+    stat = path.stat()
+    return str(path.resolve()), {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def _monthly_positions(layout: dict) -> list[int]:
+    if "mensuales_pos" in layout:
+        return list(layout["mensuales_pos"])
+    monthly = {str(name) for name in layout.get("mensuales", [])}
+    return [pos for pos, value in enumerate(layout["encabezado"]) if str(value) in monthly]
+
+
+def _for_file(layout: dict, entry: dict) -> dict:
+    """Layout con el encabezado y columnas mensuales propios del archivo."""
+    if "mensuales" not in entry:
+        return layout
+    return {**layout, "encabezado": entry["encabezado"], "mensuales": entry["mensuales"]}
+
+
+def _file_entry(stat: dict, huella: str, layout: dict, header: list) -> dict:
+    entry = {**stat, "huella": huella}
+    positions = _monthly_positions(layout)
+    if positions:
+        header = [str(value) for value in header]
+        entry["encabezado"] = header
+        entry["mensuales"] = [header[pos] for pos in positions if pos < len(header)]
+    return entry
+
+
+def resolve_layout(
+    source: str,
+    path: Path,
+    read_header: Callable[[dict], list],
+    detect: Callable[[], dict],
+    registry_path: Path | None = None,
+) -> dict:
+    """
+    Layout del archivo: primero el registro, deteccion solo si es nuevo.
+
+    `read_header(lector)` devuelve el encabezado leido con esos parametros.
+    `detect()` devuelve un layout completo (`lector`, `encabezado`, `columnas`,
+    `mensuales`) y solo se invoca si ningun layout conocido coincide.
+    """
+    registry = load_registry(registry_path)
+    key, stat = _file_key(path)
+
+    cached = registry["archivos"].get(key)
+    if cached and cached["size"] == stat["size"] and cached["mtime"] == stat["mtime"]:
+        layout = registry["layouts"].get(cached["huella"])
+        if layout:
+            return _for_file(layout, cached)
+
+    # Un encabezado por lector; cada layout conocido se prueba con sus posiciones mensuales.
+    headers: dict[str, list | None] = {}
+    for huella, layout in registry["layouts"].items():
+        if layout["fuente"] != source:
+            continue
+        reader_key = json.dumps(layout["lector"], sort_keys=True)
+        if reader_key not in headers:
+            try:
+                headers[reader_key] = read_header(layout["lector"])
+            except (UnicodeDecodeError, ValueError, KeyError, IndexError):
+                headers[reader_key] = None
+        header = headers[reader_key]
+        if header is None or len(header) != len(layout["encabezado"]):
+            continue
+        if fingerprint(source, layout["lector"], header, _monthly_positions(layout)) == huella:
+            entry = _file_entry(stat, huella, layout, header)
+            registry["archivos"][key] = entry
+            save_registry(registry, registry_path)
+            return _for_file(layout, entry)
+
+    layout = {"fuente": source, "mensuales": [], **detect()}
+    return register(layout, path, registry=registry, registry_path=registry_path)
+
+
+def cached_layout(path: Path, registry_path: Path | None = None) -> dict | None:
+    """Layout registrado del archivo si no cambio (tamano/mtime); no lee el archivo."""
+    registry = load_registry(registry_path)
+    key, stat = _file_key(path)
+    cached = registry["archivos"].get(key)
+    if cached and cached["size"] == stat["size"] and cached["mtime"] == stat["mtime"]:
+        layout = registry["layouts"].get(cached["huella"])
+        return _for_file(layout, cached) if layout else None
+    return None
+
+
+def register(layout: dict, path: Path, registry: dict | None = None, registry_path: Path | None = None) -> dict:
+    """Guarda (o reemplaza) un layout detectado y asocia el archivo a su huella."""
+    registry = registry if registry is not None else load_registry(registry_path)
+    layout = {**layout, "encabezado": [str(value) for value in layout["encabezado"]]}
+    layout.pop("mensuales_pos", None)
+    layout["mensuales_pos"] = _monthly_positions(layout)
+    huella = fingerprint(layout["fuente"], layout["lector"], layout["encabezado"], layout["mensuales_pos"])
+    registry["layouts"][huella] = layout
+    key, stat = _file_key(path)
+    registry["archivos"][key] = _file_entry(stat, huella, layout, layout["encabezado"])
+    save_registry(registry, registry_path)
+    print(f"  Layout nuevo registrado ({layout['fuente']}): {huella[:10]}")
+    return layout
+
+
+def columns_by_name(columns, names: list[str]) -> list:
+    """Columnas reales cuyo `str()` esta en `names` (encabezados fecha en Excel)."""
+    wanted = set(names)
+    return [column for column in columns if str(column) in wanted]
@@ -0,0 +1,205 @@
+"""
+Group-by en paralelo por shards (procesos + memoria compartida).
+
+Las filas se particionan por una llave de shard que debe formar parte de las
+llaves del groupby (p. ej. `id_departamento`), asi ningun grupo cruza shards
+y cada shard se agrega de forma independiente:
+1. Las llaves se factorizan a codigos enteros (orden lexicografico) y las
+   columnas de valores a float; ambas matrices van a `SharedMemory`, los
+   workers solo reciben el rango de filas de su shard.
+2. Cada worker combina los codigos en un id de grupo entero, agrega su
+   rango con un groupby de una sola llave y devuelve grupos con codigos.
+3. Los resultados se concatenan y ordenan por codigo: la salida es identica
+   (filas, orden y valores) a `df.groupby(keys).agg(...)` de un solo proceso.
+
+Benchmark 1..N cores:
+    python scripts/transform.py --benchmark 8
+"""
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# Debajo de este numero de filas el costo del pool supera la ganancia.
+MIN_PARALLEL_ROWS = 200_000
+
+
+def _group_ids(codes: np.ndarray, cardinalities: list[int]) -> np.ndarray:
+    """
+    Un id entero por combinacion de llaves que conserva el orden lexicografico.
+
+    Combina los codigos en base mixta; si el producto de cardinalidades no
+    cabe en int64 se compacta con `np.unique` (ordenado) y se sigue.
+    """
+    limit = np.iinfo(np.int64).max
+    ids = np.zeros(len(codes), dtype=np.int64)
+    span = 1
+    for idx, cardinality in enumerate(cardinalities):
+        cardinality = max(cardinality, 1)
+        if span > limit // cardinality:
+            uniques, ids = np.unique(ids, return_inverse=True)
+            span = len(uniques)
+        ids = ids * cardinality + codes[:, idx]
+        span *= cardinality
+    return ids
+
+
+def _aggregate(
+    codes: np.ndarray,
+    values: np.ndarray,
+    cardinalities: list[int],
+    key_names: list[str],
+    value_names: list[str],
+    agg: dict,
+) -> pd.DataFrame:
+    # Groupby sobre una sola llave entera; las llaves salen de la primera fila de cada grupo.
+    ids = _group_ids(codes, cardinalities)
+    _, first = np.unique(ids, return_index=True)
+    aggregated = pd.DataFrame(values, columns=value_names).groupby(ids, sort=True).agg(**agg)
+    keys = pd.DataFrame(codes[first], columns=key_names)
+    return pd.concat([keys, aggregated.reset_index(drop=True)], axis=1)
+
+
+def _shard_task(
+    codes_shm: str,
+    values_shm: str,
+    shape: tuple[int, int, int],
+    start: int,
+    stop: int,
+    cardinalities: list[int],
+    key_names: list[str],
+    value_names: list[str],
+    agg: dict,
+) -> pd.DataFrame:
+    n_rows, n_keys, n_values = shape
+    codes_block = shared_memory.SharedMemory(name=codes_shm)
+    values_block = shared_memory.SharedMemory(name=values_shm)
+    try:
+        codes = np.ndarray((n_rows, n_keys), dtype=np.int64, buffer=codes_block.buf)[start:stop].copy()
+        values = np.ndarray((n_rows, n_values), dtype=np.float64, buffer=values_block.buf)[start:stop].copy()
+    finally:
+        codes_block.close()
+        values_block.close()
+    return _aggregate(codes, values, cardinalities, key_names, value_names, agg)
+
+
+def _to_shared(array: np.ndarray) -> shared_memory.SharedMemory:
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return block
+
+
+def sharded_groupby(
+    df: pd.DataFrame,
+    keys: list[str],
+    agg: dict[str, tuple[str, str]],
+    shard_key: str,
+    workers: int | None = None,
+) -> pd.DataFrame:
+    """
+    Equivalente a `df.groupby(keys).agg(**agg).reset_index()` repartido en procesos.
+
+    `agg` usa agregaciones con nombre (`salida=(columna, "sum"|"mean"|...)`).
+    Filas con llaves nulas se descartan, igual que el groupby por defecto.
+    Con un worker (o pocas filas) usa directamente el groupby de pandas.
+    """
+    if shard_key not in keys:
+        raise ValueError(f"La llave de shard '{shard_key}' debe estar en las llaves del groupby.")
+    workers = workers or os.cpu_count() or 1
+
+    if workers <= 1 or len(df) < MIN_PARALLEL_ROWS:
+        return df.groupby(keys).agg(**agg).reset_index()
+
+    codes = np.empty((len(df), len(keys)), dtype=np.int64)
+    uniques = {}
+    for idx, key in enumerate(keys):
+        codes[:, idx], uniques[key] = pd.factorize(df[key], sort=True)
+    valid = (codes >= 0).all(axis=1)
+    cardinalities = [len(uniques[key]) for key in keys]
+
+    value_names = list(dict.fromkeys(column for column, _ in agg.values()))
+    values = df[value_names].to_numpy(dtype=np.float64)
+    codes, values = codes[valid], values[valid]
+
+    # Filas contiguas por shard (orden estable: se preserva el orden dentro del grupo).
+    shard_col = keys.index(shard_key)
+    order = np.argsort(codes[:, shard_col], kind="stable")
+    codes, values = codes[order], values[order]
+    bounds = np.flatnonzero(np.diff(codes[:, shard_col])) + 1
+    ranges = list(zip(np.r_[0, bounds], np.r_[bounds, len(codes)])) if len(codes) else []
+
+    codes_block, values_block = _to_shared(codes), _to_shared(values)
+    try:
+        shape = (len(codes), len(keys), len(value_names))
+        with ProcessPoolExecutor(max_workers=min(workers, max(len(ranges), 1))) as pool:
+            futures = [
+                pool.submit(
+                    _shard_task,
+                    codes_block.name,
+                    values_block.name,
+                    shape,
+                    a,
+                    b,
+                    cardinalities,
+                    keys,
+                    value_names,
+                    agg,
+                )
+                for a, b in ranges
+            ]
+            parts = [future.result() for future in futures]
+    finally:
+        for block in (codes_block, values_block):
+            block.close()
+            block.unlink()
+
+    if not parts:
+        return df.iloc[:0].groupby(keys).agg(**agg).reset_index()
+    result = pd.concat(parts, ignore_index=True)
+    # Orden por codigos == orden lexicografico de las etiquetas (factorize con sort=True).
+    result = result.iloc[np.lexsort([result[key].to_numpy() for key in reversed(keys)])].reset_index(drop=True)
+    for key in keys:
+        result[key] = uniques[key].take(result[key].to_numpy())
+    # Sumas/minimos/maximos de columnas enteras vuelven a su tipo original.
+    for name, (column, func) in agg.items():
+        if func in {"sum", "min", "max"} and pd.api.types.is_integer_dtype(df[column].dtype):
+            result[name] = result[name].astype(df[column].dtype)
+    return result
+
+
+def benchmark(
+    df: pd.DataFrame,
+    keys: list[str],
+    agg: dict[str, tuple[str, str]],
+    shard_key: str,
+    max_workers: int | None = None,
+) -> pd.DataFrame:
+    """Tiempos con 1..N workers (1 = groupby de un solo proceso) y verificacion de igualdad."""
+    max_workers = max_workers or os.cpu_count() or 1
+
+    started = time.perf_counter()
+    reference = df.groupby(keys).agg(**agg).reset_index()
+    baseline = time.perf_counter() - started
+    print(f"  workers=1 (groupby de un proceso): {baseline:.2f}s")
+
+    rows = [{"workers": 1, "segundos": baseline, "speedup": 1.0, "identico": True}]
+    for workers in range(2, max_workers + 1):
+        started = time.perf_counter()
+        result = sharded_groupby(df, keys, agg, shard_key, workers=workers)
+        elapsed = time.perf_counter() - started
+        rows.append(
+            {
+                "workers": workers,
+                "segundos": elapsed,
+                "speedup": baseline / elapsed if elapsed else float("nan"),
+                "identico": result.equals(reference),
+            }
+        )
+        print(f"  workers={workers}: {elapsed:.2f}s (x{baseline / elapsed:.2f})")
+    return pd.DataFrame(rows)
@@ -0,0 +1,18 @@
+"""
+Bandas de tamano de operador por usuarios/accesos.
+
+Unica definicion compartida por el pipeline (cubo trimestral de
+calculate_icp), el dashboard y la API JSON.
+"""
+from __future__ import annotations
+
+import pandas as pd
+
+
+SIZE_BAND_LABELS = ["0 a 1000", "1001 a 5000", "5001 a 10000", "10001 a 100000", "100000+"]
+SIZE_BAND_BINS = [-0.001, 1000, 5000, 10000, 100000, float("inf")]
+
+
+def size_band(values: pd.Series) -> pd.Series:
+    """Banda (categorica ordenada) de cada valor."""
+    return pd.cut(values, bins=SIZE_BAND_BINS, labels=SIZE_BAND_LABELS, include_lowest=True, right=True)
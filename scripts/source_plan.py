@@ -0,0 +1,300 @@
+"""
+Plan de archivos fuente (Ecuador/Peru) antes de parsear.
+
+`calculate_icp` tomaba todos los archivos de la carpeta del pais y el
+groupby de `build_canonical` sumaba duplicados (re-descargas, o un archivo
+mensual y uno trimestral del mismo periodo). El plan:
+1. Descarta duplicados exactos por sha256 (solo se hashean archivos con el
+   mismo tamano; el hash sale del manifiesto del espejo o del cache si el
+   archivo no cambio).
+2. Estima los periodos (anno, trimestre) de cada archivo sin parsearlo:
+   periodos ya vistos (cache), columnas mensuales del layout registrado
+   (Ecuador) o el nombre del archivo (`sep_2025`, `2024T3`, `2025_Q1`).
+3. Elige la cobertura minima: primero los archivos que cubren mas periodos
+   (desempate: corte mas reciente, luego mtime); un archivo cuyos periodos
+   ya estan cubiertos no se parsea.
+Tras parsear, cada archivo aporta solo los periodos que ningun archivo
+anterior cubrio, asi un solapamiento parcial no se cuenta dos veces. La
+cobertura se decide con periodos estimados: despues de cada parseo, un
+archivo `cubierto` cuyos periodos no quedan cubiertos por los reales (mas
+los estimados de lo que falta parsear) se parsea tambien.
+
+Cache: data_ISPs/raw/plan_fuentes.json (ruta -> tamano, mtime, sha256, periodos).
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+import sys
+from typing import Callable
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+import config
+from scripts import mirror_sources, schema_registry
+from scripts.extract_utils import month_to_quarter
+
+
+CACHE_FILENAME = "plan_fuentes.json"
+HASH_CHUNK_BYTES = 1024 * 1024
+MONTHS = {
+    "ene": 1,
+    "feb": 2,
+    "mar": 3,
+    "abr": 4,
+    "may": 5,
+    "jun": 6,
+    "jul": 7,
+    "ago": 8,
+    "sep": 9,
+    "oct": 10,
+    "nov": 11,
+    "dic": 12,
+}
+YEAR_RE = re.compile(r"(?<!\d)(20\d{2})(?!\d)")
+QUARTER_RE = re.compile(r"(?<![a-z])(?:t|q|trim|trimestre)[-_ ]?([1-4])(?!\d)|(?<!\d)([1-4])[-_ ]?(?:t|q|trim)(?![a-z])")
+MONTH_NAME_RE = re.compile(r"(?<![a-z])(" + "|".join(MONTHS) + r")[a-z]*(?![a-z])")
+HEADER_DATE_RE = re.compile(r"(20\d{2})-(\d{2})-\d{2}")
+HEADER_MONTH_RE = re.compile(r"\b(" + "|".join(MONTHS) + r")[-_ ]?(\d{2,4})\b")
+
+
+@dataclass
+class SourceFile:
+    path: Path
+    periodos: set[tuple[int, int]] | None = None
+    origen_periodos: str = "desconocido"
+    corte: int = 0
+    sha256: str | None = None
+    estado: str = "parsear"
+    duplicado_de: Path | None = None
+
+
+@dataclass
+class SourcePlan:
+    archivos: list[SourceFile] = field(default_factory=list)
+
+    @property
+    def to_parse(self) -> list[SourceFile]:
+        return [item for item in self.archivos if item.estado == "parsear"]
+
+    def summary(self) -> str:
+        lines = []
+        for item in self.archivos:
+            periods = ",".join(f"{y}Q{q}" for y, q in sorted(item.periodos)) if item.periodos else "?"
+            detail = f" (= {item.duplicado_de.name})" if item.duplicado_de else ""
+            lines.append(f"  {item.estado:<10} {item.path.name}{detail} [{periods}; {item.origen_periodos}]")
+        return "\n".join(lines)
+
+
+def _cache_path() -> Path:
+    return config.RAW_DATA_DIR / CACHE_FILENAME
+
+
+def load_cache(path: Path | None = None) -> dict:
+    path = path or _cache_path()
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_cache(cache: dict, path: Path | None = None) -> Path:
+    path = path or _cache_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(cache, indent=2, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_path, path)
+    return path
+
+
+def _cache_entry(path: Path, cache: dict) -> dict:
+    """Entrada vigente del cache (se reinicia si el archivo cambio)."""
+    stat = path.stat()
+    key = str(path.resolve())
+    entry = cache.get(key)
+    if not entry or entry.get("size") != stat.st_size or entry.get("mtime") != int(stat.st_mtime):
+        entry = {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+        cache[key] = entry
+    return entry
+
+
+def file_sha256(path: Path, cache: dict, manifest: dict) -> str:
+    entry = _cache_entry(path, cache)
+    if not entry.get("sha256"):
+        entry["sha256"] = mirror_sources.known_hash(path, manifest)
+    if not entry.get("sha256"):
+        digest = hashlib.sha256()
+        with open(path, "rb") as handle:
+            for chunk in iter(lambda: handle.read(HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        entry["sha256"] = digest.hexdigest()
+    return entry["sha256"]
+
+
+def periods_from_filename(name: str) -> tuple[set[tuple[int, int]] | None, int]:
+    """Periodos y corte (anno*12+mes) a partir del nombre; (None, 0) si es ambiguo."""
+    name = Path(name).stem.lower()
+    years = {int(year) for year in YEAR_RE.findall(name)}
+    if len(years) != 1:
+        return None, 0
+    year = years.pop()
+
+    quarters = {int(a or b) for a, b in QUARTER_RE.findall(name)}
+    if len(quarters) == 1:
+        quarter = quarters.pop()
+        return {(year, quarter)}, year * 12 + quarter * 3
+
+    months = {MONTHS[token] for token in MONTH_NAME_RE.findall(name)}
+    if len(months) == 1:
+        month = months.pop()
+        return {(year, month_to_quarter(month))}, year * 12 + month
+    return None, 0
+
+
+def periods_from_header(columns: list[str]) -> tuple[set[tuple[int, int]] | None, int]:
+    """Periodos a partir de columnas mensuales del encabezado (`2025-07-01`, `jul-25`)."""
+    months = set()
+    for column in columns:
+        text = str(column).lower()
+        match = HEADER_DATE_RE.search(text)
+        if match:
+            months.add((int(match.group(1)), int(match.group(2))))
+            continue
+        match = HEADER_MONTH_RE.search(text)
+        if match:
+            year = int(match.group(2))
+            months.add((year + 2000 if year < 100 else year, MONTHS[match.group(1)]))
+    months = {(year, month) for year, month in months if 1 <= month <= 12}
+    if not months:
+        return None, 0
+    return {(year, month_to_quarter(month)) for year, month in months}, max(y * 12 + m for y, m in months)
+
+
+def _estimate_periods(item: SourceFile, cache: dict) -> None:
+    periods, corte, origin = None, 0, "desconocido"
+    layout = schema_registry.cached_layout(item.path)
+    if layout and layout.get("mensuales"):
+        periods, corte = periods_from_header(layout["mensuales"])
+        origin = "encabezado"
+    if not periods:
+        periods, corte = periods_from_filename(item.path.name)
+        origin = "nombre"
+
+    # Los periodos reales de un parseo anterior mandan; el corte se conserva.
+    entry = _cache_entry(item.path, cache)
+    if entry.get("periodos"):
+        periods = {tuple(period) for period in entry["periodos"]}
+        corte = corte or max(year * 12 + quarter * 3 for year, quarter in periods)
+        origin = "cache"
+    if periods:
+        item.periodos, item.corte, item.origen_periodos = periods, corte, origin
+
+
+def plan_files(files: list[Path], cache: dict | None = None) -> SourcePlan:
+    """Clasifica los archivos en `parsear`, `duplicado` o `cubierto`."""
+    cache = load_cache() if cache is None else cache
+    manifest = mirror_sources.load_manifest()
+    items = [SourceFile(path=Path(path)) for path in files]
+
+    # 1) Duplicados exactos: solo hay que hashear tamanos repetidos.
+    by_size: dict[int, list[SourceFile]] = {}
+    for item in items:
+        by_size.setdefault(item.path.stat().st_size, []).append(item)
+    for group in by_size.values():
+        if len(group) < 2:
+            continue
+        seen: dict[str, SourceFile] = {}
+        # El mas reciente queda como original.
+        for item in sorted(group, key=lambda it: (-it.path.stat().st_mtime, it.path.name)):
+            item.sha256 = file_sha256(item.path, cache, manifest)
+            if item.sha256 in seen:
+                item.estado = "duplicado"
+                item.duplicado_de = seen[item.sha256].path
+            else:
+                seen[item.sha256] = item
+
+    # 2) Periodos sin parsear y 3) cobertura minima (greedy por cobertura).
+    for item in items:
+        if item.estado == "parsear":
+            _estimate_periods(item, cache)
+
+    known = [item for item in items if item.estado == "parsear" and item.periodos]
+    known.sort(key=lambda it: (-len(it.periodos), -it.corte, -it.path.stat().st_mtime, it.path.name))
+    covered: set[tuple[int, int]] = set()
+    for item in known:
+        if item.periodos <= covered:
+            item.estado = "cubierto"
+        covered |= item.periodos
+
+    unknown = [item for item in items if item.estado == "parsear" and not item.periodos]
+    others = [item for item in items if item.estado != "parsear"]
+    save_cache(cache)
+    return SourcePlan(archivos=[*[it for it in known if it.estado == "parsear"], *unknown, *others])
+
+
+def record_periods(path: Path, canonical: pd.DataFrame, cache: dict) -> set[tuple[int, int]]:
+    """Guarda en el cache los periodos reales del archivo ya parseado."""
+    periods = {
+        (int(anno), int(trimestre))
+        for anno, trimestre in canonical[["anno", "trimestre"]].dropna().drop_duplicates().itertuples(index=False)
+    }
+    entry = _cache_entry(path, cache)
+    entry["periodos"] = sorted(periods)
+    return periods
+
+
+def load_planned(
+    country: str,
+    files: list[Path],
+    extractor: Callable[..., pd.DataFrame],
+) -> pd.DataFrame:
+    """
+    Parsea solo los archivos del plan con `extractor(source_files=[...], save=False)`.
+
+    Cada archivo aporta unicamente periodos no cubiertos por los anteriores.
+    Un archivo `cubierto` se parsea si los periodos reales dejan huecos en
+    los que el estimaba aportar.
+    """
+    cache = load_cache()
+    plan = plan_files(files, cache=cache)
+    print(f"Plan {country}: {len(plan.to_parse)} de {len(plan.archivos)} archivos a parsear")
+    print(plan.summary())
+
+    covered: set[tuple[int, int]] = set()
+    parts = []
+    queue = list(plan.to_parse)
+    skipped = [item for item in plan.archivos if item.estado == "cubierto"]
+    while queue:
+        item = queue.pop(0)
+        canonical = extractor(source_files=[str(item.path)], save=False)
+        periods = record_periods(item.path, canonical, cache)
+        if item.periodos is not None and periods != item.periodos:
+            print(f"  Aviso: {item.path.name} trae {sorted(periods)} (estimado {sorted(item.periodos)})")
+        overlap = periods & covered
+        if overlap:
+            print(f"  {item.path.name}: se omiten periodos ya cubiertos {sorted(overlap)}")
+            keys = pd.Series(list(zip(canonical["anno"], canonical["trimestre"])), index=canonical.index)
+            canonical = canonical.loc[~keys.isin(overlap)]
+        covered |= periods
+        # El archivo de origen permite validar duplicados antes de agregar (validation.check_duplicates).
+        parts.append(canonical.assign(archivo=item.path.name))
+
+        # Re-chequeo con periodos reales: lo cubierto por estimacion puede no estarlo.
+        expected = covered.union(*(other.periodos or set() for other in queue))
+        for other in list(skipped):
+            missing = other.periodos - expected
+            if missing:
+                print(f"  {other.path.name}: se parsea, faltan {sorted(missing)}")
+                other.estado = "parsear"
+                skipped.remove(other)
+                queue.append(other)
+                expected |= other.periodos
+
+    save_cache(cache)
+    if not parts:
+        raise ValueError(f"Ningun archivo {country} para parsear tras el plan.")
+    return pd.concat(parts, ignore_index=True)
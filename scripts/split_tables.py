@@ -4,6 +4,7 @@ import sys
 
 sys.path.append(str(Path(__file__).parent.parent))
 import config
+from scripts import artifacts
 
 
 def load_enriched():
@@ -60,19 +61,22 @@ def build_leads(df):
     return leads_df.loc[leads_df["nombre"].notna()].copy()
 
 
-def run():
-    df = load_enriched()
+def run(df=None, background_writes=False):
+    # df: salida en memoria de enrich.run (desde main.py); si no, se lee el CSV.
+    if df is None:
+        df = load_enriched()
     empresas = build_empresas(df)
     leads = build_leads(df)
 
     empresas_path = config.FINAL_DATA_DIR / config.OUTPUT_EMPRESAS_TABLA_FILENAME
     leads_path = config.FINAL_DATA_DIR / config.OUTPUT_LEADS_FILENAME
 
-    empresas.to_csv(empresas_path, index=False)
-    leads.to_csv(leads_path, index=False)
+    artifacts.persist_csv(empresas, empresas_path, background=background_writes)
+    artifacts.persist_csv(leads, leads_path, background=background_writes)
 
     print(f"Empresas: {empresas_path} ({len(empresas)})")
     print(f"Leads: {leads_path} ({len(leads)})")
+    return empresas, leads
 
 
 if __name__ == "__main__":
@@ -0,0 +1,249 @@
+"""
+Sincronizacion incremental de Colombia por marca de agua (anno, trimestre).
+
+Store local: data_ISPs/raw/colombia/store/
+- periodo_<anno>Q<trimestre>.parquet: filas crudas de ese trimestre.
+- sync_state.json: marca de agua y, por periodo, filas y checksum ingeridos.
+- bootstrap/: chunks de la descarga completa inicial (propios, no comparte
+  el checkpoint de extract_colombia ni sus chunks con ventana de anos).
+
+En cada refresco se consulta el conteo de filas por periodo en el servidor
+y solo se descargan:
+- periodos posteriores a la marca de agua,
+- periodos cuyo conteo cambio (re-publicados),
+- los ultimos `recheck_last` periodos, comparando checksum (re-publicacion
+  con el mismo numero de filas).
+Si el datastore no soporta filtros, se hace una descarga completa una vez
+y se particiona en el store.
+"""
+from __future__ import annotations
+
+from datetime import date
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import sys
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+import config
+from scripts import extract_colombia
+from scripts.extract_utils import combine_partials
+
+
+STORE_DIR = config.RAW_DATA_DIR / "colombia" / "store"
+STATE_FILENAME = "sync_state.json"
+BOOTSTRAP_DIRNAME = "bootstrap"
+
+
+def _period_label(period: tuple[int, int]) -> str:
+    return f"{int(period[0])}Q{int(period[1])}"
+
+
+def _period_path(store_dir: Path, period: tuple[int, int]) -> Path:
+    return store_dir / f"periodo_{_period_label(period)}.parquet"
+
+
+def load_state(store_dir: Path = STORE_DIR) -> dict:
+    path = store_dir / STATE_FILENAME
+    if not path.exists():
+        return {"resource_id": config.RESOURCE_ID, "high_water": None, "periods": {}}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def checksum_frame(df: pd.DataFrame) -> str:
+    """Checksum independiente del orden de filas/columnas."""
+    if df.empty:
+        return ""
+    ordered = df.reindex(columns=sorted(df.columns)).astype("string").fillna("")
+    row_hashes = pd.util.hash_pandas_object(ordered, index=False).sort_values()
+    return hashlib.sha256(row_hashes.values.tobytes()).hexdigest()
+
+
+def _server_total(url: str, period: tuple[int, int] | None = None) -> int:
+    payload = extract_colombia.fetch_page(url, extract_colombia.build_params(limit=1, offset=0, period=period))
+    return int(payload.get("result", {}).get("total", 0))
+
+
+def server_period_counts(url: str, known: list[tuple[int, int]], max_new: int = 8) -> dict[tuple[int, int], int] | None:
+    """
+    Conteo de filas por periodo en el servidor.
+
+    Una consulta `limit=1` filtrada por periodo para los conocidos y los
+    trimestres siguientes a la marca de agua hasta el trimestre actual.
+    None si el servidor ignora los filtros.
+    """
+    if not known:
+        # No hay forma barata de listar periodos: la primera carga es completa.
+        return None
+    total = _server_total(url)
+    counts: dict[tuple[int, int], int] = {}
+    for period in sorted(known):
+        counts[period] = _server_total(url, period)
+    if counts and all(value == total for value in counts.values()) and len(counts) > 1:
+        return None
+
+    today = date.today()
+    current = (today.year, (today.month - 1) // 3 + 1)
+    year, quarter = max(known)
+    for _ in range(max_new):
+        year, quarter = (year + 1, 1) if quarter == 4 else (year, quarter + 1)
+        if (year, quarter) > current:
+            break
+        value = _server_total(url, (year, quarter))
+        if value == total and total > 0 and counts:
+            # El servidor devolvio el total sin filtrar.
+            return None
+        if value:
+            counts[(year, quarter)] = value
+    return counts
+
+
+def _fetch_period(url: str, period: tuple[int, int], limit: int) -> pd.DataFrame:
+    records: list[dict] = []
+    offset = 0
+    while True:
+        payload = extract_colombia.fetch_page(
+            url, extract_colombia.build_params(limit=limit, offset=offset, period=period)
+        )
+        page = payload.get("result", {}).get("records", [])
+        records.extend(page)
+        offset += len(page)
+        if len(page) < limit:
+            break
+    return pd.DataFrame(records).astype("string")
+
+
+def _store_period(store_dir: Path, state: dict, period: tuple[int, int], df: pd.DataFrame, checksum: str) -> None:
+    path = _period_path(store_dir, period)
+    tmp_path = path.with_suffix(".parquet.tmp")
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    state["periods"][_period_label(period)] = {"rows": int(len(df)), "checksum": checksum}
+    high_water = tuple(state["high_water"]) if state["high_water"] else None
+    if high_water is None or period > high_water:
+        state["high_water"] = list(period)
+    extract_colombia.write_atomic_json(store_dir / STATE_FILENAME, state)
+
+
+def _bootstrap_full(store_dir: Path, state: dict, limit: int, api_url: str | None = None) -> dict:
+    """
+    Descarga completa (sin filtros) y particion por periodo en el store.
+
+    Los chunks van a `store_dir/bootstrap` y se reparten por periodo de a
+    uno; en memoria queda a lo sumo un chunk o un periodo.
+    """
+    print("Sync Colombia: store vacio o sin filtros por periodo; descarga completa y particion.")
+    chunks_dir = store_dir / BOOTSTRAP_DIRNAME
+    checkpoint = extract_colombia.load_checkpoint(chunks_dir)
+    # Un checkpoint completo es de una corrida anterior (datos viejos): se descarga de nuevo.
+    resume = not (checkpoint and checkpoint.get("completed"))
+    extract_colombia.extract_to_chunks(
+        limit=limit,
+        chunks_dir=chunks_dir,
+        resume=resume,
+        pushdown="none",
+        years=None,
+        api_url=api_url,
+    )
+
+    # 1) Cada chunk se parte por periodo en piezas en disco.
+    pieces_dir = chunks_dir / "periodos"
+    shutil.rmtree(pieces_dir, ignore_errors=True)
+    pieces: dict[tuple[int, int], list[Path]] = {}
+    for idx, chunk in enumerate(extract_colombia.iter_chunks(chunks_dir)):
+        anno = pd.to_numeric(chunk["anno"], errors="coerce")
+        trimestre = pd.to_numeric(chunk["trimestre"], errors="coerce")
+        for (year, quarter), df_piece in chunk.groupby([anno, trimestre]):
+            period = (int(year), int(quarter))
+            path = pieces_dir / _period_label(period) / f"part_{idx:06d}.parquet"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            df_piece.to_parquet(path, index=False)
+            pieces.setdefault(period, []).append(path)
+
+    # 2) Un periodo a la vez: se juntan sus piezas y se guarda si cambio.
+    for period in sorted(pieces):
+        df_period = pd.concat([pd.read_parquet(path) for path in pieces[period]], ignore_index=True)
+        checksum = checksum_frame(df_period)
+        if state["periods"].get(_period_label(period), {}).get("checksum") != checksum:
+            _store_period(store_dir, state, period, df_period, checksum)
+    shutil.rmtree(pieces_dir, ignore_errors=True)
+    return state
+
+
+def sync_incremental(
+    limit: int = 1000,
+    recheck_last: int = 1,
+    store_dir: Path = STORE_DIR,
+    api_url: str | None = None,
+) -> dict:
+    """Trae solo periodos nuevos o re-publicados y los agrega al store local."""
+    if not config.RESOURCE_ID:
+        raise ValueError("RESOURCE_ID no esta configurado en config.py")
+
+    store_dir.mkdir(parents=True, exist_ok=True)
+    url = f"{api_url or config.API_BASE_URL}/search.json"
+    state = load_state(store_dir)
+    if state.get("resource_id") != config.RESOURCE_ID:
+        print("Sync Colombia: recurso distinto al del store; se reinicia el estado.")
+        state = {"resource_id": config.RESOURCE_ID, "high_water": None, "periods": {}}
+
+    known = [tuple(int(v) for v in label.split("Q")) for label in state["periods"]]
+    counts = server_period_counts(url, known)
+    if counts is None:
+        return _bootstrap_full(store_dir, state, limit=limit, api_url=api_url)
+
+    high_water = tuple(state["high_water"]) if state["high_water"] else None
+    recent = sorted(p for p in known if high_water and p <= high_water)[-recheck_last:] if recheck_last else []
+
+    fetched = 0
+    for period in sorted(counts):
+        stored = state["periods"].get(_period_label(period))
+        is_new = high_water is None or period > high_water or stored is None
+        count_changed = stored is not None and stored["rows"] != counts[period]
+        if not (is_new or count_changed or period in recent):
+            continue
+
+        df_period = _fetch_period(url, period, limit=limit)
+        checksum = checksum_frame(df_period)
+        if stored and not count_changed and stored["checksum"] == checksum:
+            continue
+        reason = "nuevo" if is_new else "re-publicado"
+        print(f"  - {_period_label(period)}: {len(df_period)} filas ({reason})")
+        _store_period(store_dir, state, period, df_period, checksum)
+        fetched += 1
+
+    hw_label = _period_label(state["high_water"]) if state["high_water"] else "-"
+    print(f"Sync Colombia: {fetched} periodos actualizados; marca de agua {hw_label}")
+    return state
+
+
+def iter_store(store_dir: Path = STORE_DIR, columns: list[str] | None = None):
+    """Itera los periodos del store (uno a la vez en memoria)."""
+    state = load_state(store_dir)
+    for label in sorted(state["periods"]):
+        period = tuple(int(v) for v in label.split("Q"))
+        yield pd.read_parquet(_period_path(store_dir, period), columns=columns)
+
+
+def to_canonical_from_store(store_dir: Path = STORE_DIR) -> pd.DataFrame:
+    partials = [
+        extract_colombia.to_canonical(df)
+        for df in iter_store(store_dir, columns=sorted(extract_colombia.REQUIRED_COLUMNS))
+    ]
+    return combine_partials(partials)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sincronizacion incremental Colombia (marca de agua).")
+    parser.add_argument("--limit", type=int, default=1000, help="Registros por pagina.")
+    parser.add_argument("--recheck-last", type=int, default=1, help="Periodos recientes a re-verificar por checksum.")
+    parser.add_argument("--api-url", default=None, help="Base URL del datastore.")
+    args = parser.parse_args()
+
+    sync_incremental(limit=args.limit, recheck_last=args.recheck_last, api_url=args.api_url)
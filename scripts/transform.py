@@ -7,6 +7,8 @@ from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent.parent))
 import config
+from scripts import market_structure
+from scripts.sharded_groupby import benchmark, sharded_groupby
 
 
 # Mapeos de clasificación
@@ -91,19 +93,25 @@ def apply_transformations(df):
 
 
 
-def generate_base_detallada(df):
+BASE_GROUP_KEYS = [
+    'id_empresa', 'empresa', 'anno', 'trimestre', 
+    'id_municipio', 'municipio', 'id_departamento', 'departamento',
+    'grupo_segmento', 'grupo_estrato', 'grupo_tecnologia'
+]
+BASE_AGGREGATIONS = {
+    'accesos': ('accesos', 'sum'),
+    'velocidad_bajada': ('velocidad_efectiva_downstream', 'mean'),
+    'velocidad_subida': ('velocidad_efectiva_upstream', 'mean'),
+}
+# Los departamentos no comparten grupos: cada uno se agrega en un proceso.
+BASE_SHARD_KEY = 'id_departamento'
+
+
+def generate_base_detallada(df, workers=None):
     """Genera base detallada por empresa/trimestre/municipio con grupos"""
     print("\nGenerando base detallada...")
     
-    df_grouped = df.groupby([
-        'id_empresa', 'empresa', 'anno', 'trimestre', 
-        'id_municipio', 'municipio', 'id_departamento', 'departamento',
-        'grupo_segmento', 'grupo_estrato', 'grupo_tecnologia'
-    ]).agg(
-        accesos=('accesos', 'sum'),
-        velocidad_bajada=('velocidad_efectiva_downstream', 'mean'),
-        velocidad_subida=('velocidad_efectiva_upstream', 'mean')
-    ).reset_index()
+    df_grouped = sharded_groupby(df, BASE_GROUP_KEYS, BASE_AGGREGATIONS, BASE_SHARD_KEY, workers=workers)
     
     filepath = config.PROCESSED_DATA_DIR / config.OUTPUT_BASE_FILENAME
     df_grouped.to_csv(filepath, index=False)
@@ -183,7 +191,7 @@ def generate_empresa_trimestre(df_grouped):
     return df_emp_trim
 
 
-def run():
+def run(workers=None):
     """Ejecuta pipeline completo de transformación"""
     print("=" * 60)
     print("TRANSFORMACIÓN DE DATOS")
@@ -193,9 +201,10 @@ def run():
         df = load_raw_data()
         df = apply_transformations(df)
         
-        df_base = generate_base_detallada(df)
+        df_base = generate_base_detallada(df, workers=workers)
         df_resumen = generate_resumen(df_base)
         df_emp_trim = generate_empresa_trimestre(df_base)
+        market_structure.run(df_resumen)
         
         print("\n" + "=" * 60)
         print("TRANSFORMACIÓN COMPLETADA")
@@ -204,6 +213,9 @@ def run():
         print(f"  - {config.OUTPUT_BASE_FILENAME}")
         print(f"  - {config.OUTPUT_RESUMEN_FILENAME}")
         print(f"  - {config.OUTPUT_EMPRESA_TRIM_FILENAME}")
+        print(f"  - {market_structure.MUNICIPIOS_FILENAME}")
+        print(f"  - {market_structure.DEPARTAMENTOS_FILENAME}")
+        print(f"  - {market_structure.DOMINANCIA_FILENAME}")
         
     except Exception as e:
         print("\n" + "=" * 60)
@@ -212,6 +224,33 @@ def run():
         raise
 
 
+def run_benchmark(max_workers=None):
+    """Mide la base detallada con 1..N workers sobre el raw real."""
+    df = apply_transformations(load_raw_data())
+    print(f"\nBenchmark base detallada ({len(df)} filas, shard: {BASE_SHARD_KEY})...")
+    results = benchmark(df, BASE_GROUP_KEYS, BASE_AGGREGATIONS, BASE_SHARD_KEY, max_workers=max_workers)
+    print(results.to_string(index=False))
+    return results
+
+
 if __name__ == "__main__":
-    run()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Transformacion de datos raw de Colombia.")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos para la base detallada (default: CPUs).")
+    parser.add_argument(
+        "--benchmark",
+        type=int,
+        nargs="?",
+        const=0,
+        default=None,
+        metavar="N",
+        help="Solo mide la base detallada con 1..N workers (default N: CPUs).",
+    )
+    args = parser.parse_args()
+
+    if args.benchmark is not None:
+        run_benchmark(max_workers=args.benchmark or None)
+    else:
+        run(workers=args.workers)
 
@@ -0,0 +1,210 @@
+"""
+Validaciones del canonico multi-pais antes de calcular ICP y enriquecer.
+
+Implementa las validaciones de docs/fuentes_por_pais_y_esquema_canonico.md
+como operaciones vectorizadas sobre el DataFrame:
+- cobertura de periodos esperados en la ventana,
+- porcentaje de `id_operador` nulo,
+- sin duplicados por (pais, id_operador, anno, trimestre) entre archivos
+  fuente, antes de agregar (un mismo periodo sumado desde dos archivos),
+- `num_accesos` entero no negativo,
+- total de accesos por trimestre sin caidas bruscas (hard solo en los
+  ultimos periodos de cada pais; caidas historicas quedan como aviso).
+
+Los checks "hard" abortan el pipeline; los "soft" solo quedan en el reporte.
+Salida: data_ISPs/processed/validacion_canonico.json
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+import json
+from pathlib import Path
+import sys
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+import config
+
+
+REPORT_FILENAME = "validacion_canonico.json"
+KEY_COLUMNS = ["pais", "id_operador", "anno", "trimestre"]
+MAX_NULL_ID_RATE = 0.05
+# Caida maxima permitida del total de accesos entre trimestres consecutivos.
+MAX_QUARTER_DROP = 0.5
+# Periodos mas recientes (por pais) donde una caida aborta; en los anteriores es aviso.
+QUARTER_DROP_HARD_PERIODS = 1
+
+
+def _expected_periods(window: tuple[int, int], today: date | None = None) -> pd.MultiIndex:
+    """Trimestres de la ventana ya cerrados a la fecha (el trimestre en curso no se exige)."""
+    today = today or date.today()
+    current = (today.year, (today.month - 1) // 3 + 1)
+    periods = [
+        (year, quarter)
+        for year in range(window[0], window[1] + 1)
+        for quarter in range(1, 5)
+        if (year, quarter) < current
+    ]
+    return pd.MultiIndex.from_tuples(periods, names=["anno", "trimestre"])
+
+
+def _check(name: str, level: str, ok: bool, detail: dict) -> dict:
+    return {"check": name, "nivel": level, "ok": bool(ok), "detalle": detail}
+
+
+def check_period_coverage(canonical: pd.DataFrame, window: tuple[int, int]) -> list[dict]:
+    expected = _expected_periods(window)
+    present = canonical[["pais", "anno", "trimestre"]].drop_duplicates()
+    present = present.assign(anno=present["anno"].astype(int), trimestre=present["trimestre"].astype(int))
+    results = []
+    for pais, group in present.groupby("pais"):
+        have = pd.MultiIndex.from_frame(group[["anno", "trimestre"]])
+        missing = expected.difference(have)
+        in_window = have.intersection(expected)
+        detail = {
+            "pais": pais,
+            "esperados": len(expected),
+            "presentes": len(in_window),
+            "faltantes": [f"{a}Q{t}" for a, t in missing],
+        }
+        # Sin ningun periodo en ventana es un parseo roto; huecos parciales son aviso.
+        results.append(_check("cobertura_periodos", "hard", len(in_window) > 0 or len(expected) == 0, detail))
+        if len(in_window) > 0 and len(missing):
+            results.append(_check("cobertura_periodos_completa", "soft", False, detail))
+    return results
+
+
+def check_null_ids(raw_concat: pd.DataFrame) -> list[dict]:
+    ids = raw_concat["id_operador"]
+    is_null = ids.isna() | ids.astype(str).str.strip().isin(["", "nan", "None", "<NA>"])
+    rates = is_null.groupby(raw_concat["pais"]).mean()
+    return [
+        _check(
+            "id_operador_nulo",
+            "hard",
+            rate <= MAX_NULL_ID_RATE,
+            {"pais": pais, "tasa": round(float(rate), 4), "maximo": MAX_NULL_ID_RATE},
+        )
+        for pais, rate in rates.items()
+    ]
+
+
+def check_duplicates(raw_concat: pd.DataFrame) -> list[dict]:
+    """
+    Cada llave debe venir de un solo archivo fuente.
+
+    Corre sobre la concatenacion previa al groupby (que suma y oculta los
+    duplicados). El archivo es la columna `archivo` (Ecuador/Peru, ver
+    source_plan) o, sin ella, la `fuente`.
+    """
+    source = raw_concat["archivo"] if "archivo" in raw_concat.columns else raw_concat["fuente"]
+    keyed = raw_concat[KEY_COLUMNS].astype(str).assign(archivo=source.fillna(raw_concat["fuente"]).astype(str))
+    pairs = keyed.drop_duplicates()
+    duplicated = pairs.loc[pairs.groupby(KEY_COLUMNS)["archivo"].transform("nunique") > 1]
+    n_keys = len(duplicated[KEY_COLUMNS].drop_duplicates())
+    return [
+        _check(
+            "llave_unica",
+            "hard",
+            n_keys == 0,
+            {"llaves_duplicadas": n_keys, "ejemplos": duplicated.head(10).to_dict(orient="records")},
+        )
+    ]
+
+
+def check_accesos(canonical: pd.DataFrame) -> list[dict]:
+    values = pd.to_numeric(canonical["num_accesos"], errors="coerce")
+    negative = values < 0
+    non_integer = values.notna() & (values != values.round())
+    return [
+        _check("accesos_no_negativos", "hard", not negative.any(), {"filas": int(negative.sum())}),
+        _check("accesos_enteros", "hard", not non_integer.any(), {"filas": int(non_integer.sum())}),
+    ]
+
+
+def check_quarter_drops(canonical: pd.DataFrame) -> list[dict]:
+    totals = (
+        canonical.groupby(["pais", "anno", "trimestre"], as_index=False)["num_accesos"]
+        .sum()
+        .sort_values(["pais", "anno", "trimestre"])
+    )
+    previous = totals.groupby("pais")["num_accesos"].shift(1)
+    drop = 1 - totals["num_accesos"] / previous
+    # Una caida vieja ya publicada no debe bloquear cada corrida futura.
+    recent = totals.groupby("pais").cumcount(ascending=False) < QUARTER_DROP_HARD_PERIODS
+    flagged = totals.loc[drop > MAX_QUARTER_DROP].assign(
+        caida=drop[drop > MAX_QUARTER_DROP].round(4), reciente=recent[drop > MAX_QUARTER_DROP]
+    )
+    results = []
+    for pais in totals["pais"].unique():
+        rows = flagged.loc[flagged["pais"] == pais]
+        for name, level, subset in [
+            ("total_trimestral_sin_caidas", "hard", rows.loc[rows["reciente"]]),
+            ("total_trimestral_sin_caidas_historico", "soft", rows.loc[~rows["reciente"]]),
+        ]:
+            if level == "soft" and subset.empty:
+                continue
+            results.append(
+                _check(
+                    name,
+                    level,
+                    subset.empty,
+                    {
+                        "pais": pais,
+                        "caida_maxima": MAX_QUARTER_DROP,
+                        "periodos": [
+                            {"periodo": f"{int(r.anno)}Q{int(r.trimestre)}", "caida": float(r.caida)}
+                            for r in subset.itertuples()
+                        ],
+                    },
+                )
+            )
+    return results
+
+
+def validate_canonical(
+    raw_concat: pd.DataFrame,
+    canonical: pd.DataFrame,
+    window: tuple[int, int] = config.WINDOW_YEARS,
+) -> dict:
+    """
+    Corre todas las validaciones y devuelve el reporte.
+
+    `raw_concat` es la concatenacion de extractores antes de descartar nulos
+    y de agregar (ids nulos, duplicados entre archivos); `canonical` es el
+    canonico ya agregado.
+    """
+    checks = []
+    checks += check_period_coverage(canonical, window)
+    checks += check_null_ids(raw_concat)
+    checks += check_duplicates(raw_concat)
+    checks += check_accesos(canonical)
+    checks += check_quarter_drops(canonical)
+
+    failed_hard = [c for c in checks if c["nivel"] == "hard" and not c["ok"]]
+    return {
+        "generado": datetime.now().isoformat(timespec="seconds"),
+        "filas": int(len(canonical)),
+        "ok": not failed_hard,
+        "fallas_hard": len(failed_hard),
+        "avisos": sum(1 for c in checks if c["nivel"] == "soft" and not c["ok"]),
+        "checks": checks,
+    }
+
+
+def write_report(report: dict, path: Path | None = None) -> Path:
+    path = path or config.PROCESSED_DATA_DIR / REPORT_FILENAME
+    path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def enforce(report: dict) -> None:
+    """Aborta si hay checks hard fallidos."""
+    if report["ok"]:
+        return
+    failed = [c for c in report["checks"] if c["nivel"] == "hard" and not c["ok"]]
+    summary = "; ".join(
+        f"{c['check']}" + (f" ({c['detalle']['pais']})" if "pais" in c["detalle"] else "") for c in failed
+    )
+    raise ValueError(f"Validacion del canonico fallida ({len(failed)} checks): {summary}")
@@ -0,0 +1,419 @@
+"""
+Cola local de trabajos WHOIS (SQLite) para enriquecer con varios workers.
+
+Flujo:
+1. `publish` carga los candidatos ICP como trabajos pendientes. Un trabajo
+   ya terminado solo vuelve a `pendiente` si cambio su `operador` o su
+   `entity_key`, si termino en `error`, o si se publica con otro id de
+   corrida (`--corrida`, para forzar un refresco completo); el resto
+   conserva su resultado, asi relanzar retoma sin repetir consultas.
+2. N workers (procesos o contenedores con el mismo archivo montado) toman
+   trabajos con un lease: el trabajo queda `en_proceso` hasta `lease_expira`;
+   si el worker muere, el lease vence y otro worker lo retoma.
+3. Un error devuelve el trabajo a `pendiente` hasta MAX_ATTEMPTS intentos.
+4. `collect` une los resultados con el mismo esquema de salida de enrich.
+
+Con `start_workers` el proceso padre lleva la etapa `whois` en sus metricas
+leyendo el avance de la cola; cada worker escribe sus requests, latencias y
+errores en su propio textfile (metrics.start_worker_reporter).
+
+Cada proceso tiene su propio RATE_CONTROLLER: los workers de una maquina
+reparten la tasa por host (`--rate-share`, por defecto `--workers`). Con
+varios contenedores, pasar a cada uno el total de workers en `--rate-share`.
+
+Uso:
+    python scripts/whois_queue.py publish
+    python scripts/whois_queue.py worker --workers 4
+    python scripts/whois_queue.py collect
+"""
+from __future__ import annotations
+
+from datetime import datetime
+import json
+from multiprocessing import Process
+import os
+from pathlib import Path
+import socket
+import sqlite3
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).parent.parent))
+import config
+from scripts import artifacts, enrich, metrics, rate_control
+
+
+QUEUE_FILENAME = "whois_jobs.sqlite"
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+# Cada cuanto el padre lee el avance de la cola mientras esperan los workers.
+PROGRESS_POLL_SECONDS = 2.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    pais TEXT NOT NULL,
+    id_operador TEXT NOT NULL,
+    operador TEXT NOT NULL,
+    entity_key TEXT NOT NULL,
+    prioridad REAL NOT NULL DEFAULT 0,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expira REAL,
+    resultado TEXT,
+    error TEXT,
+    actualizado TEXT,
+    corrida TEXT,
+    PRIMARY KEY (pais, id_operador)
+);
+CREATE INDEX IF NOT EXISTS jobs_estado ON jobs (estado, prioridad);
+CREATE INDEX IF NOT EXISTS jobs_entidad ON jobs (entity_key, estado);
+"""
+
+
+def _queue_path() -> Path:
+    return config.PROCESSED_DATA_DIR / QUEUE_FILENAME
+
+
+def connect(db_path: Path | None = None) -> sqlite3.Connection:
+    db_path = db_path or _queue_path()
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    # WAL: lectores y un escritor a la vez sin bloquear a los demas workers.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    # Colas creadas antes de registrar la corrida.
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    if "corrida" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN corrida TEXT")
+    return conn
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def publish(
+    candidates: pd.DataFrame,
+    db_path: Path | None = None,
+    reset: bool = False,
+    run_id: str | None = None,
+) -> int:
+    """
+    Publica candidatos como trabajos; devuelve cuantos quedaron nuevos o re-encolados.
+
+    Vuelven a `pendiente` los trabajos con otro `operador`/`entity_key`, los
+    `error` y, si se pasa `run_id`, los de otra corrida. Los `en_proceso`
+    no se tocan; a los demas solo se les actualiza la prioridad.
+    """
+    conn = connect(db_path)
+    if reset:
+        conn.execute("DELETE FROM jobs")
+    if "max_accesos_2024_2025" in candidates.columns:
+        priority = candidates["max_accesos_2024_2025"]
+    else:
+        priority = pd.Series(0, index=candidates.index)
+    rows = [
+        (str(pais), str(id_op), str(operador), enrich.whois_entity_key(pais, operador), float(prio), _now(), run_id)
+        for pais, id_op, operador, prio in zip(
+            candidates["pais"], candidates["id_operador"], candidates["operador"], priority.fillna(0)
+        )
+    ]
+    before = conn.total_changes
+    conn.executemany(
+        """
+        INSERT INTO jobs (pais, id_operador, operador, entity_key, prioridad, actualizado, corrida)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (pais, id_operador) DO UPDATE SET
+            operador = excluded.operador, entity_key = excluded.entity_key, prioridad = excluded.prioridad,
+            estado = 'pendiente', intentos = 0, lease_owner = NULL, lease_expira = NULL,
+            resultado = NULL, error = NULL, actualizado = excluded.actualizado,
+            corrida = COALESCE(excluded.corrida, jobs.corrida)
+        WHERE jobs.estado != 'en_proceso' AND (
+            jobs.operador IS NOT excluded.operador
+            OR jobs.entity_key IS NOT excluded.entity_key
+            OR jobs.estado = 'error'
+            OR (excluded.corrida IS NOT NULL AND jobs.corrida IS NOT excluded.corrida)
+        )
+        """,
+        rows,
+    )
+    published = conn.total_changes - before
+    conn.executemany(
+        "UPDATE jobs SET prioridad = ? WHERE pais = ? AND id_operador = ? AND prioridad != ?",
+        [(row[4], row[0], row[1], row[4]) for row in rows],
+    )
+    conn.close()
+    return published
+
+
+def lease(conn: sqlite3.Connection, worker_id: str, lease_seconds: int = LEASE_SECONDS) -> sqlite3.Row | None:
+    """Toma el trabajo pendiente (o con lease vencido) de mayor prioridad."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Lease vencido sin intentos restantes: el worker murio en el ultimo intento.
+        conn.execute(
+            """
+            UPDATE jobs SET estado = 'error', error = COALESCE(error, 'lease vencido'), lease_owner = NULL
+            WHERE estado = 'en_proceso' AND lease_expira < ? AND intentos >= ?
+            """,
+            (now, MAX_ATTEMPTS),
+        )
+        job = conn.execute(
+            """
+            SELECT * FROM jobs
+            WHERE intentos < ?
+              AND (estado = 'pendiente' OR (estado = 'en_proceso' AND lease_expira < ?))
+            ORDER BY prioridad DESC
+            LIMIT 1
+            """,
+            (MAX_ATTEMPTS, now),
+        ).fetchone()
+        if job is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            """
+            UPDATE jobs SET estado = 'en_proceso', lease_owner = ?, lease_expira = ?,
+                intentos = intentos + 1, actualizado = ?
+            WHERE pais = ? AND id_operador = ?
+            """,
+            (worker_id, now + lease_seconds, _now(), job["pais"], job["id_operador"]),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return job
+
+
+def complete(conn: sqlite3.Connection, job: sqlite3.Row, worker_id: str, result: dict) -> bool:
+    """Guarda el resultado si el worker aun tiene el lease."""
+    cursor = conn.execute(
+        """
+        UPDATE jobs SET estado = 'ok', resultado = ?, error = NULL, lease_owner = NULL,
+            lease_expira = NULL, actualizado = ?
+        WHERE pais = ? AND id_operador = ? AND lease_owner = ? AND estado = 'en_proceso'
+        """,
+        (json.dumps(result, ensure_ascii=False), _now(), job["pais"], job["id_operador"], worker_id),
+    )
+    return cursor.rowcount == 1
+
+
+def fail(conn: sqlite3.Connection, job: sqlite3.Row, worker_id: str, error: str) -> None:
+    """Devuelve el trabajo a la cola, o lo marca `error` al agotar intentos."""
+    conn.execute(
+        """
+        UPDATE jobs SET estado = CASE WHEN intentos >= ? THEN 'error' ELSE 'pendiente' END,
+            error = ?, lease_owner = NULL, lease_expira = NULL, actualizado = ?
+        WHERE pais = ? AND id_operador = ? AND lease_owner = ?
+        """,
+        (MAX_ATTEMPTS, error[:500], _now(), job["pais"], job["id_operador"], worker_id),
+    )
+
+
+def release(conn: sqlite3.Connection, job: sqlite3.Row, worker_id: str) -> None:
+    """Devuelve el trabajo a `pendiente` sin contar el intento."""
+    conn.execute(
+        """
+        UPDATE jobs SET estado = 'pendiente', intentos = MAX(intentos - 1, 0), lease_owner = NULL,
+            lease_expira = NULL, actualizado = ?
+        WHERE pais = ? AND id_operador = ? AND lease_owner = ?
+        """,
+        (_now(), job["pais"], job["id_operador"], worker_id),
+    )
+
+
+def _entity_result(conn: sqlite3.Connection, entity_key: str) -> dict | None:
+    row = conn.execute(
+        "SELECT resultado FROM jobs WHERE entity_key = ? AND estado = 'ok' LIMIT 1", (entity_key,)
+    ).fetchone()
+    return json.loads(row["resultado"]) if row else None
+
+
+def run_worker(
+    worker_id: str | None = None,
+    db_path: Path | None = None,
+    lease_seconds: int = LEASE_SECONDS,
+    rate_share: int = 1,
+) -> int:
+    """
+    Procesa trabajos hasta vaciar la cola. Devuelve cuantos completo.
+
+    `rate_share`: workers que comparten la tasa por host de enrich.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    if rate_share > 1:
+        enrich.RATE_CONTROLLER = enrich.RATE_CONTROLLER.share(rate_share)
+    conn = connect(db_path)
+    completed = 0
+    while True:
+        job = lease(conn, worker_id, lease_seconds=lease_seconds)
+        if job is None:
+            break
+        print(f"[{worker_id}] {job['pais']} - {job['operador']} (intento {job['intentos'] + 1})")
+        try:
+            # Una consulta por entidad resuelta y pais: otro worker pudo haberla hecho ya.
+            result = _entity_result(conn, job["entity_key"])
+            if result is None:
+                query_name, whois = enrich.lookup_operator(job["operador"], pais=job["pais"])
+                result = {
+                    "whois_query_name": query_name,
+                    **{field: whois.get(field, "") for field in enrich.WHOIS_FIELDS},
+                }
+            if complete(conn, job, worker_id, result):
+                completed += 1
+            else:
+                print(f"[{worker_id}]   Lease vencido; resultado descartado")
+        except rate_control.Throttled as exc:
+            # Throttling no consume intentos: el trabajo vuelve a la cola.
+            print(f"[{worker_id}]   Throttling ({exc}); re-encolado")
+            release(conn, job, worker_id)
+            if isinstance(exc, rate_control.CircuitOpen):
+                time.sleep(exc.retry_after)
+        except Exception as exc:
+            print(f"[{worker_id}]   Error: {exc}")
+            fail(conn, job, worker_id, f"{type(exc).__name__}: {exc}")
+    conn.close()
+    print(f"[{worker_id}] Sin trabajos pendientes ({completed} completados)")
+    return completed
+
+
+def _worker_process(worker_id: str, db_path: Path | None, rate_share: int) -> None:
+    metrics.start_worker_reporter(worker_id)
+    try:
+        run_worker(worker_id=worker_id, db_path=db_path, rate_share=rate_share)
+    finally:
+        # Los procesos hijos no corren atexit: el textfile final se escribe aqui.
+        metrics.stop_reporter()
+
+
+def _finished(status: dict[str, int]) -> int:
+    return status.get("ok", 0) + status.get("error", 0)
+
+
+def start_workers(num_workers: int, db_path: Path | None = None, rate_share: int | None = None) -> None:
+    """
+    Lanza `num_workers` procesos locales (1/`rate_share` de la tasa cada uno) y espera.
+
+    Mientras tanto la etapa `whois` del padre avanza con los trabajos
+    terminados de la cola.
+    """
+    rate_share = rate_share or num_workers
+    processes = [
+        Process(
+            target=_worker_process,
+            kwargs={"worker_id": f"{socket.gethostname()}-w{idx}", "db_path": db_path, "rate_share": rate_share},
+        )
+        for idx in range(num_workers)
+    ]
+    status = queue_status(db_path)
+    with metrics.stage(
+        "whois", total=sum(status.values()), unit="operadores", initial=_finished(status)
+    ) as progress:
+        for process in processes:
+            process.start()
+        for process in processes:
+            while process.is_alive():
+                process.join(timeout=PROGRESS_POLL_SECONDS)
+                progress.advance(_finished(queue_status(db_path)) - progress.done)
+
+
+def queue_status(db_path: Path | None = None) -> dict[str, int]:
+    conn = connect(db_path)
+    rows = conn.execute("SELECT estado, COUNT(*) AS n FROM jobs GROUP BY estado").fetchall()
+    conn.close()
+    return {row["estado"]: row["n"] for row in rows}
+
+
+def collect(candidates: pd.DataFrame, db_path: Path | None = None) -> pd.DataFrame:
+    """Resultados `ok` unidos a los candidatos con el esquema de salida de enrich."""
+    conn = connect(db_path)
+    rows = conn.execute("SELECT pais, id_operador, resultado FROM jobs WHERE estado = 'ok'").fetchall()
+    conn.close()
+    results = {(row["pais"], row["id_operador"]): json.loads(row["resultado"]) for row in rows}
+    return enrich.merge_whois_results(candidates, results)
+
+
+def run(
+    num_workers: int = 2,
+    only_icp: bool = True,
+    min_max_accesos: int = 1000,
+    max_max_accesos: int = 100000,
+    df_icp: pd.DataFrame | None = None,
+    background_writes: bool = False,
+    db_path: Path | None = None,
+    run_id: str | None = None,
+) -> pd.DataFrame:
+    """Publica, procesa con `num_workers` procesos locales y guarda la salida de enrich."""
+    candidates = enrich.load_icp_candidates(
+        only_icp=only_icp,
+        min_max_accesos=min_max_accesos,
+        max_max_accesos=max_max_accesos,
+        df_icp=df_icp,
+    )
+    if candidates.empty:
+        print("No hay operadores para enriquecer con los filtros actuales.")
+        return pd.DataFrame()
+
+    print(f"Cola WHOIS: {publish(candidates, db_path, run_id=run_id)} trabajos nuevos o re-encolados")
+    start_workers(num_workers, db_path=db_path)
+    print(f"Cola WHOIS: {queue_status(db_path)}")
+
+    enriched = collect(candidates, db_path)
+    if len(enriched) < len(candidates):
+        print(f"Salida parcial: {len(enriched)}/{len(candidates)} operadores enriquecidos.")
+    output_path = config.PROCESSED_DATA_DIR / config.OUTPUT_WHOIS_FILENAME
+    artifacts.persist_csv(enriched, output_path, background=background_writes)
+    print(f"WHOIS enriquecido guardado: {output_path}")
+    return enriched
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cola SQLite para enriquecimiento WHOIS con varios workers.")
+    parser.add_argument("accion", choices=["publish", "worker", "collect", "status", "run"])
+    parser.add_argument("--workers", type=int, default=1, help="Procesos worker a lanzar en esta maquina.")
+    parser.add_argument("--db", type=Path, default=None, help="Archivo SQLite de la cola (compartido entre contenedores).")
+    parser.add_argument("--reset", action="store_true", help="Vacia la cola antes de publicar.")
+    parser.add_argument(
+        "--corrida", default=None, help="Id de corrida; uno distinto al guardado re-encola todos los trabajos terminados."
+    )
+    parser.add_argument(
+        "--rate-share", type=int, default=None, help="Workers totales que comparten la tasa por host (default: --workers)."
+    )
+    parser.add_argument("--min-max-accesos", type=int, default=1000, help="Minimo de max_accesos_2024_2025.")
+    parser.add_argument("--max-max-accesos", type=int, default=100000, help="Maximo de max_accesos_2024_2025.")
+    args = parser.parse_args()
+
+    if args.accion == "run":
+        run(
+            num_workers=args.workers,
+            min_max_accesos=args.min_max_accesos,
+            max_max_accesos=args.max_max_accesos,
+            db_path=args.db,
+            run_id=args.corrida,
+        )
+    elif args.accion in {"publish", "collect"}:
+        icp_candidates = enrich.load_icp_candidates(
+            min_max_accesos=args.min_max_accesos, max_max_accesos=args.max_max_accesos
+        )
+        if args.accion == "publish":
+            published = publish(icp_candidates, args.db, reset=args.reset, run_id=args.corrida)
+            print(f"Cola WHOIS: {published} trabajos nuevos o re-encolados")
+        else:
+            output = collect(icp_candidates, args.db)
+            output_path = config.PROCESSED_DATA_DIR / config.OUTPUT_WHOIS_FILENAME
+            artifacts.persist_csv(output, output_path)
+            print(f"WHOIS enriquecido guardado: {output_path} ({len(output)}/{len(icp_candidates)} operadores)")
+    elif args.accion == "worker":
+        if args.workers > 1:
+            start_workers(args.workers, db_path=args.db, rate_share=args.rate_share)
+        else:
+            _worker_process(f"{socket.gethostname()}-{os.getpid()}", args.db, args.rate_share or 1)
+    else:
+        print(queue_status(args.db))
@@ -0,0 +1,168 @@
+"""
+Lectura incremental de paginas WHOIS con corte temprano.
+
+En lugar de descargar todo el HTML y correr una regex DOTALL sobre el
+documento, se consumen chunks y se cierra la conexion apenas aparece:
+- el primer enlace `/AS\\d+` (pagina de busqueda), o
+- el `</pre>` que cierra el bloque `<div id="whois"><pre>` (pagina ASN).
+
+Incluye una medicion de bytes y CPU ahorrados contra paginas fixture locales
+(docs/whois_fixtures: paginas sinteticas con la estructura de bgp.he.net):
+    python scripts/whois_stream.py [--fixtures DIR]
+"""
+from __future__ import annotations
+
+import codecs
+from pathlib import Path
+import re
+import sys
+import time
+from typing import Iterable, Iterator
+
+import pandas as pd
+import requests
+
+sys.path.append(str(Path(__file__).parent.parent))
+import config
+
+
+CHUNK_SIZE = 8192
+# Cola de texto que se re-escanea entre chunks para no perder un match partido.
+_OVERLAP = 256
+FIXTURES_DIR = Path(__file__).parent.parent / "docs" / "whois_fixtures"
+
+AS_LINK_RE = re.compile(r'href="/(AS\d+)"')
+WHOIS_DIV_RE = re.compile(r'<div[^>]*id="whois"[^>]*>', flags=re.IGNORECASE)
+WHOIS_PRE_RE = re.compile(r"<pre[^>]*>(.*?)</pre>", flags=re.DOTALL | re.IGNORECASE)
+PRE_CLOSE_RE = re.compile(r"</pre>", flags=re.IGNORECASE)
+TAG_RE = re.compile(r"<[^>]+>")
+# Patron original (documento completo), usado como referencia en la medicion.
+WHOIS_FULL_RE = re.compile(
+    r'<div[^>]*id="whois"[^>]*>.*?<pre[^>]*>(.*?)</pre>', flags=re.DOTALL | re.IGNORECASE
+)
+
+
+def scan_as_link(chunks: Iterable[bytes]) -> tuple[str | None, int]:
+    """Primer ASN enlazado en la pagina de busqueda y bytes consumidos."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    tail = ""
+    bytes_read = 0
+    for chunk in chunks:
+        bytes_read += len(chunk)
+        text = tail + decoder.decode(chunk)
+        match = AS_LINK_RE.search(text)
+        if match:
+            return match.group(1), bytes_read
+        tail = text[-_OVERLAP:]
+    return None, bytes_read
+
+
+def scan_whois_pre(chunks: Iterable[bytes]) -> tuple[str | None, int]:
+    """Contenido del `<pre>` dentro de `div#whois` y bytes consumidos."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    text = ""
+    in_div = False
+    bytes_read = 0
+    for chunk in chunks:
+        bytes_read += len(chunk)
+        start = max(0, len(text) - _OVERLAP)
+        text += decoder.decode(chunk)
+        if not in_div:
+            div = WHOIS_DIV_RE.search(text, start)
+            if not div:
+                text = text[-_OVERLAP:]
+                continue
+            text = text[div.end():]
+            in_div = True
+            start = 0
+        # Solo se corre la regex del bloque cuando ya llego el cierre.
+        if PRE_CLOSE_RE.search(text, start):
+            match = WHOIS_PRE_RE.search(text)
+            if match:
+                return match.group(1), bytes_read
+    return None, bytes_read
+
+
+def strip_tags(html_fragment: str) -> str:
+    return TAG_RE.sub("", html_fragment)
+
+
+def fetch_streamed(url: str, scanner, headers: dict | None = None, timeout: int = 30):
+    """GET en modo stream; el `with` cierra la conexion al salir del scanner."""
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        return scanner(response.iter_content(chunk_size=CHUNK_SIZE))
+
+
+def _iter_chunks(content: bytes, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    for start in range(0, len(content), chunk_size):
+        yield content[start : start + chunk_size]
+
+
+def measure_fixtures(fixtures_dir: Path = FIXTURES_DIR, repeat: int = 50) -> pd.DataFrame:
+    """
+    Compara lectura completa vs streaming sobre paginas HTML locales.
+
+    Convencion de nombres: `search_*.html` (pagina de busqueda) y
+    `asn_*.html` (pagina WHOIS de un ASN).
+    """
+    rows = []
+    for path in sorted(fixtures_dir.glob("*.htm*")):
+        content = path.read_bytes()
+        if path.name.startswith("search"):
+            tipo, scanner = "search", scan_as_link
+
+            def full_parse(data: bytes):
+                match = AS_LINK_RE.search(data.decode("utf-8", errors="replace"))
+                return match.group(1) if match else None
+        elif path.name.startswith("asn"):
+            tipo, scanner = "whois", scan_whois_pre
+
+            def full_parse(data: bytes):
+                match = WHOIS_FULL_RE.search(data.decode("utf-8", errors="replace"))
+                return match.group(1) if match else None
+        else:
+            continue
+
+        started = time.process_time()
+        for _ in range(repeat):
+            expected = full_parse(content)
+        cpu_full = (time.process_time() - started) / repeat
+
+        started = time.process_time()
+        for _ in range(repeat):
+            found, bytes_read = scanner(_iter_chunks(content))
+        cpu_stream = (time.process_time() - started) / repeat
+
+        rows.append(
+            {
+                "archivo": path.name,
+                "tipo": tipo,
+                "coincide": found == expected,
+                "bytes_total": len(content),
+                "bytes_leidos": bytes_read,
+                "bytes_ahorrados": len(content) - bytes_read,
+                "cpu_full_ms": round(cpu_full * 1000, 4),
+                "cpu_stream_ms": round(cpu_stream * 1000, 4),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mide bytes/CPU ahorrados por el parseo streaming WHOIS.")
+    parser.add_argument("--fixtures", type=Path, default=FIXTURES_DIR, help="Carpeta con search_*.html y asn_*.html.")
+    parser.add_argument("--repeat", type=int, default=50, help="Repeticiones por archivo para medir CPU.")
+    args = parser.parse_args()
+
+    report = measure_fixtures(args.fixtures, repeat=args.repeat)
+    if report.empty:
+        print(f"No hay fixtures en {args.fixtures}")
+    else:
+        print(report.to_string(index=False))
+        print(
+            f"\nPromedio por operador: {report['bytes_ahorrados'].mean():,.0f} bytes ahorrados, "
+            f"CPU {report['cpu_full_ms'].mean():.3f} ms -> {report['cpu_stream_ms'].mean():.3f} ms"
+        )